@@ -1,3 +1,6 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI, Depends
 from fastapi.exceptions import RequestValidationError
 from pydantic import ValidationError
@@ -5,10 +8,47 @@ from pymongo.errors import DuplicateKeyError, OperationFailure
 from starlette.responses import JSONResponse
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY, HTTP_409_CONFLICT
 
+from config.config import get_client, close_client, SETTINGS
+from database.outbox import OutboxRepository
+from database.register_object_type_repository import MongoRegisterTypeRepository
+from database.register_type_registry import TYPE_REGISTRY
+from database.webhook_dispatcher import create_webhook_dispatcher
+from library.cache import CACHE_BACKEND
+from library.metrics import MetricsMiddleware, metrics_response
+from routes.admin import router as admin_router
 from routes.register_object import router as register_router
 from routes.register_object_type import router as register_object_type_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_client()
+    await MongoRegisterTypeRepository().ensure_indexes()
+    background_tasks = []
+    if SETTINGS.TYPE_REGISTRY_WATCH_CHANGES:
+        background_tasks.append(asyncio.create_task(TYPE_REGISTRY.watch_changes()))
+    if CACHE_BACKEND.shared:
+        background_tasks.append(asyncio.create_task(TYPE_REGISTRY.listen_invalidations()))
+    if SETTINGS.OUTBOX_ENABLED:
+        await OutboxRepository().ensure_indexes()
+        if SETTINGS.OUTBOX_DISPATCH_IN_APP and SETTINGS.WEBHOOK_SUBSCRIBERS:
+            background_tasks.append(asyncio.create_task(create_webhook_dispatcher().run()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await CACHE_BACKEND.close()
+    close_client()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
 
 app.include_router(
     register_object_type_router,
@@ -22,6 +62,12 @@ app.include_router(
     prefix="/register",
 )
 
+app.include_router(
+    admin_router,
+    tags=["Администрирование"],
+    prefix="/admin",
+)
+
 
 @app.exception_handler(ValidationError)
 async def validation_error_exception_handler(request, exc: ValidationError):
@@ -0,0 +1,300 @@
+"""
+Нагрузочный тест API реестра: создание, чтение, список, обновление и история объектов.
+Запросы выполняются в процессе через ASGI транспорт httpx, без сетевого стека HTTP,
+против MongoDB из настроек (DATABASE_URL) или mongomock (--mock, только нагрузка на CPU;
+сценарии, которые mongomock не поддерживает, пропускаются и перечисляются в meta.skipped).
+Результаты (p50/p99, запросы в секунду, выделения памяти на запрос) сохраняются в JSON
+для сравнения между коммитами (python -m benchmarks.compare). Запуск из каталога src:
+
+    python -m benchmarks.bench_api [--mock] [--objects 10000] [--history 1000] [--history-objects 10]
+                                   [--requests 1000] [--concurrency 10] [--output results.json]
+
+Перед запуском коллекция типа бенчмарка удаляется и заполняется заново.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta, UTC
+
+import httpx
+from bson import ObjectId
+from pymongo import UpdateOne
+
+import config.config as config
+from config.config import SETTINGS
+from database.mongo_repository import MongoDataBaseRepository
+from database.register_object_type_repository import history_collection_name, unique_index_spec, \
+    collection_collation, HISTORY_INDEX_SPEC, EMBEDDED_HISTORY_INDEX_SPEC
+from database.register_type_registry import REGISTER_TYPE_COLLECTION, TYPE_REGISTRY
+from models.register_object_type import RegisterObjectTypeModel
+
+SLUG = "bench_api"
+SEED_BATCH_SIZE = 10000
+ALLOCATION_SAMPLE_REQUESTS = 100
+
+BENCH_TYPE = RegisterObjectTypeModel(
+    name="Benchmark objects",
+    description="Объекты нагрузочного теста",
+    slug=SLUG,
+    notify_fields=["string_field"],
+    unique_fields=["int_field"],
+    fields=[
+        {"name": "int_field", "type": "int"},
+        {"name": "float_field", "type": "float"},
+        {"name": "string_field", "type": "str"},
+        {"name": "bool_field", "type": "bool"},
+        {"name": "list_of_str_field", "type": "list_of_str"},
+    ],
+)
+
+
+def object_data(index: int) -> dict:
+    return {"int_field": index, "float_field": index / 3, "string_field": f"object {index}",
+            "bool_field": index % 2 == 0, "list_of_str_field": ["a", "b", "c"]}
+
+
+def history_record(index: int, version: int, history_datetime: datetime) -> dict:
+    return {"history_id": ObjectId(), "history_datetime": history_datetime, "notify_fields": ["string_field"],
+            "is_deactivated": False, **object_data(index), "float_field": float(version)}
+
+
+async def seed(objects: int, history: int, history_objects: int, validate: bool = True) -> list[ObjectId]:
+    """
+    Создание типа бенчмарка и заполнение коллекции объектами.
+    У первых history_objects объектов создается history исторических записей.
+    Без validate коллекции создаются без схемы валидации и collation
+    Returns:
+        идентификаторы объектов в порядке создания
+    """
+    repository = MongoDataBaseRepository()
+    db = repository.db
+    await db[SLUG].drop()
+    await db[history_collection_name(SLUG)].drop()
+    await db[REGISTER_TYPE_COLLECTION].delete_many({"slug": SLUG})
+
+    await db[REGISTER_TYPE_COLLECTION].insert_one(BENCH_TYPE.model_dump(exclude={"id"}))
+    if validate:
+        await repository.create_collection(SLUG, BENCH_TYPE.fields_json_schema(),
+                                           [(EMBEDDED_HISTORY_INDEX_SPEC, True)], collation=collection_collation())
+        await repository.create_collection(history_collection_name(SLUG), None, [(HISTORY_INDEX_SPEC, False)])
+    else:
+        # mongomock не поддерживает параметры создания коллекций, коллекции создаются вместе с индексами
+        await repository.create_index(SLUG, list(EMBEDDED_HISTORY_INDEX_SPEC), unique=True)
+        await repository.create_index(history_collection_name(SLUG), list(HISTORY_INDEX_SPEC))
+    await repository.create_index(SLUG, unique_index_spec(BENCH_TYPE.unique_fields), unique=True)
+    TYPE_REGISTRY.invalidate(SLUG)
+    TYPE_REGISTRY.add_slug(SLUG)
+
+    history_in_collection = SETTINGS.HISTORY_STORAGE == 'collection'
+    started = datetime.now(UTC) - timedelta(days=1)
+    object_ids = []
+    for batch_start in range(0, objects, SEED_BATCH_SIZE):
+        documents, history_documents = [], []
+        for index in range(batch_start, min(objects, batch_start + SEED_BATCH_SIZE)):
+            record = history_record(index, 0, started)
+            documents.append({"_id": ObjectId(), "notify_fields": ["string_field"], "is_deactivated": False,
+                              **object_data(index), "history": [] if history_in_collection else [record]})
+            if history_in_collection:
+                history_documents.append(history_document(record, documents[-1]["_id"]))
+        await repository.insert_many(SLUG, documents, ordered=False)
+        if history_documents:
+            await repository.insert_many(history_collection_name(SLUG), history_documents, ordered=False)
+        object_ids.extend(document["_id"] for document in documents)
+
+    for index, object_id in enumerate(object_ids[:history_objects]):
+        for batch_start in range(1, history, SEED_BATCH_SIZE):
+            records = [history_record(index, version, started + timedelta(seconds=version))
+                       for version in range(batch_start, min(history, batch_start + SEED_BATCH_SIZE))]
+            if history_in_collection:
+                await repository.insert_many(history_collection_name(SLUG),
+                                             [history_document(record, object_id) for record in records])
+            else:
+                await repository.bulk_write(SLUG, [UpdateOne({"_id": object_id},
+                                                             {"$push": {"history": {"$each": records}}})])
+    return object_ids
+
+
+def history_document(record: dict, object_id: ObjectId) -> dict:
+    document = {key: value for key, value in record.items() if key != "history_id"}
+    return {**document, "_id": record["history_id"], "object_id": object_id}
+
+
+def percentile(sorted_timings: list[float], fraction: float) -> float:
+    return sorted_timings[min(len(sorted_timings) - 1, int(len(sorted_timings) * fraction))]
+
+
+async def run_requests(client: httpx.AsyncClient, make_request, requests: int,
+                       concurrency: int) -> tuple[list[float], int, float]:
+    """
+    Выполнение requests запросов в concurrency параллельных потоков
+    Исключение при выполнении запроса (ASGI транспорт передает исключения приложения) считается ошибкой
+    Returns:
+        задержки запросов в мс, количество ошибочных ответов и общее время в секундах
+    """
+    timings, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for request_index in counter:
+            started = time.perf_counter()
+            try:
+                response = await make_request(client, request_index)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            timings.append((time.perf_counter() - started) * 1000)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return timings, errors, time.perf_counter() - started
+
+
+async def measure_allocations(client: httpx.AsyncClient, make_request, offset: int) -> dict[str, float]:
+    """Выделения памяти на запрос по последовательной выборке запросов под tracemalloc"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    allocated = 0
+    for request_index in range(offset, offset + ALLOCATION_SAMPLE_REQUESTS):
+        snapshot_before = tracemalloc.take_snapshot()
+        try:
+            await make_request(client, request_index)
+        except Exception:
+            pass
+        snapshot_after = tracemalloc.take_snapshot()
+        allocated += sum(stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename")
+                         if stat.size_diff > 0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"alloc_per_request_kib": allocated / ALLOCATION_SAMPLE_REQUESTS / 1024,
+            "alloc_peak_kib": (peak - baseline) / 1024}
+
+
+def scenarios(object_ids: list[ObjectId], objects: int, history_objects: int) -> dict:
+    base = f"/register/{SLUG}"
+    list_cursors: list[str | None] = [None]
+
+    async def create(client, request_index):
+        return await client.post(f"{base}/", json=object_data(objects + request_index))
+
+    async def read(client, request_index):
+        return await client.get(f"{base}/{random.choice(object_ids)}")
+
+    async def read_cached(client, request_index):
+        return await client.get(f"{base}/{object_ids[0]}")
+
+    async def list_page(client, request_index):
+        params = {"limit": 100}
+        cursor = list_cursors[-1]
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get(f"{base}/", params=params)
+        list_cursors.append(response.json().get("next_cursor") if response.status_code == 200 else None)
+        return response
+
+    async def patch(client, request_index):
+        return await client.patch(f"{base}/{random.choice(object_ids[history_objects:] or object_ids)}",
+                                  json={"float_field": float(request_index)})
+
+    async def history_page(client, request_index):
+        object_id = object_ids[request_index % max(history_objects, 1)]
+        return await client.get(f"{base}/{object_id}/history/", params={"limit": 100})
+
+    return {"create": create, "read": read, "read_cached": read_cached, "list": list_page, "patch": patch,
+            "history": history_page}
+
+
+def mock_unsupported_scenarios() -> dict[str, str]:
+    """Сценарии, которые не выполняются против mongomock, и причины"""
+    unsupported = {"patch": "mongomock does not support updates with an aggregation pipeline"}
+    if SETTINGS.HISTORY_STORAGE == 'collection':
+        for name in ("create", "patch"):
+            unsupported[name] = "mongomock does not support sessions required for history collection writes"
+    return unsupported
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    from app import app
+
+    object_ids = await seed(args.objects, args.history, args.history_objects, validate=not args.mock)
+    results = {}
+    skipped = mock_unsupported_scenarios() if args.mock else {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, make_request in scenarios(object_ids, args.objects, args.history_objects).items():
+            if args.scenario and name not in args.scenario:
+                continue
+            if name in skipped:
+                print(f"{name:<12}skipped: {skipped[name]}")
+                continue
+            timings, errors, elapsed = await run_requests(client, make_request, args.requests, args.concurrency)
+            timings.sort()
+            results[name] = {
+                "requests": len(timings),
+                "errors": errors,
+                "rps": len(timings) / elapsed,
+                "mean_ms": statistics.fmean(timings),
+                "p50_ms": percentile(timings, 0.5),
+                "p99_ms": percentile(timings, 0.99),
+                **await measure_allocations(client, make_request, offset=args.requests),
+            }
+            print(f"{name:<12}" + "  ".join(f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                                            for key, value in results[name].items()))
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "mock": args.mock,
+            "history_storage": SETTINGS.HISTORY_STORAGE,
+            "objects": args.objects,
+            "history": args.history,
+            "history_objects": args.history_objects,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "skipped": skipped,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Register API load benchmark")
+    parser.add_argument("--mock", action="store_true", help="use mongomock instead of DATABASE_URL")
+    parser.add_argument("--objects", type=int, default=10000, help="objects in the benchmark collection")
+    parser.add_argument("--history", type=int, default=1000, help="history records of objects with history")
+    parser.add_argument("--history-objects", type=int, default=10, help="objects with long history")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent requests")
+    parser.add_argument("--scenario", action="append", default=[],
+                        help="scenario to run: create, read, read_cached, list, patch, history (default: all)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for request targets")
+    parser.add_argument("--output", help="JSON file for results")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+        config.set_client(AsyncMongoMockClient())
+    SETTINGS.DATABASE_NAME = SETTINGS.DATABASE_NAME or "benchmarks"
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
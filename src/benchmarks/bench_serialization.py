@@ -0,0 +1,67 @@
+"""
+Сравнение сериализации списка объектов реестра: путь через модели Pydantic и response_model
+(model_validate -> model_dump -> валидация и сериализация FastAPI -> json.dumps)
+и прямая сериализация документов MongoDB в JSON.
+Не требует БД, запуск из каталога src:
+
+    python -m benchmarks.bench_serialization [--sizes 100 1000 10000] [--repeat 5]
+"""
+import argparse
+import json
+import time
+from datetime import datetime, UTC
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from library.serialization import dumps, document_to_response
+from models.register_object import RegisterObjectModel
+from schemas.pagination import Page
+from schemas.register_object import RegisterObjectNoHistorySchema
+
+
+def make_documents(count: int) -> list[dict]:
+    return [{
+        "_id": ObjectId(),
+        "notify_fields": ["string_field", "int_field"],
+        "is_deactivated": False,
+        "int_field": index,
+        "float_field": index / 3,
+        "string_field": f"object {index}",
+        "bool_field": index % 2 == 0,
+        "list_of_str_field": ["a", "b", "c"],
+        "created": datetime.now(UTC),
+    } for index in range(count)]
+
+
+def model_path(documents: list[dict], adapter: TypeAdapter) -> bytes:
+    items = [RegisterObjectModel.model_validate(document).model_dump() for document in documents]
+    page = adapter.validate_python({"items": items, "next_cursor": None})
+    return json.dumps(adapter.dump_python(page, mode="json")).encode()
+
+
+def raw_path(documents: list[dict]) -> bytes:
+    return dumps({"items": [document_to_response(document) for document in documents], "next_cursor": None})
+
+
+def best_of(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List serialization benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(Page[RegisterObjectNoHistorySchema])
+    for size in args.sizes:
+        documents = make_documents(size)
+        model_ms = best_of(lambda: model_path(documents, adapter), args.repeat)
+        raw_ms = best_of(lambda: raw_path(documents), args.repeat)
+        print(f"{size:>7} objects: pydantic {model_ms:9.2f} ms  raw {raw_ms:9.2f} ms  x{model_ms / raw_ms:.1f}")
@@ -0,0 +1,78 @@
+"""
+Сравнение задержки путей записи: запись с повторным чтением документа и запись за один запрос.
+Запуск из каталога src против MongoDB из настроек (DATABASE_URL) или mongomock (--mock):
+
+    python -m benchmarks.bench_write_paths [--mock] [--iterations 1000]
+
+mongomock не имеет сетевой задержки, поэтому выигрыш от сокращения числа запросов
+виден только при запуске против mongod.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from pymongo import ReturnDocument
+
+import config.config as config
+from config.config import SETTINGS
+
+COLLECTION_NAME = "bench_write_paths"
+
+
+async def measure(operation, iterations: int) -> dict[str, float]:
+    timings = []
+    for iteration in range(iterations):
+        started = time.perf_counter()
+        await operation(iteration)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {"mean_ms": statistics.fmean(timings),
+            "p50_ms": timings[len(timings) // 2],
+            "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))]}
+
+
+async def run(iterations: int):
+    collection = config.get_db()[COLLECTION_NAME]
+    await collection.drop()
+
+    async def insert_and_read(iteration):
+        result = await collection.insert_one({"value": iteration, "history": []})
+        await collection.find_one({"_id": result.inserted_id}, {"history": 0})
+
+    async def insert_only(iteration):
+        document = {"value": iteration, "history": []}
+        result = await collection.insert_one(document)
+        return {**document, "_id": result.inserted_id}
+
+    async def update_and_read(iteration):
+        await collection.update_one({"value": iteration}, {"$set": {"updated": True}})
+        await collection.find_one({"value": iteration})
+
+    async def find_one_and_update(iteration):
+        await collection.find_one_and_update({"value": iteration}, {"$set": {"updated": True}},
+                                             return_document=ReturnDocument.AFTER)
+
+    await collection.create_index("value")
+    results = {
+        "insert + find_one": await measure(insert_and_read, iterations),
+        "insert_one": await measure(insert_only, iterations),
+        "update_one + find_one": await measure(update_and_read, iterations),
+        "find_one_and_update": await measure(find_one_and_update, iterations),
+    }
+    await collection.drop()
+
+    for name, timings in results.items():
+        print(f"{name:<24}" + "  ".join(f"{key}={value:.3f}" for key, value in timings.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write path latency benchmark")
+    parser.add_argument("--mock", action="store_true", help="use mongomock instead of DATABASE_URL")
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+        config.set_client(AsyncMongoMockClient())
+    SETTINGS.DATABASE_NAME = SETTINGS.DATABASE_NAME or "benchmarks"
+    asyncio.run(run(args.iterations))
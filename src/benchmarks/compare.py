@@ -0,0 +1,60 @@
+"""
+Сравнение двух результатов benchmarks.bench_api (например, базового коммита и ветки).
+Печатает изменение метрик сценариев в процентах и завершается с кодом 1,
+если p50, p99 или выделения памяти выросли (или rps упал) больше порога. Запуск из каталога src:
+
+    python -m benchmarks.compare base.json head.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+# Метрики, рост которых означает регрессию
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "alloc_per_request_kib")
+# Метрики, падение которых означает регрессию
+HIGHER_IS_BETTER = ("rps",)
+
+
+def change_percent(base: float, head: float) -> float:
+    return (head - base) / base * 100 if base else 0.0
+
+
+def compare(base: dict, head: dict, threshold: float) -> list[str]:
+    """
+    Печать таблицы сравнения сценариев, присутствующих в обоих результатах
+    Returns:
+        описания регрессий больше порога
+    """
+    regressions = []
+    print(f"{'scenario':<12}{'metric':<24}{'base':>12}{'head':>12}{'change':>10}")
+    for scenario, base_metrics in base["results"].items():
+        head_metrics = head["results"].get(scenario)
+        if head_metrics is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            change = change_percent(base_metrics[metric], head_metrics[metric])
+            regressed = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            print(f"{scenario:<12}{metric:<24}{base_metrics[metric]:>12.2f}{head_metrics[metric]:>12.2f}"
+                  f"{change:>+9.1f}%{' !' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{scenario} {metric} {change:+.1f}%")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare register API benchmark results")
+    parser.add_argument("base", help="baseline results JSON")
+    parser.add_argument("head", help="results JSON to compare with the baseline")
+    parser.add_argument("--threshold", type=float, default=10, help="regression threshold, percent")
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.head) as head_file:
+        base, head = json.load(base_file), json.load(head_file)
+    for key in ("mock", "history_storage", "objects", "history", "concurrency"):
+        if base["meta"].get(key) != head["meta"].get(key):
+            print(f"warning: {key} differs: {base['meta'].get(key)} != {head['meta'].get(key)}")
+
+    regressions = compare(base, head, args.threshold)
+    if regressions:
+        print("regressions: " + ", ".join(regressions))
+        sys.exit(1)
@@ -1,9 +1,21 @@
-from typing import Optional, AsyncGenerator
+from typing import Optional, AsyncGenerator, Literal
 
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 import models
+from library.metrics import POOL_CHECKOUT_LISTENER
+
+
+class WebhookSubscriber(BaseModel):
+    # Имя используется в путях полей записей outbox, поэтому ограничено буквами, цифрами, - и _
+    name: str = Field(pattern=r'^[A-Za-z0-9_-]+$')
+    url: str
+    # Типы реестра, изменения объектов которых доставляются подписчику. Без значения - все типы
+    slugs: Optional[list[str]] = None
+    # Количество одновременно доставляемых подписчику пачек в одном процессе доставки
+    concurrency: int = Field(4, ge=1)
 
 
 class Settings(BaseSettings):
@@ -11,6 +23,92 @@ class Settings(BaseSettings):
     DATABASE_URL: Optional[str] = None
     DATABASE_NAME: Optional[str] = None
 
+    # connection pool
+    MONGO_MAX_POOL_SIZE: int = 100
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_MAX_IDLE_TIME_MS: Optional[int] = None
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: Optional[int] = None
+    # Список компрессоров через запятую, например "zstd,zlib"
+    MONGO_COMPRESSORS: Optional[str] = None
+
+    # Хранение истории объектов: в массиве history документа (embedded)
+    # или в отдельной коллекции <slug>__history (collection)
+    HISTORY_STORAGE: Literal['embedded', 'collection'] = 'embedded'
+
+    # Максимальное количество объектов в одном запросе пакетной загрузки
+    BULK_MAX_ITEMS: int = 10000
+    # Потоковая загрузка NDJSON: размер пачки записи и количество одновременно записываемых пачек
+    IMPORT_BATCH_SIZE: int = 1000
+    IMPORT_CONCURRENCY: int = 4
+    # Максимальное количество ошибок строк в ответе потоковой загрузки, остальные только подсчитываются
+    IMPORT_MAX_ERRORS: int = 1000
+    # Максимальная длина строки NDJSON в байтах, более длинные строки отклоняются без накопления в памяти
+    IMPORT_MAX_LINE_BYTES: int = 1024 * 1024
+    # Размер пачки чтения существующих объектов при синхронизации
+    SYNC_BATCH_SIZE: int = 1000
+
+    # Collation коллекций новых типов реестра (и их уникальных индексов), например "ru".
+    # Без значения строки сравниваются побайтно
+    UNIQUE_INDEX_COLLATION_LOCALE: Optional[str] = None
+    # Уровень сравнения: 1, 2 - без учета регистра, 3 - с учетом регистра
+    UNIQUE_INDEX_COLLATION_STRENGTH: int = 3
+    # Срок, на который процесс построения вторичных индексов отмечает тип как строящийся.
+    # Отметка продлевается во время построения, после сбоя процесса она истекает
+    FIELD_INDEX_BUILD_LEASE_SECONDS: float = 60
+
+    # Ограничение времени выполнения подсчета и агрегации объектов на сервере БД
+    AGGREGATION_MAX_TIME_MS: int = 10000
+
+    # Профилирование медленных запросов: запросы дольше порога повторяются с explain,
+    # планы последних SLOW_QUERY_BUFFER_SIZE запросов доступны в /admin/slow_queries
+    SLOW_QUERY_PROFILING: bool = False
+    SLOW_QUERY_THRESHOLD_MS: float = 100
+    SLOW_QUERY_BUFFER_SIZE: int = 100
+
+    # Лента изменений объектов (/register/{slug}/_events, требуется replica set):
+    # количество последних событий для возобновления после переподключения,
+    # количество неотправленных событий, после которого отстающий клиент отключается,
+    # период отправки комментария для поддержания соединения
+    CHANGE_FEED_REPLAY_SIZE: int = 1000
+    CHANGE_FEED_QUEUE_SIZE: int = 1000
+    CHANGE_FEED_HEARTBEAT_SECONDS: float = 15
+
+    # Outbox уведомлений: изменения notify_fields объектов записываются в коллекцию outbox
+    # в одной транзакции с объектом (требуется replica set) и доставляются подписчикам webhook
+    OUTBOX_ENABLED: bool = False
+    # Подписчики в JSON: [{"name": "crm", "url": "https://...", "slugs": ["users"], "concurrency": 4}]
+    WEBHOOK_SUBSCRIBERS: list[WebhookSubscriber] = []
+    # Доставка в процессе приложения. Без нее доставка выполняется процессами dispatch_outbox.py
+    OUTBOX_DISPATCH_IN_APP: bool = True
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL_SECONDS: float = 1
+    # Время, на которое пачка закрепляется за процессом доставки (после сбоя процесса пачка доставляется повторно)
+    OUTBOX_LOCK_SECONDS: float = 60
+    # Повторы доставки с экспоненциальной задержкой, после OUTBOX_MAX_ATTEMPTS попыток запись помечается ошибочной
+    OUTBOX_MAX_ATTEMPTS: int = 10
+    OUTBOX_RETRY_BASE_SECONDS: float = 1
+    OUTBOX_RETRY_MAX_SECONDS: float = 300
+    # Записи, не доставленные части подписчиков, хранятся для разбора и удаляются TTL индексом через это время
+    OUTBOX_FAILED_RETENTION_SECONDS: int = 7 * 24 * 3600
+    WEBHOOK_TIMEOUT_SECONDS: float = 10
+
+    # Хранилище кэша ответов и метаданных типов: в памяти процесса (memory)
+    # или общее для всех процессов приложения (redis, требуется REDIS_URL)
+    CACHE_BACKEND: Literal['memory', 'redis'] = 'memory'
+    REDIS_URL: Optional[str] = None
+    CACHE_KEY_PREFIX: str = "fastapi_mongo:"
+
+    # Кэш ответов GET запросов объектов и типов
+    RESPONSE_CACHE_MAX_SIZE: int = 10000
+    RESPONSE_CACHE_TTL_SECONDS: float = 30
+
+    # Кэш метаданных типов реестра
+    TYPE_REGISTRY_TTL_SECONDS: float = 60
+    # Сброс кэша типов по change stream (требуется replica set)
+    TYPE_REGISTRY_WATCH_CHANGES: bool = False
+    # Период обновления кэша существующих коллекций типов
+    TYPE_SLUGS_REFRESH_SECONDS: float = 60
+
     # JWT
     secret_key: str = "secret"
     algorithm: str = "HS256"
@@ -22,17 +120,51 @@ class Settings(BaseSettings):
 
 SETTINGS = Settings()
 
+_mongo_client: AsyncIOMotorClient | None = None
+
+
+def _client_options() -> dict:
+    options = {
+        "maxPoolSize": SETTINGS.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": SETTINGS.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": SETTINGS.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": SETTINGS.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "compressors": SETTINGS.MONGO_COMPRESSORS,
+    }
+    options = {option: value for option, value in options.items() if value is not None}
+    # Время ожидания соединений из пула для метрик
+    options["event_listeners"] = [POOL_CHECKOUT_LISTENER]
+    return options
+
+
+def get_client() -> AsyncIOMotorClient:
+    """
+    Общий для процесса клиент MongoDB.
+    Создается при старте приложения (или при первом обращении) и переиспользуется всеми репозиториями
+    """
+    global _mongo_client
+    if _mongo_client is None:
+        _mongo_client = AsyncIOMotorClient(SETTINGS.DATABASE_URL, **_client_options())
+    return _mongo_client
+
+
+def set_client(client: AsyncIOMotorClient):
+    """Подмена общего клиента (например, mongomock для бенчмарков)"""
+    global _mongo_client
+    _mongo_client = client
+
+
+def close_client():
+    """Закрытие общего клиента MongoDB при остановке приложения"""
+    global _mongo_client
+    if _mongo_client is not None:
+        _mongo_client.close()
+        _mongo_client = None
+
 
 def get_db() -> AsyncIOMotorDatabase:
-    mongo_client = AsyncIOMotorClient(SETTINGS.DATABASE_URL)
-    mongo_db = mongo_client.get_database(SETTINGS.DATABASE_NAME)
-    return mongo_db
+    return get_client().get_database(SETTINGS.DATABASE_NAME)
 
 
 async def a_get_db() -> AsyncGenerator[AsyncIOMotorDatabase, None]:
-    mongo_client = AsyncIOMotorClient(SETTINGS.DATABASE_URL)
-    mongo_db = mongo_client[SETTINGS.DATABASE_NAME]
-    try:
-        yield mongo_db
-    finally:
-        mongo_client.close()
+    yield get_db()
@@ -0,0 +1,43 @@
+"""Тесты общего клиента MongoDB"""
+import pytest
+from fastapi import FastAPI, Depends
+from fastapi.testclient import TestClient
+
+from config.config import SETTINGS, get_client, close_client, a_get_db
+from database.mongo_repository import MongoDataBaseRepository
+
+
+@pytest.fixture
+def shared_client(monkeypatch):
+    # Клиент не подключается к серверу до первого запроса, поэтому сервер БД для тестов не нужен
+    monkeypatch.setattr(SETTINGS, "DATABASE_URL", "mongodb://localhost:27017")
+    monkeypatch.setattr(SETTINGS, "DATABASE_NAME", "config_test")
+    close_client()
+    yield
+    close_client()
+
+
+def test_repositories_reuse_client(shared_client):
+    """Репозитории и зависимость БД запросов используют один клиент"""
+    app = FastAPI()
+
+    @app.get("/client")
+    async def client_id(db=Depends(a_get_db)):
+        return id(db.client)
+
+    client = get_client()
+    assert MongoDataBaseRepository().db.client is client
+    assert MongoDataBaseRepository().db.client is client
+
+    test_client = TestClient(app)
+    assert test_client.get("/client").json() == id(client)
+    assert test_client.get("/client").json() == id(client)
+
+
+def test_close_client(shared_client):
+    """После закрытия общий клиент создается заново при следующем обращении"""
+    client = get_client()
+    close_client()
+    new_client = get_client()
+    assert new_client is not client
+    assert MongoDataBaseRepository().db.client is new_client
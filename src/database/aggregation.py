@@ -0,0 +1,57 @@
+import re
+
+from models.register_object_type import SupportedTypes
+from schemas.register_object import AggregateMetricSchema, METRIC_NAME_PATTERN
+
+NUMERIC_TYPES = {SupportedTypes.INT, SupportedTypes.FLOAT}
+COMPARABLE_TYPES = NUMERIC_TYPES | {SupportedTypes.STRING, SupportedTypes.DATETIME}
+GROUP_KEY = "key"
+
+
+def _metric_accumulator(metric: AggregateMetricSchema, field_types: dict[str, SupportedTypes]) -> dict:
+    if metric.op == "count":
+        return {"$sum": 1}
+    field_type = field_types.get(metric.field)
+    if field_type is None:
+        raise ValueError(f"Unknown aggregation field: {metric.field}")
+    allowed_types = NUMERIC_TYPES if metric.op in ("sum", "avg") else COMPARABLE_TYPES
+    if field_type not in allowed_types:
+        raise ValueError(f"Operation {metric.op} is not supported for field {metric.field}")
+    return {f"${metric.op}": f"${metric.field}"}
+
+
+def build_group_pipeline(query: dict, group_by: list[str], metrics: list[AggregateMetricSchema],
+                         field_types: dict[str, SupportedTypes], limit: int) -> list[dict]:
+    """
+    Строит конвейер агрегации: отбор по запросу, группировка по полям и вычисление метрик групп.
+    Без полей группировки все отобранные объекты составляют одну группу
+    Args:
+        query: запрос отбора объектов (результат build_filter)
+        group_by: поля группировки
+        metrics: вычисляемые для каждой группы метрики
+        field_types: допустимые поля и их типы
+        limit: максимальное количество групп в результате
+    Returns:
+        конвейер, возвращающий документы вида {"key": {поле группировки: значение}, метрика: значение}
+    """
+    for field_name in group_by:
+        if field_name not in field_types:
+            raise ValueError(f"Unknown group field: {field_name}")
+
+    accumulators = {}
+    for metric in metrics:
+        name = metric.output_name()
+        if name in accumulators or name == GROUP_KEY:
+            raise ValueError(f"Duplicate metric name: {name}")
+        # Имя по умолчанию содержит имя поля типа, которое может быть недопустимым именем поля $group
+        if not re.match(METRIC_NAME_PATTERN, name):
+            raise ValueError(f"Invalid metric name: {name}, set a name matching {METRIC_NAME_PATTERN}")
+        accumulators[name] = _metric_accumulator(metric, field_types)
+
+    return [
+        {"$match": query},
+        {"$group": {"_id": {field_name: f"${field_name}" for field_name in group_by}, **accumulators}},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, GROUP_KEY: "$_id", **{name: 1 for name in accumulators}}},
+    ]
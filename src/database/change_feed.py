@@ -0,0 +1,306 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from pymongo.errors import PyMongoError
+
+from config.config import SETTINGS
+from database.mongo_repository import MongoDataBaseRepository
+from database.register_type_registry import TYPE_REGISTRY
+from library.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# Не более стольких попыток подряд возобновить общий change stream после ошибки, затем лента закрывается
+MAX_RESUME_ATTEMPTS = 5
+
+# История не передается в событиях change stream: массив может быть большим.
+# Событие invalidate (удаление или переименование коллекции) завершает поток, возобновить его нельзя
+CHANGE_STREAM_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete", "invalidate"]}}},
+    {"$project": {"fullDocument.history": 0, "updateDescription.updatedFields.history": 0}},
+]
+
+
+class ChangeFeedLost(Exception):
+    """Подписчик не успевает получать события или позиция возобновления больше недоступна"""
+
+
+@dataclass(frozen=True)
+class ChangeFeedEvent:
+    # Resume token события change stream, по нему клиент возобновляет получение событий
+    id: str
+    operation: str
+    data: dict
+
+    def to_sse(self) -> bytes:
+        return f"id: {self.id}\nevent: {self.operation}\ndata: ".encode() + dumps(self.data) + b"\n\n"
+
+
+def change_to_event(change: dict, default_notify_fields: list[str]) -> ChangeFeedEvent | None:
+    """
+    Событие ленты из события change stream коллекции объектов.
+    Изменения объекта попадают в ленту, только если затрагивают его notify_fields
+    (notify_fields типа, если объект уже удален). Создание и удаление объектов попадают в ленту всегда
+    """
+    operation = change["operationType"]
+    document = change.get("fullDocument") or {}
+    notify_fields = document.get("notify_fields", default_notify_fields)
+    if operation == "update":
+        update_description = change.get("updateDescription", {})
+        changed = {field.split(".", 1)[0] for field in
+                   [*update_description.get("updatedFields", {}), *update_description.get("removedFields", [])]}
+        changed_fields = [field for field in notify_fields if field in changed]
+        if not changed_fields:
+            return None
+    elif operation == "delete":
+        changed_fields = []
+    else:
+        # При вставке и замене документа изменены все поля
+        changed_fields = [field for field in notify_fields if field in document]
+
+    data = {"id": change["documentKey"]["_id"], "operation": operation, "changed_fields": changed_fields,
+            "fields": {field: document.get(field) for field in changed_fields}}
+    if "clusterTime" in change:
+        data["cluster_time"] = change["clusterTime"].as_datetime()
+    return ChangeFeedEvent(id=change["_id"]["_data"], operation=operation, data=data)
+
+
+async def _feed_event(slug: str, change: dict) -> ChangeFeedEvent | None:
+    register_type = await TYPE_REGISTRY.get(slug)
+    return change_to_event(change, register_type.notify_fields if register_type else [])
+
+
+async def sse_chunks(events: AsyncIterator[ChangeFeedEvent], heartbeat: float) -> AsyncIterator[bytes]:
+    """
+    События ленты в формате server-sent events. Без событий раз в heartbeat секунд отправляется комментарий,
+    чтобы прокси не закрывали соединение. Потеря ленты передается событием error, после чего поток завершается
+    """
+    # Ожидание события не отменяется по таймауту: отмена закрыла бы итератор событий
+    next_event = asyncio.ensure_future(anext(events))
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=heartbeat)
+            if not done:
+                yield b": heartbeat\n\n"
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            except ChangeFeedLost as ex:
+                yield b"event: error\ndata: " + dumps({"detail": str(ex)}) + b"\n\n"
+                return
+            yield event.to_sse()
+            next_event = asyncio.ensure_future(anext(events))
+    finally:
+        next_event.cancel()
+        with suppress(asyncio.CancelledError, StopAsyncIteration, ChangeFeedLost):
+            await next_event
+
+
+class _Subscriber:
+    def __init__(self):
+        # Ошибка в очереди завершает подписку: подписчик отключен из-за отставания или лента закрыта
+        self.queue: asyncio.Queue[ChangeFeedEvent | ChangeFeedLost] = asyncio.Queue()
+
+
+class CollectionFeed:
+    """
+    Общий change stream коллекции объектов типа, события которого рассылаются всем подписчикам.
+    Последние события хранятся в буфере для возобновления подписки после переподключения клиента.
+    Лента закрывается, если поток инвалидирован или не возобновляется после MAX_RESUME_ATTEMPTS попыток
+    """
+
+    def __init__(self, slug: str, replay_size: int, queue_size: int):
+        self.slug = slug
+        self.queue_size = queue_size
+        self.subscribers: set[_Subscriber] = set()
+        self.replay: deque[ChangeFeedEvent] = deque(maxlen=replay_size)
+        self.started = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.error: ChangeFeedLost | None = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    @property
+    def closed(self) -> bool:
+        return self.task is not None and self.task.done()
+
+    async def _run(self):
+        try:
+            await self._watch()
+        except ChangeFeedLost as ex:
+            logger.warning("Change feed of %s is closed: %s", self.slug, ex)
+            self.close(ex)
+
+    async def _watch(self):
+        collection = MongoDataBaseRepository().db[self.slug]
+        resume_token = None
+        attempts = 0
+        while True:
+            try:
+                async with collection.watch(CHANGE_STREAM_PIPELINE, full_document='updateLookup',
+                                            resume_after=resume_token) as stream:
+                    resume_token = stream.resume_token
+                    self.started.set()
+                    async for change in stream:
+                        if change["operationType"] == "invalidate":
+                            break
+                        resume_token = stream.resume_token
+                        attempts = 0
+                        event = await _feed_event(self.slug, change)
+                        if event is not None:
+                            self.publish(event)
+                raise ChangeFeedLost(f"Change stream of {self.slug} is invalidated")
+            except PyMongoError as ex:
+                if not self.started.is_set():
+                    # Change stream недоступен (например, сервер без replica set)
+                    raise ChangeFeedLost(f"Change stream is not available: {ex}")
+                attempts += 1
+                if attempts > MAX_RESUME_ATTEMPTS:
+                    raise ChangeFeedLost(f"Change stream of {self.slug} cannot be resumed: {ex}")
+                logger.warning("Change stream of %s failed, resuming: %s", self.slug, ex)
+                await asyncio.sleep(1)
+
+    def close(self, error: ChangeFeedLost):
+        """Завершение подписок с ошибкой error"""
+        self.error = error
+        for subscriber in self.subscribers:
+            subscriber.queue.put_nowait(error)
+        self.subscribers.clear()
+
+    async def wait_started(self):
+        """Ожидание открытия change stream, чтобы подписчик не пропустил события сразу после подписки"""
+        started = asyncio.create_task(self.started.wait())
+        await asyncio.wait([started, self.task], return_when=asyncio.FIRST_COMPLETED)
+        started.cancel()
+        if self.error is not None:
+            raise self.error
+
+    def publish(self, event: ChangeFeedEvent):
+        self.replay.append(event)
+        for subscriber in list(self.subscribers):
+            if subscriber.queue.qsize() >= self.queue_size:
+                # Отстающий подписчик отключается и переподключается с позиции последнего полученного события
+                self.subscribers.discard(subscriber)
+                subscriber.queue.put_nowait(ChangeFeedLost("Subscriber is too slow, reconnect with Last-Event-ID"))
+            else:
+                subscriber.queue.put_nowait(event)
+
+    def has_event(self, event_id: str) -> bool:
+        return any(event.id == event_id for event in self.replay)
+
+    def subscribe(self, last_event_id: str | None) -> _Subscriber:
+        """Подписка на события после last_event_id из буфера (без него - на новые события)"""
+        subscriber = _Subscriber()
+        if last_event_id is not None:
+            event_ids = [event.id for event in self.replay]
+            for event in list(self.replay)[event_ids.index(last_event_id) + 1:]:
+                subscriber.queue.put_nowait(event)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+
+class ChangeFeedHub:
+    """
+    Ленты изменений объектов типов. На коллекцию открывается один change stream, пока у нее есть подписчики.
+    Клиент, позиция которого вытеснена из буфера ленты, догоняет ленту отдельным потоком с этой позиции
+    и переходит на общую ленту, когда отдельный поток доходит до ее событий
+    """
+
+    def __init__(self, replay_size: int, queue_size: int):
+        self.replay_size = replay_size
+        self.queue_size = queue_size
+        self._feeds: dict[str, CollectionFeed] = {}
+
+    def _feed(self, slug: str) -> CollectionFeed:
+        """Общая лента типа. Закрытая лента заменяется новой"""
+        feed = self._feeds.get(slug)
+        if feed is None or feed.closed:
+            feed = self._feeds[slug] = CollectionFeed(slug, self.replay_size, self.queue_size)
+            feed.start()
+        return feed
+
+    def _unsubscribe(self, feed: CollectionFeed, subscriber: _Subscriber):
+        feed.subscribers.discard(subscriber)
+        if not feed.subscribers and self._feeds.get(feed.slug) is feed:
+            del self._feeds[feed.slug]
+            feed.task.cancel()
+
+    async def events(self, slug: str, last_event_id: str | None = None) -> AsyncIterator[ChangeFeedEvent]:
+        """
+        События ленты типа после last_event_id до отмены итерации.
+        Raises:
+            ChangeFeedLost: подписчик не успевает получать события, позиция last_event_id недоступна
+                или лента закрыта
+        """
+        feed = self._feed(slug)
+        resumed = last_event_id is not None and not feed.has_event(last_event_id)
+        # При возобновлении отдельным потоком подписка на общую ленту оформляется до его открытия,
+        # чтобы события между позицией отдельного потока и общей лентой не были пропущены
+        subscriber = feed.subscribe(None if resumed else last_event_id)
+        try:
+            await feed.wait_started()
+            # Первое событие общей ленты, полученное, пока отдельный поток ее догоняет
+            pending = None
+            if resumed:
+                private_events = self._resumed_events(slug, last_event_id)
+                try:
+                    async for event, token in private_events:
+                        if event is not None:
+                            yield event
+                        if pending is None and not subscriber.queue.empty():
+                            pending = subscriber.queue.get_nowait()
+                        if isinstance(pending, ChangeFeedLost) or subscriber not in feed.subscribers:
+                            # Общая лента отключила подписчика, пока отдельный поток ее догонял: подписка повторяется
+                            self._unsubscribe(feed, subscriber)
+                            feed = self._feed(slug)
+                            subscriber = feed.subscribe(None)
+                            pending = None
+                            await feed.wait_started()
+                        elif pending is not None and pending.id <= token:
+                            # Resume token - шестнадцатеричная строка, порядок строк совпадает с порядком событий
+                            break
+                finally:
+                    await private_events.aclose()
+                # События общей ленты до позиции отдельного потока уже переданы клиенту
+                while isinstance(pending, ChangeFeedEvent) and pending.id <= token:
+                    pending = subscriber.queue.get_nowait() if not subscriber.queue.empty() else None
+
+            while True:
+                item = pending if pending is not None else await subscriber.queue.get()
+                pending = None
+                if isinstance(item, ChangeFeedLost):
+                    raise item
+                yield item
+        finally:
+            self._unsubscribe(feed, subscriber)
+
+    @staticmethod
+    async def _resumed_events(slug: str, last_event_id: str) -> AsyncIterator[tuple[ChangeFeedEvent | None, str]]:
+        """
+        События отдельного change stream, возобновленного с позиции last_event_id, и позиции потока после них.
+        Когда новых событий нет, возвращается None и текущая позиция потока
+        """
+        collection = MongoDataBaseRepository().db[slug]
+        try:
+            async with collection.watch(CHANGE_STREAM_PIPELINE, full_document='updateLookup',
+                                        resume_after={"_data": last_event_id}) as stream:
+                while stream.alive:
+                    change = await stream.try_next()
+                    if change is not None and change["operationType"] == "invalidate":
+                        break
+                    event = await _feed_event(slug, change) if change is not None else None
+                    yield event, stream.resume_token["_data"]
+        except PyMongoError as ex:
+            raise ChangeFeedLost(f"Cannot resume after {last_event_id}: {ex}")
+        raise ChangeFeedLost(f"Change stream of {slug} is invalidated")
+
+
+CHANGE_FEED_HUB = ChangeFeedHub(replay_size=SETTINGS.CHANGE_FEED_REPLAY_SIZE,
+                                queue_size=SETTINGS.CHANGE_FEED_QUEUE_SIZE)
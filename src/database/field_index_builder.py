@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, UTC
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from config.config import SETTINGS
+from database.mongo_repository import MongoDataBaseRepository
+from models.register_object_type import RegisterObjectTypeModel
+from schemas.register_object_type import FieldIndexStatusSchema
+
+logger = logging.getLogger(__name__)
+
+# Префикс имен вторичных индексов полей
+FIELD_INDEX_PREFIX = "field_"
+# Состояние построения индексов типов, общее для всех процессов приложения: _id - slug типа
+FIELD_INDEX_BUILDS_COLLECTION = 'field_index_builds'
+
+
+def field_index_name(field_name: str) -> str:
+    return f"{FIELD_INDEX_PREFIX}{field_name}"
+
+
+def field_index_names(register_type: RegisterObjectTypeModel) -> set[str]:
+    """
+    Имена индексов, которыми управляет построение индексов полей типа: по одному на каждое поле типа.
+    Индексы отбираются по точным именам, а не по префиксу: имена, созданные MongoDB по умолчанию,
+    например field_code_1 для поля field_code, тоже начинаются с FIELD_INDEX_PREFIX
+    """
+    return {field_index_name(field.name) for field in register_type.fields}
+
+
+def field_index_specs(register_type: RegisterObjectTypeModel) -> dict[str, tuple[list[tuple[str, int | str]], dict]]:
+    """Спецификации вторичных индексов полей типа: имя индекса -> (поля индекса, параметры создания)"""
+    return {field_index_name(field.name): ([(field.name, field.index.kind.direction())], field.index.options())
+            for field in register_type.fields if field.index is not None}
+
+
+def _same_index(index: dict, keys: list[tuple[str, int | str]], options: dict) -> bool:
+    """Соответствие существующего индекса (из index_information) спецификации"""
+    index_keys = [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+                  for field, direction in index["key"]]
+    index_options = {option: index[option] for option in ("sparse", "partialFilterExpression", "expireAfterSeconds")
+                     if index.get(option) not in (None, False)}
+    return index_keys == keys and index_options == options
+
+
+class FieldIndexBuilder:
+    """
+    Построение и удаление вторичных индексов полей типов в фоне, без ожидания в запросах API.
+    Построения индексов одного типа в процессе выполняются последовательно.
+    Состояние построения хранится в коллекции FIELD_INDEX_BUILDS_COLLECTION, поэтому статус индексов
+    одинаков в любом процессе: тип строится, пока не истекла продлеваемая построением отметка building_until,
+    ошибки построения хранятся до следующего построения.
+    Удаляются только неуникальные индексы с именами индексов полей типа и построенные прежде (indexes в состоянии)
+    """
+
+    def __init__(self, lease_seconds: float = 60):
+        self.lease_seconds = lease_seconds
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def schedule(self, register_type: RegisterObjectTypeModel) -> asyncio.Task:
+        """Запуск приведения индексов коллекции объектов типа к спецификации полей"""
+        slug = register_type.slug
+        task = asyncio.create_task(self._build(register_type, self._tasks.get(slug)))
+        self._tasks[slug] = task
+        task.add_done_callback(lambda done: self._tasks.pop(slug) if self._tasks.get(slug) is done else None)
+        return task
+
+    async def wait(self, slug: str):
+        """Ожидание завершения построения индексов типа в этом процессе"""
+        task = self._tasks.get(slug)
+        if task is not None:
+            await asyncio.wait([task])
+
+    async def forget(self, slug: str):
+        """Удаление состояния построения индексов удаленного типа"""
+        await MongoDataBaseRepository().delete_many(FIELD_INDEX_BUILDS_COLLECTION, {"_id": slug})
+
+    async def _keep_building(self, slug: str, build_id: ObjectId, stop: asyncio.Event):
+        """Продление отметки построения до завершения построения (stop)"""
+        states = MongoDataBaseRepository().db[FIELD_INDEX_BUILDS_COLLECTION]
+        while True:
+            building_until = datetime.now(UTC) + timedelta(seconds=self.lease_seconds)
+            try:
+                await states.update_one({"_id": slug}, {"$set": {"build_id": build_id,
+                                                                 "building_until": building_until}},
+                                        upsert=True)
+            except PyMongoError as ex:
+                logger.warning("Index build state of %s was not updated: %s", slug, ex)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.lease_seconds / 3)
+                return
+            except TimeoutError:
+                pass
+
+    async def _build(self, register_type: RegisterObjectTypeModel, previous: asyncio.Task | None):
+        if previous is not None:
+            await asyncio.wait([previous])
+
+        slug = register_type.slug
+        repository = MongoDataBaseRepository()
+        build_id = ObjectId()
+        stop = asyncio.Event()
+        # Отметка снимается после завершения продления, иначе запоздавшее продление поставило бы ее снова
+        heartbeat = asyncio.create_task(self._keep_building(slug, build_id, stop))
+        specs = field_index_specs(register_type)
+        errors = {}
+        try:
+            state = await repository.find_one(FIELD_INDEX_BUILDS_COLLECTION, {"_id": slug}) or {}
+            managed = field_index_names(register_type) | set(state.get("indexes", []))
+            existing = {name: index for name, index in (await repository.index_information(slug)).items()
+                        if name in managed and not index.get("unique")}
+            for name, index in existing.items():
+                if name not in specs or not _same_index(index, *specs[name]):
+                    await repository.drop_index(slug, name)
+            for name, (keys, options) in specs.items():
+                if name in existing and _same_index(existing[name], keys, options):
+                    continue
+                try:
+                    await repository.create_index(slug, keys, name=name, **options)
+                except PyMongoError as ex:
+                    logger.warning("Index %s build on %s failed: %s", name, slug, ex)
+                    errors[name] = str(ex)
+        except PyMongoError as ex:
+            logger.warning("Index build on %s failed: %s", slug, ex)
+            errors = {name: str(ex) for name in specs}
+        finally:
+            stop.set()
+            await heartbeat
+
+        try:
+            states = repository.db[FIELD_INDEX_BUILDS_COLLECTION]
+            await states.update_one({"_id": slug}, {"$set": {"errors": errors, "indexes": list(specs)}}, upsert=True)
+            # Отметку снимает только построение, которое ее поставило
+            await states.update_one({"_id": slug, "build_id": build_id},
+                                    {"$unset": {"build_id": "", "building_until": ""}})
+        except PyMongoError as ex:
+            logger.warning("Index build state of %s was not saved: %s", slug, ex)
+
+    async def status(self, register_type: RegisterObjectTypeModel) -> list[FieldIndexStatusSchema]:
+        """Статус вторичных индексов полей типа"""
+        slug = register_type.slug
+        specs = field_index_specs(register_type)
+        repository = MongoDataBaseRepository()
+        existing = await repository.index_information(slug)
+        state = await repository.find_one(FIELD_INDEX_BUILDS_COLLECTION, {"_id": slug}) or {}
+        building_until = state.get("building_until")
+        # Клиент MongoDB возвращает datetime в UTC без часового пояса
+        building = building_until is not None and building_until.replace(tzinfo=UTC) > datetime.now(UTC)
+        errors = state.get("errors", {})
+
+        statuses = []
+        for field in register_type.fields:
+            if field.index is None:
+                continue
+            name = field_index_name(field.name)
+            if name in existing and _same_index(existing[name], *specs[name]):
+                status, error = 'ready', None
+            elif building:
+                status, error = 'building', None
+            elif name in errors:
+                status, error = 'failed', errors[name]
+            else:
+                status, error = 'missing', None
+            statuses.append(FieldIndexStatusSchema(field=field.name, name=name, status=status, error=error))
+        return statuses
+
+
+FIELD_INDEX_BUILDER = FieldIndexBuilder(lease_seconds=SETTINGS.FIELD_INDEX_BUILD_LEASE_SECONDS)
@@ -1,5 +1,6 @@
+import time
 from functools import wraps
-from typing import Callable, Type, Iterable, TypeVar, Any, Mapping
+from typing import Callable, Type, Iterable, TypeVar, Any, Mapping, AsyncIterator
 
 from beanie import PydanticObjectId
 from fastapi import HTTPException, Depends
@@ -11,50 +12,84 @@ from pymongo.read_concern import ReadConcern
 
 from config.config import get_db, Settings, SETTINGS
 from bson import SON
+from database.pagination import decode_cursor, encode_cursor, keyset_query, keyset_sort
+from database.query_profiler import SLOW_QUERY_PROFILER
+from library.metrics import timed_operation
 
 
 class MongoDataBaseRepository:
     def __init__(self):
         self.db = get_db()
 
+    @timed_operation
     async def find_one(self, collection_name: str, query: dict,
                        exclude_fields: set = frozenset(),
-                       extra_filter: dict | None = None):
+                       extra_filter: dict | None = None,
+                       session=None):
         collection = self.db[collection_name]
         projection = {field: 0 for field in exclude_fields}
         if extra_filter:
             projection.update(extra_filter)
-        return await collection.find_one(query, projection)
+        started = time.perf_counter()
+        data = await collection.find_one(query, projection, session=session)
+        SLOW_QUERY_PROFILER.observe(self.db, collection_name, {"find": collection_name, "filter": query,
+                                                               "projection": projection, "limit": 1}, started)
+        return data
 
+    @timed_operation
     async def delete_one(self, collection_name: str, query: dict, session=None):
         collection = self.db[collection_name]
         return await collection.delete_one(query, session=session)
 
-    async def bulk_write(self, collection_name: str, operations: list):
+    @timed_operation
+    async def bulk_write(self, collection_name: str, operations: list, ordered: bool = True, session=None):
         collection = self.db[collection_name]
-        return await collection.bulk_write(operations)
+        return await collection.bulk_write(operations, ordered=ordered, session=session)
 
+    @timed_operation
     async def insert_one(self, collection_name: str, document: dict, session=None) -> Any:
         """Вставка объекта в бд, возвращается его идентификатор"""
         result = await self.db[collection_name].insert_one(document=document, session=session)
         return result.inserted_id
 
+    @timed_operation
+    async def insert_many(self, collection_name: str, documents: list[dict], ordered: bool = True,
+                          session=None) -> list:
+        """Вставка нескольких объектов в бд, возвращаются их идентификаторы"""
+        result = await self.db[collection_name].insert_many(documents, ordered=ordered, session=session)
+        return result.inserted_ids
+
+    @timed_operation
     async def update_one(self, collection_name: str, query: dict, update: dict):
-        """ОБновление одного документа, вне контекста сессий"""
-        await self.db[collection_name].update_one(query, update)
-        return await self.find_one(collection_name, query)
+        """Обновление одного документа, вне контекста сессий. Возвращается обновленный документ"""
+        return await self.db[collection_name].find_one_and_update(query, update,
+                                                                  return_document=ReturnDocument.AFTER)
+
+    @timed_operation
+    async def update_many(self, collection_name: str, query: dict, update: dict, session=None):
+        return await self.db[collection_name].update_many(query, update, session=session)
 
-    async def find_one_and_update(self, collection_name: str, query: dict, update: dict, session=None):
+    @timed_operation
+    async def delete_many(self, collection_name: str, query: dict, session=None):
+        return await self.db[collection_name].delete_many(query, session=session)
+
+    @timed_operation
+    async def find_one_and_update(self, collection_name: str, query: dict, update: dict | list, session=None,
+                                  projection: dict | None = None,
+                                  return_document: ReturnDocument = ReturnDocument.AFTER):
         data = await self.db[collection_name].find_one_and_update(query,
                                                                   update,
+                                                                  projection=projection,
                                                                   session=session,
-                                                                  return_document=ReturnDocument.AFTER)
+                                                                  return_document=return_document)
         return data
 
+    @timed_operation
     async def find(self, collection_name: str, query: dict, skip: int = 0, sort: list = None, limit: int = None,
                    exclude_fields: set = frozenset(), ):
         collection = self.db[collection_name]
         projection = {field_name: 0 for field_name in exclude_fields}
+        started = time.perf_counter()
         cursor = collection.find(query, projection=projection)
 
         if skip:
@@ -67,18 +102,53 @@ class MongoDataBaseRepository:
             cursor = cursor.limit(limit)
 
         data = await cursor.to_list(limit)
+        command = {"find": collection_name, "filter": query, "projection": projection, "skip": skip,
+                   "sort": SON(sort or []), "limit": limit or 0}
+        SLOW_QUERY_PROFILER.observe(self.db, collection_name, command, started)
+        return data
+
+    @timed_operation
+    async def aggregate(self, collection_name: str, pipeline: list[dict], session=None, **kwargs) -> list[dict]:
+        started = time.perf_counter()
+        cursor = self.db[collection_name].aggregate(pipeline, session=session, **kwargs)
+        data = await cursor.to_list(None)
+        command = {"aggregate": collection_name, "pipeline": pipeline, "cursor": {},
+                   **{option: kwargs[option] for option in ("allowDiskUse", "maxTimeMS") if option in kwargs}}
+        SLOW_QUERY_PROFILER.observe(self.db, collection_name, command, started)
         return data
 
+    @timed_operation
+    async def count(self, collection_name: str, query: dict, **kwargs) -> int:
+        return await self.db[collection_name].count_documents(query, **kwargs)
+
+    async def iterate(self, collection_name: str, query: dict, exclude_fields: set = frozenset(),
+                      batch_size: int = 1000, sort: list = None) -> AsyncIterator[dict]:
+        """Потоковое чтение документов курсором, в памяти находится не более одной пачки batch_size"""
+        projection = {field_name: 0 for field_name in exclude_fields} or None
+        cursor = self.db[collection_name].find(query, projection=projection, batch_size=batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        while documents := await cursor.to_list(batch_size):
+            for document in documents:
+                yield document
+
+    @timed_operation
     async def create_collection(self, collection_name,
-                                json_validation_schema: dict,
+                                json_validation_schema: dict | None,
                                 index_fields_spec: list[tuple[tuple[str, str | int], bool]],
                                 level='strict',
+                                collation: dict | None = None,
                                 session=None):
-        """Создание коллекции с заданными индексами и валидацией"""
+        """
+        Создание коллекции с заданными индексами и валидацией (если передана схема).
+        Collation задает правила сравнения строк по умолчанию для коллекции и ее индексов
+        """
+        options = {"validator": json_validation_schema, "validationLevel": level} if json_validation_schema else {}
+        if collation:
+            options["collation"] = collation
         new_collection = await self.db.create_collection(collection_name,
-                                                         validator=json_validation_schema,
-                                                         validationLevel=level,
                                                          session=session,
+                                                         **options
                                                          )
 
         for index_spec in index_fields_spec:
@@ -87,6 +157,21 @@ class MongoDataBaseRepository:
                 unique=index_spec[1],
                 session=session)
 
+    @timed_operation
+    async def create_index(self, collection_name: str, keys: list[tuple[str, int | str]],
+                           unique: bool = False, session=None, **kwargs) -> str:
+        """Создание индекса. Имя индекса по умолчанию строится из его полей"""
+        return await self.db[collection_name].create_index(keys, unique=unique, session=session, **kwargs)
+
+    @timed_operation
+    async def drop_index(self, collection_name: str, name: str, session=None):
+        await self.db[collection_name].drop_index(name, session=session)
+
+    @timed_operation
+    async def index_information(self, collection_name: str, session=None) -> dict[str, dict]:
+        return await self.db[collection_name].index_information(session=session)
+
+    @timed_operation
     async def update_schema(self, collection_name, json_schema: dict, level='strict',
                             session=None):
         await self.db.command({
@@ -112,7 +197,19 @@ class MongoDataBaseRepository:
                                                                    )
 
     async def list_collections(self, session=None, filter: Mapping = None):
-        return await self.db.list_collection_names(session, filter)
+        return await self.db.list_collection_names(session=session, filter=filter)
+
+    @timed_operation
+    async def collection_options(self, collection_name: str) -> dict:
+        """Параметры коллекции (validator, collation и т.д.). Пустой словарь, если коллекции нет"""
+        cursor = await self.db.list_collections(filter={"name": collection_name})
+        collections = await cursor.to_list(None)
+        return collections[0].get("options", {}) if collections else {}
+
+    @timed_operation
+    async def collection_exists(self, collection_name: str, session=None) -> bool:
+        """Проверка существования коллекции одним запросом listCollections с фильтром по имени"""
+        return collection_name in await self.list_collections(session, filter={"name": collection_name})
 
 
 T = TypeVar('T', bound=BaseModel)
@@ -128,6 +225,10 @@ class DataBaseObjectRepository:
         data = await self._repository.find_one(self.collection_name, query, exclude_fields)
         return self.model.model_validate(data) if data else None
 
+    async def find_one_raw(self, query: dict, exclude_fields: set = frozenset()) -> dict | None:
+        """Чтение документа без валидации моделью, для сериализации напрямую в ответ"""
+        return await self._repository.find_one(self.collection_name, query, exclude_fields)
+
     async def find_one_by_id(self, object_id: PydanticObjectId, exclude_fields: set = frozenset()) -> T:
         query = {'_id': object_id}
         register_type_object: T = await self.find_one(query, exclude_fields)
@@ -142,8 +243,17 @@ class DataBaseObjectRepository:
         deletion_result = await self._repository.delete_one(self.collection_name, query, session=session)
         return deletion_result.deleted_count > 0
 
-    async def bulk_write(self, operations: list):
-        return await self._repository.bulk_write(self.collection_name, operations)
+    async def count(self, query: dict, max_time_ms: int | None = None) -> int:
+        options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+        return await self._repository.count(self.collection_name, query, **options)
+
+    async def aggregate_raw(self, pipeline: list[dict], max_time_ms: int | None = None) -> list[dict]:
+        """Выполнение конвейера агрегации с выгрузкой промежуточных данных на диск при нехватке памяти"""
+        options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+        return await self._repository.aggregate(self.collection_name, pipeline, allowDiskUse=True, **options)
+
+    async def bulk_write(self, operations: list, ordered: bool = True, session=None):
+        return await self._repository.bulk_write(self.collection_name, operations, ordered=ordered, session=session)
 
     async def insert_one(self, document: T, session=None) -> Any:
         data = await self._repository.insert_one(self.collection_name,
@@ -152,18 +262,66 @@ class DataBaseObjectRepository:
         return data
 
     async def collection_exists(self):
-        registered_collections = await self._repository.list_collections()
-        return self.collection_name in registered_collections
+        return await self._repository.collection_exists(self.collection_name)
 
     async def update_one(self, query: dict, update: dict, session=None) -> T:
         updated_data = await self._repository.update_one(self.collection_name, query, update)
-        return self.model.model_validate(updated_data)
+        return self.model.model_validate(updated_data) if updated_data else None
 
-    async def find_one_and_update(self, query: dict, update: dict, session=None) -> T:
-        updated_data = await self._repository.find_one_and_update(self.collection_name, query, update, session=session)
-        return self.model.model_validate(updated_data)
+    async def find_one_and_update(self, query: dict, update: dict | list, session=None,
+                                  exclude_fields: set = frozenset()) -> T:
+        projection = {field: 0 for field in exclude_fields} or None
+        updated_data = await self._repository.find_one_and_update(self.collection_name, query, update,
+                                                                  session=session, projection=projection)
+        return self.model.model_validate(updated_data) if updated_data else None
 
     async def find(self, query: dict = None, skip: int = 0, limit: int = None, sort: list = None,
                    exclude_fields: set = frozenset()) -> Iterable[T]:
         filtered_data = await self._repository.find(self.collection_name, query, skip, sort, limit, exclude_fields)
         return (self.model.model_validate(data) for data in filtered_data)
+
+    async def find_raw(self, query: dict = None, skip: int = 0, limit: int = None, sort: list = None,
+                       exclude_fields: set = frozenset()) -> list[dict]:
+        """Чтение документов без валидации моделью, для сериализации напрямую в ответ"""
+        return await self._repository.find(self.collection_name, query, skip, sort, limit, exclude_fields)
+
+    def iterate_raw(self, query: dict = None, exclude_fields: set = frozenset(),
+                    batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Потоковое чтение документов без валидации моделью"""
+        return self._repository.iterate(self.collection_name, query or {}, exclude_fields, batch_size)
+
+    async def find_page_raw(self, query: dict = None, limit: int = 100, sort_field: str = '_id',
+                            descending: bool = False, cursor: str | None = None,
+                            exclude_fields: set = frozenset()) -> tuple[list[dict], str | None]:
+        """
+        Keyset паджинация: выборка страницы документов, следующих за позицией курсора
+        Args:
+            query: фильтр
+            limit: размер страницы
+            sort_field: поле сортировки, для однозначности порядка дополняется _id
+            descending: сортировка по убыванию
+            cursor: токен продолжения, полученный с предыдущей страницей
+            exclude_fields: исключаемые поля
+        Returns:
+            документы страницы без валидации моделью и токен следующей страницы (None для последней страницы)
+        """
+        query = query or {}
+        if cursor:
+            query = {"$and": [query, keyset_query(decode_cursor(cursor, sort_field, descending))]}
+
+        data = await self._repository.find(self.collection_name, query,
+                                           sort=keyset_sort(sort_field, descending),
+                                           limit=limit + 1,
+                                           exclude_fields=exclude_fields)
+        next_cursor = None
+        if len(data) > limit:
+            data = data[:limit]
+            next_cursor = encode_cursor(data[-1], sort_field, descending)
+        return data, next_cursor
+
+    async def find_page(self, query: dict = None, limit: int = 100, sort_field: str = '_id',
+                        descending: bool = False, cursor: str | None = None,
+                        exclude_fields: set = frozenset()) -> tuple[list[T], str | None]:
+        """Keyset паджинация с валидацией документов моделью, см. find_page_raw"""
+        data, next_cursor = await self.find_page_raw(query, limit, sort_field, descending, cursor, exclude_fields)
+        return [self.model.model_validate(item) for item in data], next_cursor
@@ -0,0 +1,140 @@
+import random
+from datetime import datetime, timedelta, UTC
+from typing import Any
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from config.config import SETTINGS, WebhookSubscriber
+from database.mongo_repository import MongoDataBaseRepository
+
+OUTBOX_COLLECTION = 'notification_outbox'
+# Выборка недоставленных подписчику записей в порядке создания
+OUTBOX_INDEX_SPEC = (('pending', 1), ('_id', 1))
+# Удаление завершенных записей с ошибками доставки через OUTBOX_FAILED_RETENTION_SECONDS
+OUTBOX_TTL_INDEX_NAME = 'finished_at_ttl'
+
+
+def outbox_subscribers(slug: str) -> list[str]:
+    """Имена подписчиков изменений объектов типа. Без включенного outbox список пуст"""
+    if not SETTINGS.OUTBOX_ENABLED:
+        return []
+    return [subscriber.name for subscriber in SETTINGS.WEBHOOK_SUBSCRIBERS
+            if subscriber.slugs is None or slug in subscriber.slugs]
+
+
+def changed_notify_fields(before: dict | None, after: dict) -> list[str]:
+    """notify_fields объекта, значения которых изменились. Для нового объекта (before - None) - все заданные"""
+    notify_fields = after.get("notify_fields") or []
+    if before is None:
+        return [field for field in notify_fields if field in after]
+    return [field for field in notify_fields if before.get(field) != after.get(field)]
+
+
+def outbox_record(slug: str, operation: str, document: dict, changed_fields: list[str], history_id: Any,
+                  subscribers: list[str]) -> dict:
+    """Запись outbox об изменении объекта, ожидающая доставки каждому из подписчиков"""
+    return {
+        "_id": ObjectId(),
+        "slug": slug,
+        "object_id": document["_id"],
+        "operation": operation,
+        "changed_fields": changed_fields,
+        "fields": {field: document.get(field) for field in changed_fields},
+        "history_id": history_id,
+        "created_at": datetime.now(UTC),
+        "pending": subscribers,
+        "failed": [],
+    }
+
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная задержка повторной доставки со случайным разбросом, чтобы повторы не шли волнами"""
+    delay = min(SETTINGS.OUTBOX_RETRY_MAX_SECONDS, SETTINGS.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1)
+
+
+class OutboxRepository:
+    """
+    Записи outbox и состояние их доставки. Состояние доставки подписчику хранится в поле state.<имя подписчика>:
+    количество попыток, время следующей попытки и закрепление за процессом доставки.
+    Записи, доставленные всем подписчикам, удаляются сразу. Записи, которые не удалось доставить части подписчиков,
+    после завершения доставки остальным получают отметку finished_at и удаляются TTL индексом
+    """
+
+    def __init__(self):
+        self._repository = MongoDataBaseRepository()
+
+    async def ensure_indexes(self):
+        await self._repository.create_index(OUTBOX_COLLECTION, list(OUTBOX_INDEX_SPEC))
+        retention = SETTINGS.OUTBOX_FAILED_RETENTION_SECONDS
+        ttl_index = (await self._repository.index_information(OUTBOX_COLLECTION)).get(OUTBOX_TTL_INDEX_NAME)
+        if ttl_index is None:
+            await self._repository.create_index(OUTBOX_COLLECTION, [("finished_at", 1)], name=OUTBOX_TTL_INDEX_NAME,
+                                                expireAfterSeconds=retention)
+        elif ttl_index.get("expireAfterSeconds") != retention:
+            # Время хранения существующего TTL индекса меняется без его перестроения
+            await self._repository.db.command({"collMod": OUTBOX_COLLECTION,
+                                               "index": {"name": OUTBOX_TTL_INDEX_NAME,
+                                                         "expireAfterSeconds": retention}})
+
+    async def _finish(self, ids: list, now: datetime):
+        """Отметка о завершении доставки записей с ошибками: такие записи удаляются TTL индексом"""
+        await self._repository.update_many(OUTBOX_COLLECTION,
+                                           {"_id": {"$in": ids}, "pending": {"$size": 0},
+                                            "failed": {"$ne": []}, "finished_at": {"$exists": False}},
+                                           {"$set": {"finished_at": now}})
+
+    async def claim(self, subscriber: WebhookSubscriber, limit: int, lock_seconds: float) -> list[dict]:
+        """
+        Закрепление за вызывающим пачки записей, готовых к доставке подписчику.
+        Записи закрепляются меткой, поэтому пачки одновременно работающих процессов доставки не пересекаются
+        """
+        state = f"state.{subscriber.name}"
+        now = datetime.now(UTC)
+        ready = {"pending": subscriber.name,
+                 f"{state}.next_attempt_at": {"$not": {"$gt": now}},
+                 f"{state}.locked_until": {"$not": {"$gt": now}}}
+        candidates = await self._repository.find(OUTBOX_COLLECTION, ready, sort=[("_id", 1)], limit=limit)
+        if not candidates:
+            return []
+
+        lock = ObjectId()
+        await self._repository.update_many(
+            OUTBOX_COLLECTION,
+            {**ready, "_id": {"$in": [record["_id"] for record in candidates]}},
+            {"$set": {f"{state}.lock": lock, f"{state}.locked_until": now + timedelta(seconds=lock_seconds)}})
+        return await self._repository.find(OUTBOX_COLLECTION, {f"{state}.lock": lock}, sort=[("_id", 1)])
+
+    async def acknowledge(self, subscriber: WebhookSubscriber, records: list[dict]):
+        """Отметка о доставке записей подписчику. Записи, доставленные всем подписчикам, удаляются"""
+        ids = [record["_id"] for record in records]
+        await self._repository.update_many(OUTBOX_COLLECTION, {"_id": {"$in": ids}},
+                                           {"$pull": {"pending": subscriber.name},
+                                            "$unset": {f"state.{subscriber.name}": ""}})
+        await self._repository.delete_many(OUTBOX_COLLECTION,
+                                           {"_id": {"$in": ids}, "pending": {"$size": 0}, "failed": {"$size": 0}})
+        await self._finish(ids, datetime.now(UTC))
+
+    async def reschedule(self, subscriber: WebhookSubscriber, records: list[dict], error: str, max_attempts: int):
+        """
+        Повторная доставка записей с задержкой после ошибки.
+        После max_attempts попыток запись исключается из доставки подписчику и помечается ошибочной
+        """
+        state = f"state.{subscriber.name}"
+        now = datetime.now(UTC)
+        operations, failed_ids = [], []
+        for record in records:
+            attempts = record.get("state", {}).get(subscriber.name, {}).get("attempts", 0) + 1
+            if attempts >= max_attempts:
+                failed_ids.append(record["_id"])
+                update = {"$pull": {"pending": subscriber.name},
+                          "$push": {"failed": {"subscriber": subscriber.name, "error": error, "at": now}},
+                          "$unset": {state: ""}}
+            else:
+                update = {"$set": {state: {"attempts": attempts, "last_error": error,
+                                           "next_attempt_at": now + timedelta(seconds=retry_delay(attempts))}}}
+            operations.append(UpdateOne({"_id": record["_id"]}, update))
+        await self._repository.bulk_write(OUTBOX_COLLECTION, operations, ordered=False)
+        if failed_ids:
+            await self._finish(failed_ids, now)
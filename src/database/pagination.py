@@ -0,0 +1,48 @@
+import base64
+import binascii
+from typing import Any
+
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+
+
+def encode_cursor(document: dict, sort_field: str, descending: bool) -> str:
+    """
+    Создает непрозрачный токен продолжения по последнему документу страницы
+    Args:
+        document: последний документ страницы
+        sort_field: поле сортировки
+        descending: направление сортировки
+    """
+    payload = {"f": sort_field, "d": descending, "v": document.get(sort_field), "id": document["_id"]}
+    return base64.urlsafe_b64encode(json_util.dumps(payload).encode()).decode()
+
+
+def decode_cursor(token: str, sort_field: str, descending: bool) -> dict[str, Any]:
+    """Разбор токена продолжения. Токен должен соответствовать текущей сортировке"""
+    try:
+        payload = json_util.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, ValueError):
+        raise ValueError("Invalid pagination cursor")
+    if not isinstance(payload, dict) or {"f", "d", "v", "id"} - payload.keys():
+        raise ValueError("Invalid pagination cursor")
+    if payload["f"] != sort_field or payload["d"] != descending:
+        raise ValueError("Pagination cursor does not match requested sort")
+    return payload
+
+
+def keyset_query(cursor: dict[str, Any]) -> dict:
+    """Условие выборки документов, следующих за позицией курсора"""
+    operator = "$lt" if cursor["d"] else "$gt"
+    if cursor["f"] == "_id":
+        return {"_id": {operator: cursor["id"]}}
+    return {"$or": [{cursor["f"]: {operator: cursor["v"]}},
+                    {cursor["f"]: cursor["v"], "_id": {operator: cursor["id"]}}]}
+
+
+def keyset_sort(sort_field: str, descending: bool) -> list[tuple[str, int]]:
+    """Сортировка для keyset паджинации. _id добавляется для однозначности порядка"""
+    direction = DESCENDING if descending else ASCENDING
+    if sort_field == "_id":
+        return [("_id", direction)]
+    return [(sort_field, direction), ("_id", direction)]
@@ -0,0 +1,76 @@
+from typing import Any, Iterable
+
+from models.register_object_type import SupportedTypes
+
+FILTER_OPERATORS = {
+    "eq": "$eq",
+    "ne": "$ne",
+    "gt": "$gt",
+    "gte": "$gte",
+    "lt": "$lt",
+    "lte": "$lte",
+    "in": "$in",
+}
+
+ORDERED_TYPES = {SupportedTypes.INT, SupportedTypes.FLOAT, SupportedTypes.STRING, SupportedTypes.DATETIME}
+
+
+def register_field_types(fields: Iterable) -> dict[str, SupportedTypes]:
+    """Типы полей, доступных для фильтрации: поля типа реестра и служебный признак деактивации"""
+    field_types = {field.name: field.type for field in fields}
+    field_types["is_deactivated"] = SupportedTypes.BOOL
+    return field_types
+
+
+def build_filter(conditions: Iterable[tuple[str, Any]], field_types: dict[str, SupportedTypes],
+                 parse_strings: bool = True) -> dict:
+    """
+    Строит запрос MongoDB из условий вида ('field__op', value)
+    Args:
+        conditions: пары (условие, значение). Условие - имя поля, либо имя поля и оператор через '__'
+        field_types: допустимые поля и их типы
+        parse_strings: значения переданы строками (query параметры) и должны быть приведены к типу поля,
+            иначе значения из JSON проверяются по типу поля
+    Returns:
+        словарь запроса MongoDB
+    """
+    query: dict[str, dict] = {}
+    for condition, value in conditions:
+        field_name, operator = condition, "eq"
+        if "__" in condition and condition.rsplit("__", 1)[1] in FILTER_OPERATORS:
+            field_name, operator = condition.rsplit("__", 1)
+
+        field_type = field_types.get(field_name)
+        if field_type is None:
+            raise ValueError(f"Unknown filter field: {field_name}")
+        if operator in ("gt", "gte", "lt", "lte") and field_type.item_type() not in ORDERED_TYPES:
+            raise ValueError(f"Operator {operator} is not supported for field {field_name}")
+
+        parse = field_type.parse_value if parse_strings else field_type.parse_json_value
+        if operator == "in":
+            # В query параметрах каждое значение передается отдельным параметром (field__in=a&field__in=b),
+            # поэтому значения могут содержать любые символы, в том числе запятые
+            values = [value] if parse_strings else value
+            if not isinstance(values, list):
+                raise ValueError(f"Operator in requires a list of values for field {field_name}")
+            query.setdefault(field_name, {}).setdefault("$in", []).extend(parse(item) for item in values)
+            continue
+
+        query.setdefault(field_name, {})[FILTER_OPERATORS[operator]] = parse(value)
+    return query
+
+
+def parse_sort(sort: str, field_types: dict[str, SupportedTypes], required_fields: set[str]) -> tuple[str, bool]:
+    """
+    Разбор параметра сортировки вида 'field' или '-field'
+    Returns:
+        имя поля в MongoDB и признак сортировки по убыванию
+    """
+    descending = sort.startswith("-")
+    field_name = sort.lstrip("-")
+    if field_name in ("id", "_id"):
+        return "_id", descending
+    field_type = field_types.get(field_name)
+    if field_type is None or field_name not in required_fields or field_type.item_type() != field_type:
+        raise ValueError(f"Sorting is supported only by id or required scalar fields, got: {field_name}")
+    return field_name, descending
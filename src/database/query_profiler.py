@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime, UTC
+from typing import Any
+
+from bson import json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
+
+from config.config import SETTINGS
+from schemas.slow_query import SlowQuerySchema
+
+logger = logging.getLogger(__name__)
+
+# Не более стольких explain одновременно: при общей деградации БД профилирование не должно ее усиливать
+MAX_PENDING_EXPLAINS = 4
+
+
+def _find_key(data: Any, key: str) -> Any:
+    """Первое значение ключа при обходе вложенных документов и массивов результата explain"""
+    if isinstance(data, dict):
+        if key in data:
+            return data[key]
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        found = _find_key(value, key)
+        if found is not None:
+            return found
+    return None
+
+
+def _plan_stages(plan: Any, stages: list[str], indexes: list[str]):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            indexes.append(plan["indexName"])
+        for value in plan.values():
+            _plan_stages(value, stages, indexes)
+    elif isinstance(plan, list):
+        for value in plan:
+            _plan_stages(value, stages, indexes)
+
+
+def plan_summary(explain: dict) -> dict:
+    """
+    Краткое описание плана из результата explain executionStats:
+    этапы выбранного плана, использованные индексы и количество просмотренных и возвращенных документов
+    """
+    stages, indexes = [], []
+    _plan_stages(_find_key(explain, "winningPlan"), stages, indexes)
+    stats = _find_key(explain, "executionStats") or {}
+    return {
+        "stages": stages,
+        "indexes": list(dict.fromkeys(indexes)),
+        "collection_scan": "COLLSCAN" in stages,
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "returned": stats.get("nReturned"),
+        "explain_time_ms": stats.get("executionTimeMillis"),
+    }
+
+
+class SlowQueryProfiler:
+    """
+    Профилирование медленных запросов репозитория (включается SLOW_QUERY_PROFILING).
+    Запросы дольше порога повторно выполняются в фоне с explain executionStats,
+    краткие описания планов хранятся в кольцевом буфере последних медленных запросов
+    """
+
+    def __init__(self, enabled: bool, threshold_ms: float, buffer_size: int):
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self._records: deque[SlowQuerySchema] = deque(maxlen=buffer_size)
+        self._pending: set[asyncio.Task] = set()
+
+    def observe(self, db: AsyncIOMotorDatabase, collection_name: str, command: dict, started: float):
+        """
+        Проверка длительности запроса, начатого в started (time.perf_counter).
+        command - команда find или aggregate, которой был выполнен запрос
+        """
+        if not self.enabled:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.threshold_ms or len(self._pending) >= MAX_PENDING_EXPLAINS:
+            return
+        task = asyncio.create_task(self._explain(db, collection_name, command, duration_ms))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _explain(self, db: AsyncIOMotorDatabase, collection_name: str, command: dict, duration_ms: float):
+        # maxTimeMS не допускается внутри команды explain и передается на ее верхнем уровне
+        explain_command = {"explain": {key: value for key, value in command.items() if key != "maxTimeMS"},
+                           "verbosity": "executionStats"}
+        if "maxTimeMS" in command:
+            explain_command["maxTimeMS"] = command["maxTimeMS"]
+        try:
+            explain = await db.command(explain_command)
+        except PyMongoError as ex:
+            logger.warning("Explain of slow query on %s failed: %s", collection_name, ex)
+            return
+        summary = plan_summary(explain)
+        if summary["collection_scan"]:
+            logger.warning("Slow query on %s (%.1f ms) used collection scan", collection_name, duration_ms)
+        self._records.append(SlowQuerySchema(
+            collection=collection_name,
+            operation=next(iter(command)),
+            duration_ms=duration_ms,
+            recorded_at=datetime.now(UTC),
+            command=json.loads(json_util.dumps({key: value for key, value in command.items()
+                                                if key not in ("find", "aggregate", "cursor")},
+                                               json_options=RELAXED_JSON_OPTIONS)),
+            **summary,
+        ))
+
+    async def wait(self):
+        """Ожидание завершения запущенных explain"""
+        if self._pending:
+            await asyncio.wait(list(self._pending))
+
+    def records(self) -> list[SlowQuerySchema]:
+        """Медленные запросы, начиная с последнего"""
+        return list(reversed(self._records))
+
+    def clear(self):
+        self._records.clear()
+
+
+SLOW_QUERY_PROFILER = SlowQueryProfiler(SETTINGS.SLOW_QUERY_PROFILING, SETTINGS.SLOW_QUERY_THRESHOLD_MS,
+                                        SETTINGS.SLOW_QUERY_BUFFER_SIZE)
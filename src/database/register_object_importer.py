@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from typing import AsyncIterable, AsyncIterator
+
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import PyMongoError
+
+from database.register_object_repository import MongoRegisterRepository
+from database.register_type_registry import TYPE_REGISTRY
+from models.register_object import RegisterObjectModel
+from schemas.register_object import BulkItemResultSchema, ImportProgressSchema
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+DOCUMENT_VALIDATION_ERROR_CODE = 121
+
+
+def write_error_status(error: dict) -> str:
+    """Статус объекта пакетной загрузки по ошибке записи bulk_write"""
+    return {DUPLICATE_KEY_ERROR_CODE: 'duplicate',
+            DOCUMENT_VALIDATION_ERROR_CODE: 'invalid'}.get(error["code"], 'error')
+
+
+class LineTooLongError(ValueError):
+    """Строка потока длиннее допустимой"""
+
+    def __init__(self, max_length: int):
+        super().__init__(f"Line is longer than {max_length} bytes")
+
+
+async def split_lines(chunks: AsyncIterable[bytes],
+                      max_length: int | None = None) -> AsyncIterator[bytes | LineTooLongError]:
+    """
+    Разбиение потока байт на строки без накопления всего потока в памяти.
+    Вместо строки длиннее max_length возвращается ошибка LineTooLongError, остаток строки пропускается
+    """
+    tail = b""
+    # Пропускается остаток слишком длинной строки до перевода строки
+    skipping = False
+    async for chunk in chunks:
+        *lines, tail = (tail + chunk).split(b"\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+            elif max_length is not None and len(line) > max_length:
+                yield LineTooLongError(max_length)
+            else:
+                yield line
+        if max_length is not None and len(tail) > max_length:
+            if not skipping:
+                yield LineTooLongError(max_length)
+                skipping = True
+            tail = b""
+    if tail and not skipping:
+        yield tail
+
+
+class RegisterObjectImporter:
+    """
+    Потоковая загрузка объектов типа из NDJSON.
+    Строки валидируются по полям типа и группируются в пачки по batch_size,
+    каждая пачка записывается одним неупорядоченным bulk_write.
+    Одновременно записывается не более concurrency пачек, чтение входного потока
+    приостанавливается до завершения одной из них
+    """
+
+    def __init__(self, slug: str, batch_size: int = 1000, concurrency: int = 4):
+        self.repository = MongoRegisterRepository(slug)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    async def _write_batch(self, create_schema: type[BaseModel],
+                           batch: list[tuple[int, bytes | LineTooLongError]]) -> list[BulkItemResultSchema]:
+        results = []
+        documents, document_lines = [], []
+        for line_number, line in batch:
+            if isinstance(line, LineTooLongError):
+                results.append(BulkItemResultSchema(index=line_number, status='invalid', detail=[str(line)]))
+                continue
+            try:
+                payload = create_schema.model_validate_json(line)
+            except ValidationError as ex:
+                results.append(BulkItemResultSchema(index=line_number, status='invalid',
+                                                    detail=[error['msg'] for error in ex.errors()]))
+                continue
+            documents.append(RegisterObjectModel(**payload.model_dump(exclude_unset=True)))
+            document_lines.append(line_number)
+
+        try:
+            inserted_ids, write_errors = await self.repository.insert_many(documents)
+        except PyMongoError as ex:
+            return results + [BulkItemResultSchema(index=line_number, status='error', detail=str(ex))
+                              for line_number in document_lines]
+
+        results.extend(BulkItemResultSchema(index=document_lines[index], status='created', id=object_id)
+                       for index, object_id in inserted_ids.items())
+        results.extend(BulkItemResultSchema(index=document_lines[index], status=write_error_status(error),
+                                            detail=error.get("errmsg"))
+                       for index, error in write_errors.items())
+        return results
+
+    async def run(self, lines: AsyncIterable[bytes | LineTooLongError]
+                  ) -> AsyncIterator[BulkItemResultSchema | ImportProgressSchema]:
+        """
+        Загрузка объектов из потока строк NDJSON. Пустые строки пропускаются,
+        слишком длинные строки (LineTooLongError из split_lines) отклоняются как невалидные
+        Yields:
+            результат для каждой незагруженной строки (index - номер строки, начиная с 1)
+            и прогресс загрузки после записи каждой пачки, последний - с признаком finished
+        """
+        create_schema = (await TYPE_REGISTRY.require(self.repository.collection_name)).create_schema
+        progress = ImportProgressSchema(processed=0, created=0, failed=0)
+        pending: set[asyncio.Task] = set()
+
+        def collect(done: set[asyncio.Task]) -> list[BulkItemResultSchema | ImportProgressSchema]:
+            events = []
+            for task in done:
+                for result in task.result():
+                    progress.processed += 1
+                    if result.status == 'created':
+                        progress.created += 1
+                    else:
+                        progress.failed += 1
+                        events.append(result)
+            logger.info("Import into %s: processed %s, created %s, failed %s", self.repository.collection_name,
+                        progress.processed, progress.created, progress.failed)
+            events.append(progress.model_copy())
+            return events
+
+        batch: list[tuple[int, bytes | LineTooLongError]] = []
+        line_number = 0
+        try:
+            async for line in lines:
+                line_number += 1
+                if not isinstance(line, LineTooLongError) and not line.strip():
+                    continue
+                batch.append((line_number, line))
+                if len(batch) < self.batch_size:
+                    continue
+                if len(pending) >= self.concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for event in collect(done):
+                        yield event
+                pending.add(asyncio.create_task(self._write_batch(create_schema, batch)))
+                batch = []
+
+            if batch:
+                pending.add(asyncio.create_task(self._write_batch(create_schema, batch)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for event in collect(done):
+                    yield event
+        finally:
+            for task in pending:
+                task.cancel()
+
+        progress.finished = True
+        yield progress
@@ -1,41 +1,431 @@
+import unicodedata
 from datetime import datetime, tzinfo, UTC
-from typing import Any
+from typing import Any, Awaitable, Callable
 
 from beanie import PydanticObjectId
+from bson import ObjectId
+from pymongo import UpdateOne, InsertOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 
+from config.config import SETTINGS
 from database.mongo_repository import DataBaseObjectRepository, T
-from database.register_object_type_repository import get_object_default_notify_fields, get_object_unique_fields
+from database.outbox import OUTBOX_COLLECTION, outbox_subscribers, outbox_record, changed_notify_fields
+from database.pagination import decode_cursor, encode_cursor, keyset_query, keyset_sort
+from database.register_object_type_repository import history_collection_name, HISTORY_INDEX_SPEC
+from database.register_type_registry import TYPE_REGISTRY
 
+from library.response_cache import RESPONSE_CACHE, register_objects_namespace
 from models.register_object import RegisterObjectModel, HistoryRecordModel
 
 
+def comparable_value(value, collation: dict | None = None):
+    """
+    Значение поля в том виде, в каком его сравнивает MongoDB: datetime хранится в UTC без часового пояса
+    с точностью до миллисекунд, строки при collation со strength 1 и 2 сравниваются без учета регистра
+    (при strength 1 - и без учета диакритических знаков)
+    """
+    if isinstance(value, list):
+        return tuple(comparable_value(item, collation) for item in value)
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(UTC).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, str) and collation and collation.get("strength", 3) <= 2:
+        value = value.casefold()
+        if collation["strength"] == 1:
+            value = "".join(char for char in unicodedata.normalize("NFD", value) if not unicodedata.combining(char))
+    return value
+
+
 class MongoRegisterRepository(DataBaseObjectRepository):
     def __init__(self, collection_name: str, ):
         super().__init__(collection_name, model=RegisterObjectModel)
+        self.history_collection_name = history_collection_name(collection_name)
+        self.cache_namespace = register_objects_namespace(collection_name)
 
-    async def insert_one(self, document: RegisterObjectModel, session=None) -> Any:
+    async def collection_exists(self, for_write: bool = False):
+        return await TYPE_REGISTRY.slug_exists(self.collection_name, for_write)
+
+    @property
+    def history_in_collection(self) -> bool:
+        return SETTINGS.HISTORY_STORAGE == 'collection'
+
+    @staticmethod
+    def _history_record_dump(history_record: HistoryRecordModel) -> dict:
+        history_record_dump = history_record.model_dump(exclude={'history_id'})
+        history_record_dump['history_id'] = history_record.history_id
+        return history_record_dump
+
+    @staticmethod
+    def _history_document(history_record_dump: dict, object_id) -> dict:
+        """Документ коллекции истории: идентификатор исторической записи хранится в _id"""
+        history_document = {key: value for key, value in history_record_dump.items() if key != 'history_id'}
+        history_document['_id'] = history_record_dump['history_id']
+        history_document['object_id'] = object_id
+        return history_document
+
+    @staticmethod
+    def _history_record_from_document(history_document: dict) -> HistoryRecordModel:
+        history_document = dict(history_document)
+        history_document['history_id'] = history_document.pop('_id')
+        history_document.pop('object_id', None)
+        return HistoryRecordModel(**history_document)
+
+    def _prepare_insert(self, document: RegisterObjectModel, default_notify_fields: list[str]) -> tuple[dict, dict]:
+        """
+        Подготовка документа к вставке: значения notify_fields по умолчанию и начальная историческая запись
+        Returns:
+            документ для вставки и начальная историческая запись
+        """
         if 'notify_fields' not in document.model_dump(exclude_unset=True):
-            document.notify_fields = await get_object_default_notify_fields(self.collection_name)
+            document.notify_fields = default_notify_fields
 
         history_record = HistoryRecordModel(
             history_datetime=datetime.now(tz=UTC),
             **document.model_dump(exclude={'history', 'id'})
         )
-        document.history = [history_record]
+        history_record_dump = self._history_record_dump(history_record)
+
+        document_dump = document.model_dump(exclude={'id', 'history'})
+        document_dump["history"] = [] if self.history_in_collection else [history_record_dump]
+        return document_dump, history_record_dump
+
+    def _transactional(self, subscribers: list[str]) -> bool:
+        """Запись объекта затрагивает несколько коллекций: историю в отдельной коллекции или outbox"""
+        return self.history_in_collection or bool(subscribers)
+
+    def _outbox_record(self, before: dict | None, after: dict, history_id: Any,
+                       subscribers: list[str]) -> dict | None:
+        """
+        Запись outbox об изменении объекта (before - None для нового объекта).
+        Новый объект передается подписчикам всегда, измененный - только при изменении его notify_fields
+        """
+        if not subscribers:
+            return None
+        changed_fields = changed_notify_fields(before, after)
+        if before is not None and not changed_fields:
+            return None
+        return outbox_record(self.collection_name, 'insert' if before is None else 'update', after, changed_fields,
+                             history_id, subscribers)
+
+    async def _transaction(self, session, callback: Callable[[Any], Awaitable], required: bool = True):
+        """
+        Запись объекта функцией callback(session). Если запись затрагивает несколько коллекций (required),
+        callback выполняется в транзакции (или в транзакции переданной сессии).
+        with_transaction повторяет транзакцию при TransientTransactionError и повторяет фиксацию
+        при UnknownTransactionCommitResult, поэтому callback может быть вызван несколько раз
+        Returns:
+            результат callback
+        """
+        if session is not None or not required:
+            return await callback(session)
+        async with await self._repository.db.client.start_session() as write_session:
+            return await write_session.with_transaction(callback)
+
+    async def insert_one(self, document: RegisterObjectModel, session=None) -> Any:
+        document_dump, history_record_dump = self._prepare_insert(
+            document, (await TYPE_REGISTRY.require(self.collection_name)).notify_fields)
+
+        subscribers = outbox_subscribers(self.collection_name)
+
+        async def write(write_session):
+            inserted_id = await self._repository.insert_one(self.collection_name,
+                                                            document_dump,
+                                                            session=write_session)
+            if self.history_in_collection:
+                await self._repository.insert_one(self.history_collection_name,
+                                                  self._history_document(history_record_dump, inserted_id),
+                                                  session=write_session)
+            if subscribers:
+                await self._repository.insert_one(OUTBOX_COLLECTION,
+                                                  self._outbox_record(None, {**document_dump, "_id": inserted_id},
+                                                                      history_record_dump['history_id'], subscribers),
+                                                  session=write_session)
+            return inserted_id
+
+        result_id = await self._transaction(session, write, self._transactional(subscribers))
+        # Ответ строится из записанного документа без повторного чтения
+        return self.model.model_validate({**document_dump, "_id": result_id, "history": []})
+
+    async def insert_many(self, documents: list[RegisterObjectModel]) -> tuple[dict[int, ObjectId], dict[int, dict]]:
+        """
+        Пакетная вставка объектов неупорядоченным bulk_write.
+        Ошибка вставки одного объекта (например, нарушение уникального индекса) не прерывает вставку остальных.
+        При наличии подписчиков записи outbox о вставленных объектах записываются в транзакции со вставкой
+        Returns:
+            идентификаторы вставленных объектов и ошибки записи по индексу объекта в переданном списке
+        """
+        default_notify_fields = (await TYPE_REGISTRY.require(self.collection_name)).notify_fields
+        document_dumps, history_record_dumps = [], []
+        for document in documents:
+            document_dump, history_record_dump = self._prepare_insert(document, default_notify_fields)
+            document_dump["_id"] = ObjectId()
+            document_dumps.append(document_dump)
+            history_record_dumps.append(history_record_dump)
+
+        subscribers = outbox_subscribers(self.collection_name)
+        write_errors = await self._bulk_write_with_history(
+            [InsertOne(document_dump) for document_dump in document_dumps],
+            [(history_record_dump, document_dump["_id"])
+             for document_dump, history_record_dump in zip(document_dumps, history_record_dumps)],
+            outbox_records=[self._outbox_record(None, document_dump, history_record_dump['history_id'], subscribers)
+                            for document_dump, history_record_dump in zip(document_dumps, history_record_dumps)])
+        inserted_ids = {index: document_dump["_id"] for index, document_dump in enumerate(document_dumps)
+                        if index not in write_errors}
+        return inserted_ids, write_errors
+
+    async def _bulk_write_with_history(self, operations: list, history: list[tuple[dict, Any]],
+                                       batch_size: int = 1000,
+                                       outbox_records: list[dict | None] | None = None) -> dict[int, dict]:
+        """
+        Неупорядоченная запись операций над объектами и их исторических записей (запись и идентификатор объекта
+        для каждой операции) и записей outbox (запись или None для каждой операции).
+        При хранении истории в коллекции или записи outbox операции записываются пачками по batch_size,
+        каждая пачка - в одной транзакции с историей и outbox. Ошибка записи объекта отменяет транзакцию,
+        поэтому пачка записывается повторно без операций с ошибками
+        Returns:
+            ошибки записи по индексу операции
+        """
+        outbox_records = outbox_records or [None] * len(operations)
+        if not self.history_in_collection and not any(outbox_records):
+            if not operations:
+                return {}
+            try:
+                await self.bulk_write(operations, ordered=False)
+            except BulkWriteError as ex:
+                return {error["index"]: error for error in ex.details["writeErrors"]}
+            return {}
+
+        write_errors = {}
+        for batch_start in range(0, len(operations), batch_size):
+            pending = list(range(batch_start, min(len(operations), batch_start + batch_size)))
+            while pending:
+                failed = {}
+
+                async def write_batch(session):
+                    failed.clear()
+                    try:
+                        await self.bulk_write([operations[index] for index in pending], ordered=False,
+                                              session=session)
+                    except BulkWriteError as ex:
+                        failed.update({pending[error["index"]]: error for error in ex.details["writeErrors"]})
+                        raise
+                    if self.history_in_collection:
+                        await self._repository.insert_many(self.history_collection_name,
+                                                           [self._history_document(*history[index])
+                                                            for index in pending],
+                                                           session=session)
+                    batch_outbox = [outbox_records[index] for index in pending if outbox_records[index] is not None]
+                    if batch_outbox:
+                        await self._repository.insert_many(OUTBOX_COLLECTION, batch_outbox, session=session)
+
+                try:
+                    await self._transaction(None, write_batch)
+                except BulkWriteError:
+                    if not failed:
+                        raise
+                    write_errors.update(failed)
+                    pending = [index for index in pending if index not in failed]
+                    continue
+                break
+        return write_errors
+
+    @staticmethod
+    def _unique_key(data: dict, unique_fields: list[str], collation: dict | None) -> tuple:
+        """Ключ объекта по уникальным полям: ключи равны, если объекты совпадают по уникальному индексу коллекции"""
+        return tuple(comparable_value(data.get(field), collation) for field in unique_fields)
+
+    def _history_update(self, object_data: dict, changes: dict) -> tuple[dict, dict]:
+        """
+        Обновление объекта с исторической записью его нового состояния
+        Returns:
+            спецификация обновления и историческая запись
+        """
+        history_object_data = {key: value for key, value in object_data.items() if key not in ('_id', 'history')}
+        history_object_data.update(changes)
+        history_record_dump = self._history_record_dump(
+            HistoryRecordModel(**history_object_data, history_datetime=datetime.now(UTC)))
+        update = {"$set": changes}
+        if not self.history_in_collection:
+            update["$push"] = {"history": history_record_dump}
+        return update, history_record_dump
 
-        document_dump = document.model_dump(exclude={
-            'id': True,
-            "history": {
-                "__all__": {"history_id"}
-            }})
-        document_dump["history"][0]["history_id"] = document.history[0].history_id
+    async def sync(self, documents: list[RegisterObjectModel], deactivate_missing: bool = False,
+                   batch_size: int = 1000) -> dict:
+        """
+        Синхронизация коллекции с полным снимком объектов источника по уникальным полям типа.
+        Существующие объекты читаются пачками, изменения вычисляются в памяти и записываются
+        неупорядоченным bulk_write. Объекты без изменений не записываются.
+        Args:
+            documents: объекты снимка
+            deactivate_missing: деактивировать объекты, отсутствующие в снимке
+                (и активировать присутствующие в снимке деактивированные объекты)
+            batch_size: размер пачки чтения существующих объектов и записи в транзакции
+        Записи outbox о вставке и об изменении notify_fields объектов записываются в транзакции с изменениями
+        Returns:
+            количество вставленных, обновленных, неизмененных и деактивированных объектов и список ошибок
+            в виде (индекс объекта в снимке, ошибка), индекс None - ошибка деактивации
+        """
+        register_type = await TYPE_REGISTRY.require(self.collection_name)
+        unique_fields = register_type.unique_fields
+        if not unique_fields:
+            raise ValueError("Register type has no unique fields, sync is not possible")
+        default_notify_fields = register_type.notify_fields
+        # Уникальный индекс сравнивает строки по collation коллекции
+        collation = (await self._repository.collection_options(self.collection_name)).get("collation")
 
-        result_id = await self._repository.insert_one(self.collection_name,
-                                                      document_dump,
-                                                      session=session)
-        return await self.find_one_by_id(result_id, exclude_fields={'history'})
+        errors: list[tuple[int | None, Any]] = []
+        incoming: dict[tuple, tuple[int, dict]] = {}
+        for index, document in enumerate(documents):
+            data = document.model_dump(exclude={'id', 'history'}, exclude_unset=True)
+            if deactivate_missing:
+                data["is_deactivated"] = False
+            key = self._unique_key(data, unique_fields, collation)
+            if key in incoming:
+                unique_values = {field: data.get(field) for field in unique_fields}
+                errors.append((index, f"Duplicate unique fields {unique_values} in snapshot"))
+                continue
+            incoming[key] = (index, data)
+
+        subscribers = outbox_subscribers(self.collection_name)
+        operations, operation_refs, history_record_dumps, outbox_records = [], [], [], []
+        counters = {"inserted": 0, "updated": 0, "unchanged": 0, "deactivated": 0}
+
+        def add_operation(operation, kind: str, index: int | None, history_record_dump: dict,
+                          before: dict | None, after: dict):
+            operations.append(operation)
+            operation_refs.append((kind, index))
+            history_record_dumps.append((history_record_dump, after["_id"]))
+            outbox_records.append(self._outbox_record(before, after, history_record_dump['history_id'], subscribers))
+
+        incoming_items = list(incoming.items())
+        for batch_start in range(0, len(incoming_items), batch_size):
+            batch = incoming_items[batch_start:batch_start + batch_size]
+            keys_query = {"$or": [{field: data.get(field) for field in unique_fields} for _, (_, data) in batch]}
+            existing = {self._unique_key(object_data, unique_fields, collation): object_data
+                        for object_data in await self._repository.find(self.collection_name, keys_query,
+                                                                       exclude_fields={'history'})}
+            for key, (index, data) in batch:
+                object_data = existing.get(key)
+                if object_data is None:
+                    document_dump, history_record_dump = self._prepare_insert(RegisterObjectModel(**data),
+                                                                              default_notify_fields)
+                    document_dump["_id"] = ObjectId()
+                    add_operation(InsertOne(document_dump), "inserted", index, history_record_dump,
+                                  None, document_dump)
+                    continue
+                changes = {field: value for field, value in data.items()
+                           if comparable_value(object_data.get(field)) != comparable_value(value)}
+                if not changes:
+                    counters["unchanged"] += 1
+                    continue
+                update, history_record_dump = self._history_update(object_data, changes)
+                add_operation(UpdateOne({"_id": object_data["_id"]}, update), "updated", index,
+                              history_record_dump, object_data, {**object_data, **changes})
+
+        if deactivate_missing:
+            last_id = None
+            while True:
+                query = {"is_deactivated": {"$ne": True}}
+                if last_id is not None:
+                    query["_id"] = {"$gt": last_id}
+                active_objects = await self._repository.find(self.collection_name, query, sort=[('_id', 1)],
+                                                             limit=batch_size, exclude_fields={'history'})
+                if not active_objects:
+                    break
+                last_id = active_objects[-1]["_id"]
+                for object_data in active_objects:
+                    if self._unique_key(object_data, unique_fields, collation) in incoming:
+                        continue
+                    update, history_record_dump = self._history_update(object_data, {"is_deactivated": True})
+                    add_operation(UpdateOne({"_id": object_data["_id"]}, update), "deactivated", None,
+                                  history_record_dump, object_data, {**object_data, "is_deactivated": True})
+
+        write_errors = await self._bulk_write_with_history(operations, history_record_dumps, batch_size,
+                                                           outbox_records)
+        for operation_index, (kind, index) in enumerate(operation_refs):
+            if operation_index in write_errors:
+                errors.append((index, write_errors[operation_index].get("errmsg")))
+                continue
+            counters[kind] += 1
+
+        if counters["updated"] or counters["deactivated"]:
+            await RESPONSE_CACHE.invalidate(self.cache_namespace)
+        return {**counters, "errors": errors}
+
+    async def get_object_history_page(self, object_id: PydanticObjectId,
+                                      since: datetime | None = None,
+                                      until: datetime | None = None,
+                                      limit: int = 100,
+                                      cursor: str | None = None
+                                      ) -> tuple[list[HistoryRecordModel], str | None] | None:
+        """
+        Страница истории объекта в хронологическом порядке. С сервера передаются только записи страницы
+        Args:
+            object_id: идентификатор объекта
+            since: начало интервала (включительно)
+            until: конец интервала (не включительно)
+            limit: размер страницы
+            cursor: токен продолжения, полученный с предыдущей страницей
+        Returns:
+            записи страницы и токен следующей страницы, None - если объект не найден
+        """
+        position = decode_cursor(cursor, 'history_datetime', False) if cursor else None
+
+        if self.history_in_collection:
+            if not await self._repository.find_one(self.collection_name, {"_id": object_id},
+                                                   extra_filter={"_id": 1}):
+                return None
+            query = {"object_id": object_id}
+            if since or until:
+                query["history_datetime"] = {key: value for key, value in (("$gte", since), ("$lt", until)) if value}
+            if position:
+                query = {"$and": [query, keyset_query(position)]}
+            history_documents = await self._repository.find(self.history_collection_name, query,
+                                                            sort=keyset_sort('history_datetime', False),
+                                                            limit=limit + 1)
+            records = [self._history_record_from_document(document) for document in history_documents]
+        else:
+            conditions = []
+            if since:
+                conditions.append({"$gte": ["$$record.history_datetime", since]})
+            if until:
+                conditions.append({"$lt": ["$$record.history_datetime", until]})
+            if position:
+                conditions.append({"$or": [
+                    {"$gt": ["$$record.history_datetime", position["v"]]},
+                    {"$and": [{"$eq": ["$$record.history_datetime", position["v"]]},
+                              {"$gt": ["$$record.history_id", position["id"]]}]}
+                ]})
+            # История дописывается в конец массива, поэтому порядок элементов хронологический
+            pipeline = [
+                {"$match": {"_id": object_id}},
+                {"$project": {"_id": 0, "history": {"$slice": [
+                    {"$filter": {"input": {"$ifNull": ["$history", []]},
+                                 "as": "record",
+                                 "cond": {"$and": conditions}}},
+                    limit + 1
+                ]}}},
+            ]
+            data = await self._repository.aggregate(self.collection_name, pipeline)
+            if not data:
+                return None
+            records = [HistoryRecordModel(**record) for record in data[0]["history"]]
+
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = encode_cursor({"_id": records[-1].history_id,
+                                         "history_datetime": records[-1].history_datetime},
+                                        'history_datetime', False)
+        return records, next_cursor
 
     async def get_object_history_record(self, object_id: PydanticObjectId, history_id: PydanticObjectId):
+        if self.history_in_collection:
+            data = await self._repository.find_one(self.history_collection_name,
+                                                   query={"_id": history_id, "object_id": object_id})
+            return self._history_record_from_document(data) if data else None
+
         data = await self._repository.find_one(self.collection_name,
                                                query={"_id": object_id},
                                                extra_filter={"history": {"$elemMatch": {"history_id": history_id}}}
@@ -44,19 +434,170 @@ class MongoRegisterRepository(DataBaseObjectRepository):
             return HistoryRecordModel(**data["history"][0])
 
     async def update_one(self, object_id: PydanticObjectId, update_data: dict, session=None) -> RegisterObjectModel:
-        existing_object: RegisterObjectModel = await self.find_one_by_id(object_id, exclude_fields={"history"})
-        object_unique_fields = await get_object_unique_fields(self.collection_name)
+        """
+        Обновление объекта с добавлением исторической записи его нового состояния.
+        При хранении истории в документе объект обновляется за одно обращение к БД (findOneAndUpdate с pipeline).
+        При хранении истории в коллекции или наличии подписчиков outbox обновление выполняется в транзакции
+        с исторической записью и записью outbox
+        """
+        if not update_data:
+            raise ValueError("No fields to update")
+        object_unique_fields = (await TYPE_REGISTRY.require(self.collection_name)).unique_fields
         if set(object_unique_fields).intersection(set(update_data.keys())):
             raise ValueError("Object unique fields cant be updated")
-        history_object_data = existing_object.model_dump(exclude={"history", "id"})
-        history_object_data.update(update_data)
-        history_object = HistoryRecordModel(**history_object_data, history_datetime=datetime.now(UTC))
-        history_object_dump = history_object.model_dump(exclude={'history_id'})
-        history_object_dump['history_id'] = history_object.history_id
 
         query = {"_id": object_id}
-        update_data = {"$set": update_data,
-                       "$push": {"history": history_object_dump}}
-
-        data = await super().find_one_and_update(query, update_data, session)
+        subscribers = outbox_subscribers(self.collection_name)
+        if self._transactional(subscribers):
+            data = await self._update_in_transaction(query, update_data, subscribers, session)
+        else:
+            before, _ = await self._update_embedded(query, update_data, session)
+            data = self.model.model_validate({**before, **update_data}) if before else None
+        # Сбрасывается поколение пространства имен, а не ключ объекта: ответ, прочитанный из БД до записи
+        # параллельным запросом, сохраняется с прежним поколением и не будет выдан из кэша
+        await RESPONSE_CACHE.invalidate(self.cache_namespace)
         return data
+
+    @staticmethod
+    def _embedded_history_update(update_data: dict, history_id: ObjectId) -> list[dict]:
+        """Pipeline обновления объекта с добавлением в history снимка его нового состояния, построенного на сервере"""
+        history_record = {"$mergeObjects": [
+            {"$arrayToObject": {"$filter": {"input": {"$objectToArray": "$$ROOT"},
+                                            "cond": {"$not": {"$in": ["$$this.k", ["_id", "history"]]}}}}},
+            {"history_id": history_id, "history_datetime": "$$NOW"},
+        ]}
+        return [
+            # $literal: значения полей не должны интерпретироваться как выражения агрегации
+            {"$set": {field: {"$literal": value} for field, value in update_data.items()}},
+            {"$set": {"history": {"$concatArrays": [{"$cond": [{"$isArray": "$history"}, "$history", []]},
+                                                    [history_record]]}}},
+        ]
+
+    async def _update_embedded(self, query: dict, update_data: dict, session=None) -> tuple[dict | None, ObjectId]:
+        """
+        Обновление объекта и добавление в history снимка его нового состояния одним findOneAndUpdate с pipeline.
+        Снимок строится на сервере из $$ROOT после $set, поэтому история верна при конкурентных изменениях
+        Returns:
+            состояние объекта до обновления без истории (None, если объект не найден)
+            и идентификатор исторической записи
+        """
+        history_id = ObjectId()
+        before = await self._repository.find_one_and_update(self.collection_name, query,
+                                                            self._embedded_history_update(update_data, history_id),
+                                                            session=session, projection={"history": 0},
+                                                            return_document=ReturnDocument.BEFORE)
+        return before, history_id
+
+    async def _update_in_transaction(self, query: dict, update_data: dict, subscribers: list[str],
+                                     session=None) -> RegisterObjectModel | None:
+        """
+        Обновление объекта в одной транзакции с исторической записью и записью outbox.
+        Новое состояние объекта получается наложением изменений на состояние до обновления:
+        по ним строится историческая запись и определяются измененные notify_fields без дополнительного чтения.
+        Запись outbox создается, только если изменились notify_fields объекта
+        """
+        async def write(write_session) -> dict | None:
+            if self.history_in_collection:
+                before = await self._repository.find_one_and_update(self.collection_name, query,
+                                                                    {"$set": update_data}, session=write_session,
+                                                                    projection={"history": 0},
+                                                                    return_document=ReturnDocument.BEFORE)
+                if before is None:
+                    return None
+                _, history_record_dump = self._history_update(before, update_data)
+                history_id = history_record_dump['history_id']
+                await self._repository.insert_one(self.history_collection_name,
+                                                  self._history_document(history_record_dump, before["_id"]),
+                                                  session=write_session)
+            else:
+                before, history_id = await self._update_embedded(query, update_data, write_session)
+                if before is None:
+                    return None
+            after = {**before, **update_data}
+            record = self._outbox_record(before, after, history_id, subscribers)
+            if record is not None:
+                await self._repository.insert_one(OUTBOX_COLLECTION, record, session=write_session)
+            return after
+
+        after = await self._transaction(session, write)
+        return self.model.model_validate(after) if after is not None else None
+
+    async def delete_one_by_id(self, object_id: PydanticObjectId, session=None) -> bool:
+        """Удаление объекта. История в коллекции истории удаляется в одной транзакции с объектом"""
+        delete_object = super().delete_one_by_id
+
+        async def delete(write_session) -> bool:
+            object_deleted = await delete_object(object_id, session=write_session)
+            if object_deleted and self.history_in_collection:
+                await self._repository.delete_many(self.history_collection_name, {"object_id": object_id},
+                                                   session=write_session)
+            return object_deleted
+
+        deleted = await self._transaction(session, delete, self.history_in_collection)
+        await RESPONSE_CACHE.invalidate(self.cache_namespace)
+        return deleted
+
+    async def find_one_versioned_raw(self, object_id: PydanticObjectId) -> tuple[dict | None, Any]:
+        """
+        Чтение документа без истории вместе с его версией - идентификатором последней исторической записи,
+        который меняется при каждом изменении объекта
+        Returns:
+            документ (None, если объект не найден) и версия (None для объектов без истории)
+        """
+        query = {"_id": object_id}
+        if self.history_in_collection:
+            document = await self._repository.find_one(self.collection_name, query, {"history"})
+            if document is None:
+                return None, None
+            latest = await self._repository.find(self.history_collection_name, {"object_id": object_id},
+                                                 sort=[("history_datetime", -1)], limit=1)
+            return document, latest[0]["_id"] if latest else None
+
+        document = await self._repository.find_one(self.collection_name, query,
+                                                   extra_filter={"history": {"$slice": -1}})
+        if document is None:
+            return None, None
+        history = document.pop("history", None) or []
+        return document, history[-1]["history_id"] if history else None
+
+    async def ensure_history_collection(self):
+        """Создание коллекции истории и ее индекса, если они еще не созданы"""
+        await self._repository.db[self.history_collection_name].create_index(list(HISTORY_INDEX_SPEC))
+
+    async def migrate_embedded_history(self, batch_size: int = 1000) -> int:
+        """
+        Перенос истории из массива history документов в коллекцию истории пачками по batch_size объектов.
+        Повторный запуск безопасен: уже перенесенные записи пропускаются по _id.
+        Returns:
+            количество перенесенных исторических записей
+        """
+        await self.ensure_history_collection()
+        migrated_count = 0
+        last_id = None
+        while True:
+            query = {"history.0": {"$exists": True}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            objects = await self._repository.find(self.collection_name, query,
+                                                  sort=[('_id', 1)], limit=batch_size)
+            if not objects:
+                return migrated_count
+            last_id = objects[-1]["_id"]
+
+            history_documents = [self._history_document(record, object_data["_id"])
+                                 for object_data in objects
+                                 for record in object_data["history"]]
+            try:
+                await self._repository.insert_many(self.history_collection_name, history_documents, ordered=False)
+            except BulkWriteError as ex:
+                # Записи, перенесенные при предыдущем запуске, уже есть в коллекции истории
+                if any(error["code"] != 11000 for error in ex.details["writeErrors"]):
+                    raise
+            # Удаляются только перенесенные записи, чтобы не потерять записи, добавленные во время миграции
+            await self._repository.bulk_write(self.collection_name, [
+                UpdateOne({"_id": object_data["_id"]},
+                          {"$pull": {"history": {"history_id": {
+                              "$in": [record["history_id"] for record in object_data["history"]]}}}})
+                for object_data in objects
+            ])
+            migrated_count += len(history_documents)
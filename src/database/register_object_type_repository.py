@@ -1,53 +1,116 @@
 import asyncio
+import logging
 from functools import lru_cache
 from types import UnionType
-from async_lru import alru_cache
 from typing import List, Union, Any, Iterable
 
 from beanie import PydanticObjectId
 from pydantic import BaseModel
 from cachetools import cached, TTLCache
+from pymongo import ASCENDING, TEXT
 
+from config.config import SETTINGS
+from database.field_index_builder import FIELD_INDEX_BUILDER
 from database.mongo_repository import MongoDataBaseRepository, DataBaseObjectRepository
-from models.register_object_type import RegisterObjectTypeModel
+from database.register_type_registry import TYPE_REGISTRY, REGISTER_TYPE_COLLECTION
+from library.response_cache import RESPONSE_CACHE, REGISTER_TYPE_NAMESPACE, register_objects_namespace
+from models.register_object_type import RegisterObjectTypeModel, HISTORY_COLLECTION_SUFFIX
+
+logger = logging.getLogger(__name__)
 
 register_object_collection = RegisterObjectTypeModel
 
+HISTORY_INDEX_SPEC = (('object_id', 1), ('history_datetime', 1))
+EMBEDDED_HISTORY_INDEX_SPEC = (('_id', 1), ('history.history_id', 1))
+TYPE_UNIQUE_FIELDS = ('slug', 'name')
+
+
+def history_collection_name(slug: str) -> str:
+    """Имя коллекции истории объектов типа реестра"""
+    return f"{slug}{HISTORY_COLLECTION_SUFFIX}"
+
 
-# TODO: Переписать на другую реализацию кэша
-@alru_cache(maxsize=1024)
-async def get_object_default_notify_fields(slug: str):
-    type_object: RegisterObjectTypeModel = await MongoRegisterTypeRepository().find_one({"slug": slug})
-    return type_object.notify_fields
+def unique_index_spec(unique_fields: Iterable[str]) -> list[tuple[str, int]]:
+    """
+    Спецификация уникального составного индекса по полям в порядке их объявления в типе.
+    Строковые поля индексируются так же, как остальные: B-tree индекс обеспечивает точную уникальность
+    и используется для поиска по равенству
+    """
+    return [(field, ASCENDING) for field in unique_fields]
 
 
-@alru_cache(maxsize=1024)
-async def get_object_unique_fields(slug: str):
-    type_object = await MongoRegisterTypeRepository().find_one({"slug": slug})
-    return type_object.unique_fields
+def collection_collation() -> dict | None:
+    """Collation коллекции объектов нового типа из настроек"""
+    if not SETTINGS.UNIQUE_INDEX_COLLATION_LOCALE:
+        return None
+    return {"locale": SETTINGS.UNIQUE_INDEX_COLLATION_LOCALE, "strength": SETTINGS.UNIQUE_INDEX_COLLATION_STRENGTH}
+
+
+def _index_keys(index: dict) -> list[tuple[str, int | str]]:
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in index["key"]]
 
 
 class MongoRegisterTypeRepository(DataBaseObjectRepository):
     def __init__(self):
-        super().__init__('register_type', model=RegisterObjectTypeModel)
+        super().__init__(REGISTER_TYPE_COLLECTION, model=RegisterObjectTypeModel)
 
-    def __create_index_specification_from_json_schema(self, json_schema: dict, unique_fields: Iterable[str]) -> list[
-        tuple[str, int | str]]:
+    async def ensure_indexes(self):
+        """
+        Создание уникальных индексов коллекции типов по slug и name.
+        Повторный вызов не изменяет существующие индексы, индекс по slug используется для поиска типа по slug.
+        Индекс по полю с повторяющимися значениями не создается: дубликаты записываются в лог,
+        индекс будет создан при следующем запуске после их устранения
         """
-        Создает спецификацию для создания индексов в  MongoDB исходя из переданной json схемы
-        Args:
-            json_schema: JsonSchema
+        indexes = await self._repository.index_information(self.collection_name)
+        for field in TYPE_UNIQUE_FIELDS:
+            keys = [(field, ASCENDING)]
+            if any(_index_keys(index) == keys and index.get("unique") for index in indexes.values()):
+                continue
+            duplicates = await self._repository.aggregate(self.collection_name, [
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}, "ids": {"$push": "$_id"}}},
+                {"$match": {"count": {"$gt": 1}}},
+            ])
+            if duplicates:
+                logger.error("Unique index on register types %s is not created, duplicate values: %s", field,
+                             "; ".join(f"{duplicate['_id']!r} in types {[str(type_id) for type_id in duplicate['ids']]}"
+                                       for duplicate in duplicates))
+                continue
+            await self._repository.create_index(self.collection_name, keys, unique=True)
+
+    async def find_one_by_slug_raw(self, slug: str) -> dict | None:
+        return await self.find_one_raw({"slug": slug})
+
+    async def reindex(self, register_type: RegisterObjectTypeModel) -> list[str]:
+        """
+        Перестроение уникального индекса коллекции объектов типа по текущим unique_fields без остановки записи.
+        Новый индекс строится до удаления прежних, поэтому уникальность обеспечивается во время перестроения.
+        Удаляются прежние уникальные и текстовые индексы полей типа
         Returns:
-            лист вида [('int_field_name', 1), (string_field_name, 'text')]
+            имена удаленных индексов
         """
-
-        index_fields_spec = [
-            (field, "text" if "str" in str(json_schema["$jsonSchema"]['properties'][field]) else 1)
-            for field
-            in
-            unique_fields]
-        # Текстовые поля в индексе должны быть смежными в спецификации индекса, поэтому применена сортировка
-        return sorted(index_fields_spec, key=lambda x: x[1] != 1)
+        slug = register_type.slug
+        keys = unique_index_spec(register_type.unique_fields)
+        indexes = await self._repository.index_information(slug)
+
+        dropped = []
+        for name, index in indexes.items():
+            index_keys = _index_keys(index)
+            if name == '_id_' or index_keys == list(EMBEDDED_HISTORY_INDEX_SPEC):
+                continue
+            if index_keys == keys and index.get("unique"):
+                continue
+            if index_keys == keys or index.get("unique") or any(direction == TEXT for _, direction in index_keys):
+                dropped.append(name)
+
+        # Индекс с теми же полями, но без уникальности, нужно удалить до создания уникального
+        for name in [name for name in dropped if _index_keys(indexes[name]) == keys]:
+            await self._repository.drop_index(slug, name)
+        if keys:
+            await self._repository.create_index(slug, keys, unique=True)
+        for name in [name for name in dropped if _index_keys(indexes[name]) != keys]:
+            await self._repository.drop_index(slug, name)
+        return dropped
 
     async def insert_one(self, document: RegisterObjectTypeModel, session=None):
         """
@@ -59,21 +122,27 @@ class MongoRegisterTypeRepository(DataBaseObjectRepository):
             async with in_session.start_transaction():
                 result = await super().insert_one(document,
                                                   session=in_session)
-                register_json_schema = document.fields_json_schema()
-                index_spec = [(self.__create_index_specification_from_json_schema(register_json_schema,
-                                                                                  document.unique_fields), True),
-                              ]
-                history_index = ((('_id', 1), ('history.history_id', 1)), True)
-                index_spec.append(history_index)
-
                 await self._repository.create_collection(
                     collection_name=document.slug,
-                    json_validation_schema=register_json_schema,
-                    index_fields_spec=index_spec,
+                    json_validation_schema=document.fields_json_schema(),
+                    index_fields_spec=[(EMBEDDED_HISTORY_INDEX_SPEC, True)],
                     level='strict',
+                    collation=collection_collation(),
                     session=in_session)
-        created_object = await self.find_one({"_id": result})
-        return created_object
+                if document.unique_fields:
+                    await self._repository.create_index(document.slug, unique_index_spec(document.unique_fields),
+                                                        unique=True, session=in_session)
+                await self._repository.create_collection(
+                    collection_name=history_collection_name(document.slug),
+                    json_validation_schema=None,
+                    index_fields_spec=[(HISTORY_INDEX_SPEC, False)],
+                    session=in_session)
+        await TYPE_REGISTRY.publish_invalidation(document.slug)
+        TYPE_REGISTRY.add_slug(document.slug)
+        if any(field.index is not None for field in document.fields):
+            FIELD_INDEX_BUILDER.schedule(document)
+        await RESPONSE_CACHE.invalidate(REGISTER_TYPE_NAMESPACE)
+        return document.model_copy(update={"id": result})
 
     async def delete_one(self, query, session=None) -> bool:
         """
@@ -90,7 +159,14 @@ class MongoRegisterTypeRepository(DataBaseObjectRepository):
                 # невозможно сбросить коллекцию внутри транзакции,
                 # но в случае ошибки при сбросе коллекции сделанные выше изменения откатсятся:
                 await self._repository.db[register_object_collection_name].drop()
-                return True
+                await self._repository.db[history_collection_name(register_object_collection_name)].drop()
+
+        # Кэши сбрасываются после фиксации транзакции: иначе другой процесс успеет загрузить удаляемый тип
+        await TYPE_REGISTRY.publish_invalidation(register_object_collection_name, deleted=True)
+        await FIELD_INDEX_BUILDER.forget(register_object_collection_name)
+        await RESPONSE_CACHE.invalidate(REGISTER_TYPE_NAMESPACE)
+        await RESPONSE_CACHE.invalidate(register_objects_namespace(register_object_collection_name))
+        return True
 
     async def delete_one_by_id(self, object_id: PydanticObjectId, session=None) -> bool:
         """Удаление объекта и связанной с ним коллекции реестра"""
@@ -120,4 +196,10 @@ class MongoRegisterTypeRepository(DataBaseObjectRepository):
                     await self._repository.update_schema(updated_object.slug,
                                                          updated_object.fields_json_schema())
 
-                return updated_object
+        if 'fields' in update.keys():
+            # вторичные индексы полей строятся в фоне по зафиксированному описанию типа
+            FIELD_INDEX_BUILDER.schedule(updated_object)
+        # Кэши сбрасываются после фиксации транзакции: иначе другой процесс успеет загрузить прежнее описание типа
+        await TYPE_REGISTRY.publish_invalidation(updated_object.slug)
+        await RESPONSE_CACHE.invalidate(REGISTER_TYPE_NAMESPACE)
+        return updated_object
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import time
+
+from bson import json_util
+from pydantic import BaseModel
+from pymongo.errors import PyMongoError
+
+from config.config import SETTINGS
+from database.field_index_builder import FIELD_INDEX_BUILDS_COLLECTION
+from database.mongo_repository import MongoDataBaseRepository
+from database.outbox import OUTBOX_COLLECTION
+from database.query_filters import register_field_types
+from library.cache import CacheBackend, CACHE_BACKEND
+from library.metrics import count_cache_lookup
+from models.register_object_type import RegisterObjectTypeModel, SupportedTypes, HISTORY_COLLECTION_SUFFIX
+from schemas.register_object import compile_register_object_schemas
+
+logger = logging.getLogger(__name__)
+
+REGISTER_TYPE_COLLECTION = 'register_type'
+# Служебные коллекции, которые не являются коллекциями объектов типов
+SERVICE_COLLECTIONS = {REGISTER_TYPE_COLLECTION, FIELD_INDEX_BUILDS_COLLECTION, OUTBOX_COLLECTION}
+# Канал сообщений о сбросе записей типов во всех процессах приложения
+TYPE_INVALIDATION_CHANNEL = 'register_type_invalidation'
+
+
+class RegisterTypeEntry:
+    """Закэшированный тип реестра и производные от него данные"""
+
+    def __init__(self, type_object: RegisterObjectTypeModel, expires_at: float):
+        self.type_object = type_object
+        self.expires_at = expires_at
+        self.field_types: dict[str, SupportedTypes] = register_field_types(type_object.fields)
+        self.required_fields = {field.name for field in type_object.fields if not field.optional}
+        # Строгие схемы создания и обновления объекта типа компилируются один раз на запись реестра
+        create_schema, update_schema = compile_register_object_schemas(type_object)
+        self.create_schema: type[BaseModel] = create_schema
+        self.update_schema: type[BaseModel] = update_schema
+
+    @property
+    def notify_fields(self) -> list[str]:
+        return self.type_object.notify_fields
+
+    @property
+    def unique_fields(self) -> list[str]:
+        return self.type_object.unique_fields
+
+
+class RegisterTypeRegistry:
+    """
+    Реестр метаданных типов объектов в памяти процесса.
+    Каждый тип загружается из БД один раз и хранится не дольше ttl секунд.
+    Записи сбрасываются при изменении типа через MongoRegisterTypeRepository,
+    а при включенном TYPE_REGISTRY_WATCH_CHANGES - по change stream коллекции типов.
+    С общим для процессов хранилищем кэша (CACHE_BACKEND=redis) документы типов
+    читаются из него до обращения к БД, а сброс записей рассылается всем процессам через канал хранилища
+    """
+
+    def __init__(self, ttl: float, slugs_refresh_interval: float, backend: CacheBackend):
+        self.ttl = ttl
+        self.slugs_refresh_interval = slugs_refresh_interval
+        self.backend = backend
+        self._entries: dict[str, RegisterTypeEntry] = {}
+        self._slugs_by_id: dict = {}
+        self._known_slugs: set[str] = set()
+        self._slugs_refreshed_at: float | None = None
+        # Открытые источники сообщений о сбросе: change stream коллекции типов и подписка на канал сброса
+        self._live_sources = 0
+
+    async def get(self, slug: str) -> RegisterTypeEntry | None:
+        entry = self._entries.get(slug)
+        hit = entry is not None and entry.expires_at > time.monotonic()
+        count_cache_lookup("type_registry", hit)
+        if hit:
+            return entry
+
+        data = await self._load(slug)
+        if data is None:
+            self._entries.pop(slug, None)
+            return None
+        entry = RegisterTypeEntry(RegisterObjectTypeModel.model_validate(data), time.monotonic() + self.ttl)
+        self._entries[slug] = entry
+        self._slugs_by_id[entry.type_object.id] = slug
+        return entry
+
+    async def _load(self, slug: str) -> dict | None:
+        """Документ типа из общего хранилища кэша или из БД"""
+        shared_key = f"register_type:{slug}"
+        if self.backend.shared:
+            cached = await self.backend.get(shared_key)
+            count_cache_lookup("type_shared", cached is not None)
+            if cached is not None:
+                return json_util.loads(cached)
+        data = await MongoDataBaseRepository().find_one(REGISTER_TYPE_COLLECTION, {"slug": slug})
+        if data is not None and self.backend.shared:
+            await self.backend.set(shared_key, json_util.dumps(data).encode(), self.ttl)
+        return data
+
+    async def require(self, slug: str) -> RegisterTypeEntry:
+        entry = await self.get(slug)
+        if entry is None:
+            raise ValueError(f"Register Object type {slug} not found")
+        return entry
+
+    @property
+    def invalidations_live(self) -> bool:
+        """Сообщения об удалении типов другими процессами доставляются в этот процесс"""
+        return self._live_sources > 0
+
+    async def slug_exists(self, slug: str, for_write: bool = False) -> bool:
+        """
+        Проверка существования коллекции объектов типа по кэшу известных slug.
+        Кэш периодически обновляется полным списком коллекций,
+        при промахе выполняется один запрос listCollections с фильтром по имени.
+        Тип мог быть удален другим процессом: если сообщения об удалении не доставляются,
+        перед записью (for_write) существование коллекции подтверждается запросом к БД -
+        вставка в удаленную коллекцию создала бы ее заново без схемы валидации
+        """
+        if slug in SERVICE_COLLECTIONS or slug.endswith(HISTORY_COLLECTION_SUFFIX):
+            return False
+        if self._slugs_refreshed_at is None or \
+                time.monotonic() - self._slugs_refreshed_at > self.slugs_refresh_interval:
+            await self.refresh_slugs()
+        cached = slug in self._known_slugs and (self.invalidations_live or not for_write)
+        count_cache_lookup("type_slugs", cached)
+        if cached:
+            return True
+        if await MongoDataBaseRepository().collection_exists(slug):
+            self._known_slugs.add(slug)
+            return True
+        self.discard_slug(slug)
+        return False
+
+    async def refresh_slugs(self):
+        self._known_slugs = set(await MongoDataBaseRepository().list_collections())
+        self._slugs_refreshed_at = time.monotonic()
+
+    def add_slug(self, slug: str):
+        self._known_slugs.add(slug)
+
+    def reset(self):
+        """Сброс всех записей и списка известных slug, например после пропуска сообщений о сбросе"""
+        self.invalidate()
+        self._slugs_refreshed_at = None
+
+    def discard_slug(self, slug: str):
+        self._known_slugs.discard(slug)
+        self.invalidate(slug)
+
+    def invalidate(self, slug: str | None = None):
+        """Сброс записи типа. Без slug сбрасываются все записи"""
+        if slug is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(slug, None)
+
+    async def publish_invalidation(self, slug: str, deleted: bool = False):
+        """
+        Сброс записи типа в этом процессе и в общем хранилище кэша
+        с рассылкой сообщения о сбросе остальным процессам приложения
+        """
+        if deleted:
+            self.discard_slug(slug)
+        else:
+            self.invalidate(slug)
+        if self.backend.shared:
+            await self.backend.delete(f"register_type:{slug}")
+            await self.backend.publish(TYPE_INVALIDATION_CHANNEL, json.dumps({"slug": slug, "deleted": deleted}))
+
+    async def listen_invalidations(self):
+        """Сброс записей по сообщениям других процессов. Выполняется до отмены задачи"""
+        while True:
+            self._live_sources += 1
+            try:
+                async for message in self.backend.subscribe(TYPE_INVALIDATION_CHANNEL):
+                    invalidation = json.loads(message)
+                    if invalidation["deleted"]:
+                        self.discard_slug(invalidation["slug"])
+                    else:
+                        self.invalidate(invalidation["slug"])
+            except Exception as ex:
+                logger.warning("Register type invalidation subscription failed, restarting: %s", ex)
+            finally:
+                self._live_sources -= 1
+            # Сообщения, отправленные до восстановления подписки, могли быть пропущены
+            self.reset()
+            await asyncio.sleep(1)
+
+    async def watch_changes(self):
+        """Сброс записей по change stream коллекции типов. Выполняется до отмены задачи"""
+        collection = MongoDataBaseRepository().db[REGISTER_TYPE_COLLECTION]
+        while True:
+            try:
+                async with collection.watch(full_document='updateLookup') as stream:
+                    # Изменения, произошедшие до открытия потока, могли быть пропущены
+                    self.reset()
+                    self._live_sources += 1
+                    try:
+                        async for change in stream:
+                            object_id = change.get("documentKey", {}).get("_id")
+                            slug = (change.get("fullDocument") or {}).get("slug") \
+                                or self._slugs_by_id.get(object_id)
+                            self.invalidate(slug)
+                            if change["operationType"] == "delete":
+                                if slug is None:
+                                    # slug удаленного типа неизвестен, список коллекций будет перечитан
+                                    self._slugs_refreshed_at = None
+                                else:
+                                    self.discard_slug(slug)
+                    finally:
+                        self._live_sources -= 1
+            except PyMongoError as ex:
+                logger.warning("Register type change stream failed, restarting: %s", ex)
+                self.reset()
+                await asyncio.sleep(1)
+
+
+TYPE_REGISTRY = RegisterTypeRegistry(ttl=SETTINGS.TYPE_REGISTRY_TTL_SECONDS,
+                                     slugs_refresh_interval=SETTINGS.TYPE_SLUGS_REFRESH_SECONDS,
+                                     backend=CACHE_BACKEND)
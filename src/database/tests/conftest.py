@@ -0,0 +1,28 @@
+import pytest
+
+import config.config as config
+from config.config import SETTINGS
+from models.register_object_type import RegisterObjectTypeModel
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """Общий клиент MongoDB подменяется на mongomock на время теста"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    monkeypatch.setattr(SETTINGS, "DATABASE_NAME", "database_tests")
+    monkeypatch.setattr(config, "_mongo_client", mongomock_motor.AsyncMongoMockClient())
+    return config.get_db()
+
+
+@pytest.fixture
+def make_register_type():
+    """Описание тестового типа с полями title и size"""
+
+    def make(slug: str, **kwargs) -> RegisterObjectTypeModel:
+        data = {"name": "Test type", "description": "Тестовый тип", "slug": slug,
+                "notify_fields": ["title"], "unique_fields": [],
+                "fields": [{"name": "title", "type": "str"}, {"name": "size", "type": "int", "optional": True}],
+                **kwargs}
+        return RegisterObjectTypeModel(**data)
+
+    return make
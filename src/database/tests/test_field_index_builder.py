@@ -0,0 +1,44 @@
+"""Тесты построения вторичных индексов полей типов"""
+import pytest
+
+from database.field_index_builder import FieldIndexBuilder
+
+
+@pytest.fixture
+def fields():
+    return [{"name": "field_code", "type": "str"}, {"name": "title", "type": "str", "index": {"kind": "ascending"}}]
+
+
+@pytest.mark.asyncio
+async def test_build_keeps_other_indexes(mock_db, make_register_type, fields):
+    """
+    Построение создает индексы полей и удаляет только свои индексы.
+    Уникальный индекс поля field_code с именем по умолчанию field_code_1 и неуникальный индекс,
+    созданный не построением, сохраняются
+    """
+    register_type = make_register_type("indexed", fields=fields, unique_fields=["field_code"])
+    collection = mock_db[register_type.slug]
+    await collection.create_index([("field_code", 1)], unique=True)
+    await collection.create_index([("field_title", 1)])
+
+    builder = FieldIndexBuilder()
+    await builder.schedule(register_type)
+    assert set(await collection.index_information()) == {"_id_", "field_code_1", "field_title_1", "field_title"}
+
+    # Индекс поля, с которого снят индекс, удаляется
+    await builder.schedule(make_register_type("indexed", fields=[fields[0], {"name": "title", "type": "str"}],
+                                              unique_fields=["field_code"]))
+    assert set(await collection.index_information()) == {"_id_", "field_code_1", "field_title_1"}
+    assert (await collection.index_information())["field_code_1"]["unique"]
+
+
+@pytest.mark.asyncio
+async def test_build_drops_removed_field_index(mock_db, make_register_type, fields):
+    """Индекс удаленного из типа поля удаляется по имени, сохраненному прежним построением"""
+    await mock_db["indexed"].insert_one({"field_code": "code"})
+    builder = FieldIndexBuilder()
+    await builder.schedule(make_register_type("indexed", fields=fields))
+    assert "field_title" in await mock_db["indexed"].index_information()
+
+    await builder.schedule(make_register_type("indexed", fields=fields[:1], notify_fields=[]))
+    assert set(await mock_db["indexed"].index_information()) == {"_id_"}
@@ -0,0 +1,64 @@
+"""Тесты доставки записей outbox подписчикам webhook"""
+import asyncio
+
+import httpx
+import pytest
+from bson import ObjectId
+
+from config.config import SETTINGS, WebhookSubscriber
+from database import webhook_dispatcher
+from database.outbox import OutboxRepository, OUTBOX_COLLECTION, OUTBOX_TTL_INDEX_NAME, outbox_record
+from database.webhook_dispatcher import WebhookDispatcher
+
+SUBSCRIBERS = [WebhookSubscriber(name="first", url="http://first.test"),
+               WebhookSubscriber(name="second", url="http://second.test")]
+
+
+@pytest.mark.asyncio
+async def test_failed_records_purged(mock_db):
+    """
+    Запись, доставленная всем подписчикам, удаляется сразу.
+    Запись, не доставленная одному из подписчиков, после доставки остальным получает отметку finished_at,
+    по которой ее удаляет TTL индекс
+    """
+    repository = OutboxRepository()
+    await repository.ensure_indexes()
+    ttl_index = (await mock_db[OUTBOX_COLLECTION].index_information())[OUTBOX_TTL_INDEX_NAME]
+    assert ttl_index["expireAfterSeconds"] == SETTINGS.OUTBOX_FAILED_RETENTION_SECONDS
+
+    delivered, failed = (outbox_record("outbox", "insert", {"_id": ObjectId()}, [], ObjectId(),
+                                       [subscriber.name for subscriber in SUBSCRIBERS]) for _ in range(2))
+    await mock_db[OUTBOX_COLLECTION].insert_many([delivered, failed])
+    await repository.acknowledge(SUBSCRIBERS[0], [delivered, failed])
+
+    await repository.reschedule(SUBSCRIBERS[1], [failed], "unavailable", max_attempts=1)
+    record = await mock_db[OUTBOX_COLLECTION].find_one({"_id": failed["_id"]})
+    assert record["failed"][0]["subscriber"] == "second"
+    assert "finished_at" in record
+
+    await repository.acknowledge(SUBSCRIBERS[1], [delivered])
+    assert await mock_db[OUTBOX_COLLECTION].count_documents({}) == 1
+
+
+@pytest.mark.asyncio
+async def test_worker_recovers(mock_db, monkeypatch):
+    """Ошибка доставки не останавливает обработчики: обработчик продолжает доставку после задержки"""
+    monkeypatch.setattr(webhook_dispatcher, "retry_delay", lambda attempts: 0)
+    dispatcher = WebhookDispatcher(SUBSCRIBERS, poll_interval=0, client=httpx.AsyncClient())
+    calls = {subscriber.name: 0 for subscriber in SUBSCRIBERS}
+
+    async def dispatch_batch(subscriber: WebhookSubscriber) -> int:
+        calls[subscriber.name] += 1
+        if subscriber.name == "first" and calls["first"] == 1:
+            raise RuntimeError("dispatch failed")
+        await asyncio.sleep(0.01)
+        return 0
+
+    monkeypatch.setattr(dispatcher, "dispatch_batch", dispatch_batch)
+    task = asyncio.create_task(dispatcher.run())
+    await asyncio.sleep(0.1)
+    assert not task.done()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert calls["first"] > 1 and calls["second"] > 1
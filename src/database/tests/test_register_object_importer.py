@@ -0,0 +1,32 @@
+"""Тесты разбора потока NDJSON потоковой загрузки"""
+import pytest
+
+from database.register_object_importer import split_lines, LineTooLongError
+
+
+async def chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+async def lines(*parts: bytes, max_length: int | None = None) -> list:
+    return [line if isinstance(line, bytes) else type(line)
+            async for line in split_lines(chunks(*parts), max_length)]
+
+
+@pytest.mark.asyncio
+async def test_split_lines():
+    """Строки собираются из частей потока, последняя строка без перевода строки не теряется"""
+    assert await lines(b'{"a": 1}\n{"a"', b': 2}\n\n{"a": 3}') == [b'{"a": 1}', b'{"a": 2}', b'', b'{"a": 3}']
+
+
+@pytest.mark.asyncio
+async def test_split_lines_too_long():
+    """Вместо слишком длинной строки возвращается ошибка, ее остаток не накапливается и пропускается"""
+    assert await lines(b'{"a": 1}\n' + b'x' * 20 + b'\n{"a": 2}\n', max_length=10) == \
+        [b'{"a": 1}', LineTooLongError, b'{"a": 2}']
+    # Строка без перевода строки длиннее ограничения в нескольких частях потока
+    assert await lines(b'{"a": 1}\nxxxxxxxx', b'xxxxxxxx', b'xxxxxxxx', b'xx\n{"a": 2}', max_length=10) == \
+        [b'{"a": 1}', LineTooLongError, b'{"a": 2}']
+    assert await lines(b'x' * 11, b'x' * 11, max_length=10) == [LineTooLongError]
+    assert await lines(b'x' * 10, max_length=10) == [b'x' * 10]
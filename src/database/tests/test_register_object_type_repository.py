@@ -0,0 +1,74 @@
+"""Тесты уникальных индексов коллекций объектов типов реестра"""
+import pytest
+
+from database.field_index_builder import FieldIndexBuilder
+from database.register_object_type_repository import MongoRegisterTypeRepository, unique_index_spec, \
+    REGISTER_TYPE_COLLECTION
+from reindex_types import reindex
+
+
+def test_unique_index_spec():
+    """Уникальный индекс строится по полям unique_fields в порядке объявления, строковые поля - B-tree"""
+    assert unique_index_spec(["title", "size"]) == [("title", 1), ("size", 1)]
+    assert unique_index_spec([]) == []
+
+
+@pytest.fixture
+async def indexed_collection(mock_db):
+    collection = mock_db["reindexed"]
+    await collection.insert_one({"title": "object", "size": 1})
+    # Индексы прежних версий: текстовый и уникальный по прежним unique_fields
+    await collection.create_index([("title", "text")])
+    await collection.create_index([("size", 1)], unique=True)
+    # Индексы, которыми reindex не управляет: вторичный индекс поля и созданный вручную
+    await collection.create_index([("title", 1)], name="field_title")
+    await collection.create_index([("size", -1)])
+    return collection
+
+
+@pytest.mark.asyncio
+async def test_reindex(indexed_collection, make_register_type):
+    """
+    Перестроение создает уникальный индекс по unique_fields и удаляет только прежние уникальные и текстовые индексы.
+    Повторное перестроение ничего не меняет
+    """
+    register_type = make_register_type("reindexed", unique_fields=["title", "size"],
+                                       fields=[{"name": "title", "type": "str", "index": {"kind": "ascending"}},
+                                               {"name": "size", "type": "int", "optional": True}])
+    repository = MongoRegisterTypeRepository()
+    assert sorted(await repository.reindex(register_type)) == ["size_1", "title_text"]
+
+    indexes = await indexed_collection.index_information()
+    assert set(indexes) == {"_id_", "title_1_size_1", "field_title", "size_-1"}
+    assert indexes["title_1_size_1"]["unique"]
+
+    assert await repository.reindex(register_type) == []
+    assert await indexed_collection.index_information() == indexes
+
+
+@pytest.mark.asyncio
+async def test_reindex_types(mock_db, indexed_collection, make_register_type):
+    """Скрипт перестраивает индексы выбранных типов по их описанию в БД"""
+    register_type = make_register_type("reindexed", unique_fields=["size"])
+    await mock_db[REGISTER_TYPE_COLLECTION].insert_one(register_type.model_dump(exclude={"id"}))
+
+    await reindex(["reindexed"])
+    indexes = await indexed_collection.index_information()
+    assert set(indexes) == {"_id_", "size_1", "field_title", "size_-1"}
+    assert indexes["size_1"]["unique"]
+
+
+@pytest.mark.asyncio
+async def test_reindex_field_prefix(mock_db, make_register_type):
+    """Уникальный индекс поля с именем field_... сохраняется при построении индексов полей типа"""
+    register_type = make_register_type("reindexed", unique_fields=["field_code"], notify_fields=[],
+                                       fields=[{"name": "field_code", "type": "str"},
+                                               {"name": "code", "type": "str", "index": {"kind": "ascending"}}])
+    await mock_db["reindexed"].insert_one({"field_code": "a", "code": "a"})
+    await MongoRegisterTypeRepository().reindex(register_type)
+    await FieldIndexBuilder().schedule(register_type)
+
+    indexes = await mock_db["reindexed"].index_information()
+    assert set(indexes) == {"_id_", "field_code_1", "field_code"}
+    assert indexes["field_code_1"]["unique"]
+    assert await MongoRegisterTypeRepository().reindex(register_type) == []
@@ -0,0 +1,137 @@
+"""Тесты кэша метаданных типов реестра"""
+import asyncio
+
+import pytest
+
+from database import register_object_repository
+from database.mongo_repository import MongoDataBaseRepository
+from database.register_object_repository import MongoRegisterRepository
+from database.register_type_registry import RegisterTypeRegistry, REGISTER_TYPE_COLLECTION
+from library.cache import MemoryCacheBackend, RedisCacheBackend
+
+
+async def insert_type(db, register_type) -> dict:
+    document = register_type.model_dump(exclude={"id"})
+    await db[REGISTER_TYPE_COLLECTION].insert_one(document)
+    await db[register_type.slug].insert_one({"title": "object"})
+    return document
+
+
+@pytest.mark.asyncio
+async def test_entry_expires(mock_db, make_register_type):
+    """Запись типа хранится не дольше ttl, после истечения перечитывается из БД"""
+    registry = RegisterTypeRegistry(ttl=0.2, slugs_refresh_interval=60, backend=MemoryCacheBackend(100, 60))
+    await insert_type(mock_db, make_register_type("registry_ttl"))
+    assert (await registry.require("registry_ttl")).notify_fields == ["title"]
+
+    await mock_db[REGISTER_TYPE_COLLECTION].update_one({"slug": "registry_ttl"},
+                                                       {"$set": {"notify_fields": ["size"]}})
+    assert (await registry.require("registry_ttl")).notify_fields == ["title"]
+    await asyncio.sleep(0.3)
+    assert (await registry.require("registry_ttl")).notify_fields == ["size"]
+
+
+@pytest.fixture
+def processes():
+    """Реестры двух процессов приложения с общим хранилищем кэша Redis"""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return [RegisterTypeRegistry(ttl=60, slugs_refresh_interval=60,
+                                 backend=RedisCacheBackend(fakeredis.FakeAsyncRedis(server=server), ttl=60,
+                                                           prefix="test:"))
+            for _ in range(2)]
+
+
+@pytest.mark.asyncio
+async def test_invalidation_from_other_process(mock_db, make_register_type, processes):
+    """Создание, изменение и удаление типа в одном процессе сбрасывают запись типа в другом процессе"""
+    writer, reader = processes
+    listener = asyncio.create_task(reader.listen_invalidations())
+    # Подписка на канал выполняется при первом обращении к итератору
+    await asyncio.sleep(0.1)
+    try:
+        assert await reader.get("registry_pubsub") is None
+        assert not await reader.slug_exists("registry_pubsub")
+
+        await insert_type(mock_db, make_register_type("registry_pubsub"))
+        await writer.publish_invalidation("registry_pubsub")
+        writer.add_slug("registry_pubsub")
+        await asyncio.sleep(0.1)
+        assert (await reader.require("registry_pubsub")).notify_fields == ["title"]
+        assert await reader.slug_exists("registry_pubsub", for_write=True)
+
+        await mock_db[REGISTER_TYPE_COLLECTION].update_one({"slug": "registry_pubsub"},
+                                                           {"$set": {"notify_fields": ["size"]}})
+        await writer.publish_invalidation("registry_pubsub")
+        await asyncio.sleep(0.1)
+        assert (await reader.require("registry_pubsub")).notify_fields == ["size"]
+
+        await mock_db[REGISTER_TYPE_COLLECTION].delete_one({"slug": "registry_pubsub"})
+        await mock_db["registry_pubsub"].drop()
+        await writer.publish_invalidation("registry_pubsub", deleted=True)
+        await asyncio.sleep(0.1)
+        assert await reader.get("registry_pubsub") is None
+        # mongomock находит удаленную коллекцию по фильтру имени, поэтому проверяется кэш известных slug
+        assert "registry_pubsub" not in reader._known_slugs
+    finally:
+        listener.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await listener
+
+
+@pytest.fixture
+def collections(monkeypatch):
+    """Существующие коллекции типов, которые видит запрос listCollections с фильтром, и счетчик таких запросов"""
+    existing, lookups = {"registry_slugs"}, []
+
+    async def collection_exists(self, collection_name: str, session=None) -> bool:
+        lookups.append(collection_name)
+        return collection_name in existing
+
+    monkeypatch.setattr(MongoDataBaseRepository, "collection_exists", collection_exists)
+    return existing, lookups
+
+
+@pytest.mark.asyncio
+async def test_slug_lookup_for_write(mock_db, collections, monkeypatch):
+    """Чтение использует кэш известных slug, запись подтверждает существование коллекции запросом к БД"""
+    existing, lookups = collections
+    registry = RegisterTypeRegistry(ttl=60, slugs_refresh_interval=60, backend=MemoryCacheBackend(100, 60))
+    monkeypatch.setattr(register_object_repository, "TYPE_REGISTRY", registry)
+    await mock_db["registry_slugs"].insert_one({"title": "object"})
+    repository = MongoRegisterRepository("registry_slugs")
+
+    assert await repository.collection_exists()
+    assert lookups == []
+    assert await repository.collection_exists(for_write=True)
+    assert lookups == ["registry_slugs"]
+
+    # Тип удален другим процессом, сообщения о сбросе не доставляются: чтение еще использует кэш, запись - нет
+    existing.clear()
+    assert await repository.collection_exists()
+    assert not await repository.collection_exists(for_write=True)
+    assert not await repository.collection_exists()
+
+    # При доставке сообщений о сбросе запись использует кэш
+    existing.add("registry_slugs")
+    registry.add_slug("registry_slugs")
+    registry._live_sources = 1
+    lookups.clear()
+    assert await repository.collection_exists(for_write=True)
+    assert lookups == []
+
+
+@pytest.mark.asyncio
+async def test_deleted_type_stops_resolving(mock_db, collections, make_register_type):
+    """Удаленный тип перестает находиться сразу после сброса его записи, без ожидания обновления кэша slug"""
+    existing, _ = collections
+    registry = RegisterTypeRegistry(ttl=60, slugs_refresh_interval=60, backend=MemoryCacheBackend(100, 60))
+    await insert_type(mock_db, make_register_type("registry_slugs"))
+    assert await registry.slug_exists("registry_slugs")
+    assert await registry.get("registry_slugs") is not None
+
+    await mock_db[REGISTER_TYPE_COLLECTION].delete_one({"slug": "registry_slugs"})
+    existing.clear()
+    await registry.publish_invalidation("registry_slugs", deleted=True)
+    assert not await registry.slug_exists("registry_slugs")
+    assert await registry.get("registry_slugs") is None
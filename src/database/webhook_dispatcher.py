@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+import httpx
+from pymongo.errors import PyMongoError
+
+from config.config import SETTINGS, WebhookSubscriber
+from database.outbox import OutboxRepository, retry_delay
+from library.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+
+def webhook_event(record: dict) -> dict:
+    """Событие в теле запроса webhook. id записи outbox позволяет подписчику отбросить повторную доставку"""
+    return {"id": record["_id"], "slug": record["slug"], "object_id": record["object_id"],
+            "operation": record["operation"], "changed_fields": record["changed_fields"],
+            "fields": record["fields"], "history_id": record["history_id"], "created_at": record["created_at"]}
+
+
+class WebhookDispatcher:
+    """
+    Доставка записей outbox подписчикам webhook пачками: одна пачка - один POST запрос с JSON
+    {"subscriber": ..., "events": [...]}, успешный ответ - 2xx.
+    На подписчика запускается concurrency обработчиков, каждый закрепляет за собой отдельную пачку,
+    поэтому пропускная способность растет с числом обработчиков и процессов доставки.
+    Доставка "хотя бы один раз": пачка, не подтвержденная из-за сбоя процесса, доставляется повторно
+    после истечения закрепления. Ошибка обработчика не останавливает остальных: после нее обработчик
+    продолжает доставку с растущей задержкой
+    """
+
+    def __init__(self, subscribers: list[WebhookSubscriber], batch_size: int = 100, poll_interval: float = 1,
+                 lock_seconds: float = 60, max_attempts: int = 10, client: httpx.AsyncClient | None = None):
+        self.subscribers = subscribers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lock_seconds = lock_seconds
+        self.max_attempts = max_attempts
+        self.client = client or httpx.AsyncClient(timeout=SETTINGS.WEBHOOK_TIMEOUT_SECONDS)
+        self.repository = OutboxRepository()
+
+    async def run(self):
+        """Доставка до отмены задачи"""
+        async with self.client:
+            await asyncio.gather(*(self._worker(subscriber) for subscriber in self.subscribers
+                                   for _ in range(subscriber.concurrency)))
+
+    async def _worker(self, subscriber: WebhookSubscriber):
+        failures = 0
+        while True:
+            try:
+                claimed = await self.dispatch_batch(subscriber)
+            except Exception as ex:
+                failures += 1
+                # Ошибки БД ожидаемы при ее недоступности, остальные логируются с трассировкой
+                logger.warning("Outbox dispatch to %s failed: %s", subscriber.name, ex,
+                               exc_info=not isinstance(ex, PyMongoError))
+                await asyncio.sleep(retry_delay(failures))
+                continue
+            failures = 0
+            # Следующая пачка забирается сразу, пока записи outbox выбираются полными пачками
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def dispatch_batch(self, subscriber: WebhookSubscriber) -> int:
+        """
+        Доставка одной пачки записей подписчику
+        Returns:
+            количество записей в пачке
+        """
+        records = await self.repository.claim(subscriber, self.batch_size, self.lock_seconds)
+        if not records:
+            return 0
+        try:
+            response = await self.client.post(
+                subscriber.url,
+                content=dumps({"subscriber": subscriber.name, "events": [webhook_event(record) for record in records]}),
+                headers={"Content-Type": "application/json"})
+            response.raise_for_status()
+        except httpx.HTTPError as ex:
+            logger.warning("Webhook %s delivery of %d events failed: %s", subscriber.name, len(records), ex)
+            await self.repository.reschedule(subscriber, records, str(ex) or type(ex).__name__, self.max_attempts)
+        else:
+            await self.repository.acknowledge(subscriber, records)
+        return len(records)
+
+
+def create_webhook_dispatcher() -> WebhookDispatcher:
+    """Процесс доставки с подписчиками и параметрами из настроек"""
+    return WebhookDispatcher(SETTINGS.WEBHOOK_SUBSCRIBERS,
+                             batch_size=SETTINGS.OUTBOX_BATCH_SIZE,
+                             poll_interval=SETTINGS.OUTBOX_POLL_INTERVAL_SECONDS,
+                             lock_seconds=SETTINGS.OUTBOX_LOCK_SECONDS,
+                             max_attempts=SETTINGS.OUTBOX_MAX_ATTEMPTS)
@@ -0,0 +1,27 @@
+"""
+Доставка уведомлений outbox подписчикам webhook из настроек (WEBHOOK_SUBSCRIBERS) до прерывания процесса.
+Процессы доставки можно запускать в нескольких экземплярах, пачки записей между ними не пересекаются:
+
+    python dispatch_outbox.py
+"""
+import asyncio
+import logging
+
+from config.config import SETTINGS, close_client
+from database.outbox import OutboxRepository
+from database.webhook_dispatcher import create_webhook_dispatcher
+
+
+async def dispatch():
+    await OutboxRepository().ensure_indexes()
+    try:
+        await create_webhook_dispatcher().run()
+    finally:
+        close_client()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if not SETTINGS.WEBHOOK_SUBSCRIBERS:
+        raise SystemExit("WEBHOOK_SUBSCRIBERS is not configured")
+    asyncio.run(dispatch())
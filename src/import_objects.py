@@ -0,0 +1,42 @@
+"""
+Потоковая загрузка объектов типа реестра из NDJSON файла (или stdin) напрямую в БД.
+Результаты незагруженных строк выводятся в stdout в формате NDJSON, прогресс - в stderr:
+
+    python import_objects.py --slug SLUG [--file objects.ndjson] [--batch-size 1000] [--concurrency 4]
+"""
+import argparse
+import asyncio
+import sys
+from typing import AsyncIterator, BinaryIO
+
+from config.config import SETTINGS, close_client
+from database.register_object_importer import RegisterObjectImporter
+from schemas.register_object import ImportProgressSchema
+
+
+async def read_lines(file: BinaryIO) -> AsyncIterator[bytes]:
+    for line in file:
+        yield line
+
+
+async def import_objects(slug: str, file: BinaryIO, batch_size: int, concurrency: int):
+    importer = RegisterObjectImporter(slug, batch_size, concurrency)
+    async for event in importer.run(read_lines(file)):
+        if isinstance(event, ImportProgressSchema):
+            print(f"{slug}: processed {event.processed}, created {event.created}, failed {event.failed}",
+                  file=sys.stderr)
+        else:
+            print(event.model_dump_json())
+    close_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import register objects from NDJSON")
+    parser.add_argument("--slug", required=True, help="register type slug")
+    parser.add_argument("--file", default="-", help="NDJSON file (default: stdin)")
+    parser.add_argument("--batch-size", type=int, default=SETTINGS.IMPORT_BATCH_SIZE, help="objects per write")
+    parser.add_argument("--concurrency", type=int, default=SETTINGS.IMPORT_CONCURRENCY,
+                        help="batches written concurrently")
+    args = parser.parse_args()
+    with (sys.stdin.buffer if args.file == "-" else open(args.file, "rb")) as input_file:
+        asyncio.run(import_objects(args.slug, input_file, args.batch_size, args.concurrency))
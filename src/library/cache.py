@@ -0,0 +1,185 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import AsyncIterator
+
+from cachetools import TTLCache
+
+from config.config import SETTINGS
+
+
+class CacheBackend(ABC):
+    """
+    Хранилище кэша: значения в байтах со временем жизни, счетчики без времени жизни
+    и каналы публикации сообщений для сброса кэшей процессов
+    """
+    # Данные хранилища доступны всем процессам приложения
+    shared = False
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float | None = None):
+        ...
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        ...
+
+    @abstractmethod
+    async def get_counter(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    async def get_with_counter(self, key: str, counter_key: str) -> tuple[bytes | None, int]:
+        """Значение и счетчик одним обращением к хранилищу"""
+        ...
+
+    @abstractmethod
+    async def incr(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str):
+        ...
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> AsyncIterator[str]:
+        """Сообщения канала, опубликованные после подписки. Итерация продолжается до отмены задачи"""
+        ...
+
+    @abstractmethod
+    async def clear(self):
+        ...
+
+    async def close(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Хранилище в памяти процесса с вытеснением LRU, сообщения доставляются подписчикам этого же процесса"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._values: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counters: dict[str, int] = {}
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+
+    async def get(self, key: str) -> bytes | None:
+        return self._values.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None):
+        # Время жизни задается для всего хранилища при создании
+        self._values[key] = value
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    async def get_with_counter(self, key: str, counter_key: str) -> tuple[bytes | None, int]:
+        return self._values.get(key), self._counters.get(counter_key, 0)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    async def publish(self, channel: str, message: str):
+        for queue in self._subscribers[channel]:
+            queue.put_nowait(message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+        queue = asyncio.Queue()
+        self._subscribers[channel].add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers[channel].discard(queue)
+
+    async def clear(self):
+        self._values.clear()
+        self._counters.clear()
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Хранилище в Redis (или совместимом по протоколу сервере), общее для всех процессов приложения.
+    Ключи и каналы всех экземпляров приложения разделяются префиксом
+    """
+    shared = True
+
+    def __init__(self, client, ttl: float, prefix: str = ""):
+        self._client = client
+        self._ttl = ttl
+        self._prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float, prefix: str = "") -> 'RedisCacheBackend':
+        try:
+            from redis.asyncio import Redis
+        except ImportError:
+            raise RuntimeError("Package redis is required for CACHE_BACKEND=redis")
+        return cls(Redis.from_url(url), ttl, prefix)
+
+    def _key(self, key: str) -> str:
+        return f"{self._prefix}{key}"
+
+    async def get(self, key: str) -> bytes | None:
+        return await self._client.get(self._key(key))
+
+    async def set(self, key: str, value: bytes, ttl: float | None = None):
+        await self._client.set(self._key(key), value, px=int((ttl or self._ttl) * 1000))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._client.delete(*(self._key(key) for key in keys))
+
+    async def get_counter(self, key: str) -> int:
+        return int(await self._client.get(self._key(key)) or 0)
+
+    async def get_with_counter(self, key: str, counter_key: str) -> tuple[bytes | None, int]:
+        value, counter = await self._client.mget(self._key(key), self._key(counter_key))
+        return value, int(counter or 0)
+
+    async def incr(self, key: str) -> int:
+        return await self._client.incr(self._key(key))
+
+    async def publish(self, channel: str, message: str):
+        await self._client.publish(self._key(channel), message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+        pubsub = self._client.pubsub()
+        await pubsub.subscribe(self._key(channel))
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    data = message["data"]
+                    yield data.decode() if isinstance(data, bytes) else data
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    async def clear(self):
+        keys = [key async for key in self._client.scan_iter(match=f"{self._prefix}*")]
+        if keys:
+            await self._client.delete(*keys)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_cache_backend() -> CacheBackend:
+    """Хранилище кэша из настроек CACHE_BACKEND"""
+    if SETTINGS.CACHE_BACKEND == 'redis':
+        if not SETTINGS.REDIS_URL:
+            raise RuntimeError("REDIS_URL is required for CACHE_BACKEND=redis")
+        return RedisCacheBackend.from_url(SETTINGS.REDIS_URL, SETTINGS.RESPONSE_CACHE_TTL_SECONDS,
+                                          SETTINGS.CACHE_KEY_PREFIX)
+    return MemoryCacheBackend(SETTINGS.RESPONSE_CACHE_MAX_SIZE, SETTINGS.RESPONSE_CACHE_TTL_SECONDS)
+
+
+CACHE_BACKEND = create_cache_backend()
@@ -0,0 +1,147 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from pymongo import monitoring
+from starlette.responses import Response
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+# Интервалы гистограмм от 0.5 мс: большая часть запросов к БД и этапов обработки быстрее 5 мс
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route and register type",
+                            ("method", "route", "slug", "status"), buckets=LATENCY_BUCKETS)
+MONGO_OPERATION_LATENCY = Histogram("mongo_operation_duration_seconds", "MongoDB repository operation latency",
+                                    ("operation", "collection"), buckets=LATENCY_BUCKETS)
+MONGO_POOL_CHECKOUT_WAIT = Histogram("mongo_pool_checkout_wait_seconds", "Connection pool checkout wait time",
+                                     ("result",), buckets=LATENCY_BUCKETS)
+MONGO_POOL_CHECKED_OUT = Gauge("mongo_pool_checked_out_connections", "Connections checked out of the pool")
+STAGE_LATENCY = Histogram("request_stage_duration_seconds", "Request processing stage latency",
+                          ("stage",), buckets=LATENCY_BUCKETS)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by result", ("cache", "result"))
+
+
+def count_cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Время выполнения этапа обработки запроса (валидация, сериализация и т.п.)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - started)
+
+
+def timed_operation(method):
+    """
+    Декоратор асинхронных методов MongoDataBaseRepository: время выполнения операции
+    с метками имени метода и коллекции (первый аргумент метода)
+    """
+    operation = method.__name__
+
+    @wraps(method)
+    async def wrapper(self, collection_name: str, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(self, collection_name, *args, **kwargs)
+        finally:
+            MONGO_OPERATION_LATENCY.labels(operation, collection_name).observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class PoolCheckoutListener(monitoring.ConnectionPoolListener):
+    """
+    Время ожидания соединения из пула по событиям CMAP драйвера.
+    Начало и конец получения соединения приходят в одном потоке драйвера, поэтому время начала хранится в потоке
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _observe_wait(self, result: str):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            MONGO_POOL_CHECKOUT_WAIT.labels(result).observe(time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_checked_out(self, event):
+        self._observe_wait("ok")
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait(event.reason)
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+POOL_CHECKOUT_LISTENER = PoolCheckoutListener()
+
+
+class MetricsMiddleware:
+    """
+    Время обработки HTTP запросов (до отправки последнего байта ответа) с метками шаблона пути и типа реестра.
+    Шаблон пути и параметры известны после маршрутизации, поэтому метки определяются по завершении запроса
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            # slug попадает в метки только при успешном ответе: произвольные slug в ошибочных запросах
+            # (несуществующие типы, невалидные данные) не должны плодить временные ряды
+            slug = scope.get("path_params", {}).get("slug", "") if status_code < 400 else ""
+            REQUEST_LATENCY.labels(scope["method"], route.path if route else "unmatched", slug,
+                                   str(status_code)).observe(time.perf_counter() - started)
+
+
+def metrics_response() -> Response:
+    """Текущие значения метрик в текстовом формате Prometheus"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,4 +1,4 @@
-from typing import Optional, Type
+from typing import Optional, Type, Any
 
 from pydantic import create_model, BaseModel
 
@@ -43,3 +43,17 @@ def create_model_from_jsonschema(schema: dict, name='DynamicModel') -> Type[Base
             defaults[prop_name] = None
 
     return create_model(name, **{k: (annotations[k], defaults[k]) for k in annotations})
+
+
+def create_strict_model(name: str, fields: dict[str, tuple[Any, bool]], base: Type[BaseModel]) -> Type[BaseModel]:
+    """
+    Создает Pydantic BaseModel класс с заданными полями на основе базовой модели
+    Args:
+        name: имя модели
+        fields: словарь вида {имя поля: (тип, обязательность)}, необязательные поля по умолчанию None
+        base: базовая модель, задающая общие поля и конфигурацию
+    """
+    return create_model(name, __base__=base, **{
+        field_name: (annotation, ... if required else None)
+        for field_name, (annotation, required) in fields.items()
+    })
@@ -0,0 +1,99 @@
+import hashlib
+from dataclasses import dataclass
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from config.config import SETTINGS
+from library.cache import CacheBackend, CACHE_BACKEND
+from library.metrics import count_cache_lookup
+from library.serialization import RawJSONResponse
+
+REGISTER_TYPE_NAMESPACE = "register_type"
+
+
+def register_objects_namespace(slug: str) -> str:
+    return f"register:{slug}"
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    etag: str
+
+
+def make_etag(version) -> str:
+    """Сильный ETag из версии ответа. Если версия - тело ответа, используется его хэш"""
+    if isinstance(version, bytes):
+        version = hashlib.sha1(version).hexdigest()
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def conditional_response(request: Request, cached: CachedResponse) -> Response:
+    """Ответ 304 без тела, если клиент передал актуальный ETag в If-None-Match, иначе ответ с телом"""
+    headers = {"ETag": cached.etag}
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    return RawJSONResponse(cached.body, headers=headers)
+
+
+class ResponseCache:
+    """
+    Кэш сериализованных ответов GET запросов в хранилище кэша (в памяти процесса или общем для процессов).
+    Ключи группируются по пространствам имен: записи сбрасываются по ключу
+    или целиком по пространству имен (сменой его поколения, без перебора ключей)
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(namespace: str, key: str) -> str:
+        return f"response:{namespace}:{key}"
+
+    @staticmethod
+    def _generation_key(namespace: str) -> str:
+        return f"generation:{namespace}"
+
+    async def get(self, namespace: str, key: str) -> tuple[CachedResponse | None, int]:
+        """
+        Запись и текущее поколение пространства имен, прочитанные одним обращением к хранилищу.
+        Запись предыдущего поколения считается отсутствующей
+        Returns:
+            запись или None и поколение, которое передается в set при сохранении ответа
+        """
+        value, generation = await self.backend.get_with_counter(self._key(namespace, key),
+                                                                self._generation_key(namespace))
+        cached = None
+        if value is not None:
+            stored_generation, etag, body = value.split(b"\n", 2)
+            if int(stored_generation) == generation:
+                cached = CachedResponse(body=body, etag=etag.decode())
+        count_cache_lookup("response", cached is not None)
+        return cached, generation
+
+    async def set(self, namespace: str, key: str, response: CachedResponse, generation: int):
+        """Сохранение ответа, построенного после чтения записи поколения generation"""
+        value = b"\n".join((str(generation).encode(), response.etag.encode(), response.body))
+        await self.backend.set(self._key(namespace, key), value, self.ttl)
+
+    async def delete(self, namespace: str, key: str):
+        await self.backend.delete(self._key(namespace, key))
+
+    async def invalidate(self, namespace: str):
+        """Сброс всех записей пространства имен"""
+        await self.backend.incr(self._generation_key(namespace))
+
+    async def clear(self):
+        await self.backend.clear()
+
+
+RESPONSE_CACHE = ResponseCache(CACHE_BACKEND, ttl=SETTINGS.RESPONSE_CACHE_TTL_SECONDS)
@@ -0,0 +1,87 @@
+import csv
+import io
+from typing import Any, Iterable, AsyncIterable, AsyncIterator
+
+import orjson
+from bson import ObjectId
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Сериализация документов MongoDB в JSON: ObjectId - строкой, datetime - в ISO формате"""
+    return orjson.dumps(content, default=_default)
+
+
+def document_to_response(document: dict, exclude_fields: Iterable[str] = ('history',)) -> dict:
+    """Документ MongoDB в представление API: _id переименовывается в id, исключенные поля удаляются"""
+    response = {"id": document["_id"]}
+    response.update((key, value) for key, value in document.items()
+                    if key != "_id" and key not in exclude_fields)
+    return response
+
+
+class RawJSONResponse(Response):
+    """Ответ с уже сериализованным JSON телом, без повторной валидации по response_model"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return content if isinstance(content, bytes) else dumps(content)
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    Потоковый ответ, который формируется по мере чтения тела запроса.
+    StreamingResponse в ожидании отключения клиента читает входящие сообщения и забирал бы части тела запроса,
+    здесь отключение клиента обнаруживается при чтении тела запроса
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def ndjson_chunks(documents: AsyncIterable[dict], exclude_fields: Iterable[str] = ('history',),
+                        chunk_size: int = 1000) -> AsyncIterator[bytes]:
+    """Потоковая сериализация документов в NDJSON, документы отдаются частями по chunk_size строк"""
+    lines = []
+    async for document in documents:
+        lines.append(dumps(document_to_response(document, exclude_fields)))
+        if len(lines) >= chunk_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+async def csv_chunks(documents: AsyncIterable[dict], columns: list[str],
+                     chunk_size: int = 1000) -> AsyncIterator[bytes]:
+    """
+    Потоковая сериализация документов в CSV с заголовком.
+    Списки и логические значения записываются в ячейку в виде JSON
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = 0
+    async for document in documents:
+        response = document_to_response(document)
+        writer.writerow([
+            dumps(value).decode() if isinstance(value, (list, bool)) else
+            str(value) if isinstance(value, ObjectId) else value
+            for value in (response.get(column) for column in columns)
+        ])
+        rows += 1
+        if rows >= chunk_size:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    yield buffer.getvalue().encode()
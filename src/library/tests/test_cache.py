@@ -0,0 +1,91 @@
+"""Тесты хранилищ кэша и кэша ответов"""
+import asyncio
+
+import pytest
+
+from library.cache import MemoryCacheBackend, RedisCacheBackend, CacheBackend
+from library.response_cache import ResponseCache, CachedResponse
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache_backend(request) -> CacheBackend:
+    if request.param == "memory":
+        return MemoryCacheBackend(maxsize=100, ttl=60)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCacheBackend(fakeredis.FakeAsyncRedis(), ttl=60, prefix="test:")
+
+
+@pytest.mark.asyncio
+async def test_backend_values_and_counters(cache_backend: CacheBackend):
+    """Проверка записи, чтения и удаления значений и счетчиков хранилища"""
+    assert await cache_backend.get("key") is None
+    await cache_backend.set("key", b"value")
+    assert await cache_backend.get("key") == b"value"
+    await cache_backend.delete("key")
+    assert await cache_backend.get("key") is None
+
+    assert await cache_backend.get_counter("counter") == 0
+    assert await cache_backend.incr("counter") == 1
+    assert await cache_backend.get_counter("counter") == 1
+    await cache_backend.set("key", b"value")
+    assert await cache_backend.get_with_counter("key", "counter") == (b"value", 1)
+
+
+@pytest.mark.asyncio
+async def test_backend_publish_subscribe(cache_backend: CacheBackend):
+    """Проверка доставки опубликованного сообщения подписчику канала"""
+    messages = cache_backend.subscribe("channel")
+    receive = asyncio.ensure_future(anext(messages))
+    # Подписка выполняется при первом обращении к итератору
+    await asyncio.sleep(0.1)
+    await cache_backend.publish("channel", "message")
+    assert await asyncio.wait_for(receive, timeout=1) == "message"
+    await messages.aclose()
+
+
+@pytest.mark.asyncio
+async def test_response_cache_invalidation(cache_backend: CacheBackend):
+    """Проверка сброса кэша ответов по ключу и по пространству имен"""
+    cache = ResponseCache(cache_backend, ttl=60)
+    response = CachedResponse(body=b'{"id": 1}\n', etag='"1"')
+    cached, generation = await cache.get("namespace", "first")
+    assert cached is None
+    await cache.set("namespace", "first", response, generation)
+    await cache.set("namespace", "second", response, generation)
+    assert await cache.get("namespace", "first") == (response, generation)
+
+    await cache.delete("namespace", "first")
+    assert (await cache.get("namespace", "first"))[0] is None
+    assert (await cache.get("namespace", "second"))[0] == response
+
+    await cache.invalidate("namespace")
+    cached, new_generation = await cache.get("namespace", "second")
+    assert cached is None
+    # Ответ, построенный до сброса, не сохраняется в новом поколении
+    await cache.set("namespace", "second", response, generation)
+    assert await cache.get("namespace", "second") == (None, new_generation)
+
+
+@pytest.mark.asyncio
+async def test_response_cache_fill_race(cache_backend: CacheBackend):
+    """Ответ, прочитанный до записи объекта, не выдается из кэша: запись сбрасывает поколение пространства имен"""
+    cache = ResponseCache(cache_backend, ttl=60)
+    stale = CachedResponse(body=b'{"id": 1, "value": 1}\n', etag='"1"')
+    cached, generation = await cache.get("namespace", "object")
+    assert cached is None
+    # Запись объекта завершается между чтением из БД и сохранением ответа
+    await cache.invalidate("namespace")
+    await cache.set("namespace", "object", stale, generation)
+    assert (await cache.get("namespace", "object"))[0] is None
+
+
+def test_backend_interface():
+    """Хранилище без реализации всех методов CacheBackend не создается"""
+    class PartialBackend(CacheBackend):
+        async def get(self, key: str) -> bytes | None:
+            return None
+
+    with pytest.raises(TypeError):
+        PartialBackend()
+    with pytest.raises(TypeError):
+        CacheBackend()
@@ -0,0 +1,75 @@
+"""Тесты метрик Prometheus"""
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from library.metrics import PoolCheckoutListener, MetricsMiddleware, timed_operation
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_timed_operation():
+    """Проверка учета времени операции репозитория с метками операции и коллекции"""
+
+    class Repository:
+        @timed_operation
+        async def find_one(self, collection_name: str, query: dict):
+            return query
+
+    before = sample("mongo_operation_duration_seconds_count", operation="find_one", collection="metrics_test")
+    assert await Repository().find_one("metrics_test", {"a": 1}) == {"a": 1}
+    assert sample("mongo_operation_duration_seconds_count",
+                  operation="find_one", collection="metrics_test") == before + 1
+
+
+def test_pool_checkout_listener():
+    """Проверка учета ожидания соединения из пула и количества выданных соединений"""
+    listener = PoolCheckoutListener()
+    before = sample("mongo_pool_checkout_wait_seconds_count", result="ok")
+    checked_out = sample("mongo_pool_checked_out_connections")
+
+    listener.connection_check_out_started(SimpleNamespace())
+    listener.connection_checked_out(SimpleNamespace())
+    assert sample("mongo_pool_checkout_wait_seconds_count", result="ok") == before + 1
+    assert sample("mongo_pool_checked_out_connections") == checked_out + 1
+
+    listener.connection_checked_in(SimpleNamespace())
+    assert sample("mongo_pool_checked_out_connections") == checked_out
+
+
+def test_metrics_middleware():
+    """Проверка меток шаблона пути, slug и статуса ответа"""
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics_test/{slug}", status_code=201)
+    async def endpoint(slug: str):
+        if slug == "missing":
+            raise HTTPException(status_code=404)
+        return slug
+
+    client = TestClient(app)
+    labels = {"method": "GET", "route": "/metrics_test/{slug}", "slug": "tt", "status": "201"}
+    before = sample("http_request_duration_seconds_count", **labels)
+    unmatched_before = sample("http_request_duration_seconds_count",
+                              method="GET", route="unmatched", slug="", status="404")
+    failed_before = sample("http_request_duration_seconds_count",
+                           method="GET", route="/metrics_test/{slug}", slug="", status="404")
+    assert client.get("/metrics_test/tt").status_code == 201
+    assert client.get("/unknown").status_code == 404
+    assert client.get("/metrics_test/missing").status_code == 404
+    assert sample("http_request_duration_seconds_count", **labels) == before + 1
+    assert sample("http_request_duration_seconds_count",
+                  method="GET", route="unmatched", slug="", status="404") == unmatched_before + 1
+    # slug ошибочного ответа не попадает в метки
+    assert sample("http_request_duration_seconds_count", method="GET", route="/metrics_test/{slug}",
+                  slug="missing", status="404") == 0
+    assert sample("http_request_duration_seconds_count", method="GET", route="/metrics_test/{slug}",
+                  slug="", status="404") == failed_before + 1
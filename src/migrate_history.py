@@ -0,0 +1,32 @@
+"""
+Перенос истории объектов реестра из массива history документов в коллекции <slug>__history.
+Запускается после переключения HISTORY_STORAGE=collection:
+
+    python migrate_history.py [--slug SLUG] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+
+from config.config import SETTINGS, close_client
+from database.register_object_repository import MongoRegisterRepository
+from database.register_object_type_repository import MongoRegisterTypeRepository
+
+
+async def migrate(slugs: list[str], batch_size: int):
+    if not slugs:
+        slugs = [register_type.slug for register_type in await MongoRegisterTypeRepository().find({})]
+    for slug in slugs:
+        migrated_count = await MongoRegisterRepository(slug).migrate_embedded_history(batch_size)
+        print(f"{slug}: migrated {migrated_count} history records")
+    close_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate embedded object history into history collections")
+    parser.add_argument("--slug", action="append", default=[], help="register type slug (default: all types)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="objects per batch")
+    args = parser.parse_args()
+    # При хранении истории в документах перенесенная история перестанет быть видна приложению
+    if SETTINGS.HISTORY_STORAGE != 'collection':
+        parser.exit(1, "HISTORY_STORAGE must be set to 'collection' before migrating history\n")
+    asyncio.run(migrate(args.slug, args.batch_size))
@@ -1,16 +1,35 @@
+import hashlib
+import json
 import re
+from datetime import datetime
 from enum import Enum
-from typing import Self, TypeVar, Optional
+from typing import Self, TypeVar, Optional, Annotated, Any
 
 import jsonschema
 from beanie import Document
 from bson import ObjectId
-from pydantic import field_validator, BaseModel, model_validator, Field, constr
+from pydantic import field_validator, BaseModel, model_validator, Field, constr, BeforeValidator, StrictInt, \
+    StrictBool, StrictStr, model_serializer, SerializerFunctionWrapHandler
+from pymongo import ASCENDING, DESCENDING, HASHED
 
 from library.pydantic.fields import PyObjectId
 
 T = TypeVar('T', bound='SupportedTypes')
 
+# Суффикс коллекций истории объектов типа, не может использоваться в slug типов
+HISTORY_COLLECTION_SUFFIX = "__history"
+
+
+def _require_float(value):
+    """Поля double в MongoDB не принимают целые значения, поэтому неявное приведение int к float запрещено"""
+    if not isinstance(value, float):
+        raise ValueError("Input should be a valid float")
+    return value
+
+
+Int32 = Annotated[StrictInt, Field(ge=-2 ** 31, le=2 ** 31 - 1)]
+Double = Annotated[float, BeforeValidator(_require_float)]
+
 
 class SupportedTypes(str, Enum):
     INT = 'int'
@@ -21,6 +40,7 @@ class SupportedTypes(str, Enum):
     LIST_OF_BOOLS = 'list_of_bool'
     LIST_OF_FLOAT = 'list_of_float'
     LIST_OF_STRING = 'list_of_str'
+    DATETIME = 'datetime'
 
     def __repr__(self) -> str:
         return str.__repr__(self.value)
@@ -47,19 +67,176 @@ class SupportedTypes(str, Enum):
                 SupportedTypes.LIST_OF_STRING: {
                     "bsonType": "array",
                     "items": {"bsonType": "string"}
-                }
+                },
+                SupportedTypes.DATETIME: {"bsonType": "date"},
             }
 
         return self.__json_spec[self]
 
+    def python_type(self) -> Any:
+        """Строгий тип Python, соответствующий bsonType поля"""
+        return {
+            SupportedTypes.INT: Int32,
+            SupportedTypes.BOOL: StrictBool,
+            SupportedTypes.FLOAT: Double,
+            SupportedTypes.STRING: StrictStr,
+            SupportedTypes.LIST_OF_INTS: list[Int32],
+            SupportedTypes.LIST_OF_BOOLS: list[StrictBool],
+            SupportedTypes.LIST_OF_FLOAT: list[Double],
+            SupportedTypes.LIST_OF_STRING: list[StrictStr],
+            SupportedTypes.DATETIME: datetime,
+        }[self]
+
+    def item_type(self) -> 'SupportedTypes':
+        """Тип элемента для списков, для скалярных типов - сам тип"""
+        return {
+            SupportedTypes.LIST_OF_INTS: SupportedTypes.INT,
+            SupportedTypes.LIST_OF_BOOLS: SupportedTypes.BOOL,
+            SupportedTypes.LIST_OF_FLOAT: SupportedTypes.FLOAT,
+            SupportedTypes.LIST_OF_STRING: SupportedTypes.STRING,
+        }.get(self, self)
+
+    def parse_value(self, raw: str):
+        """Приведение строкового значения (например, из query параметров) к типу поля.
+        Для списков значение приводится к типу элемента"""
+        item_type = self.item_type()
+        try:
+            if item_type == SupportedTypes.INT:
+                return int(raw)
+            if item_type == SupportedTypes.FLOAT:
+                return float(raw)
+            if item_type == SupportedTypes.DATETIME:
+                return datetime.fromisoformat(raw)
+        except ValueError:
+            raise ValueError(f"Value {raw!r} is not a valid {item_type.value}")
+        if item_type == SupportedTypes.BOOL:
+            if raw.lower() in ("true", "1"):
+                return True
+            if raw.lower() in ("false", "0"):
+                return False
+            raise ValueError(f"Value {raw!r} is not a valid bool")
+        return raw
+
+    def parse_json_value(self, value):
+        """Проверка значения из JSON (например, из фильтра агрегации) по типу поля.
+        Для списков проверяется тип элемента, datetime передается строкой в формате ISO 8601"""
+        item_type = self.item_type()
+        if item_type == SupportedTypes.INT and type(value) is int:
+            return value
+        if item_type == SupportedTypes.FLOAT and type(value) in (int, float):
+            return float(value)
+        if item_type == SupportedTypes.BOOL and type(value) is bool:
+            return value
+        if item_type == SupportedTypes.STRING and isinstance(value, str):
+            return value
+        if item_type == SupportedTypes.DATETIME and isinstance(value, str):
+            return self.parse_value(value)
+        raise ValueError(f"Value {value!r} is not a valid {item_type.value}")
+
+    def is_list(self) -> bool:
+        return self.item_type() != self
+
+
+class IndexKind(str, Enum):
+    ASCENDING = 'ascending'
+    DESCENDING = 'descending'
+    HASHED = 'hashed'
+
+    def __repr__(self) -> str:
+        return str.__repr__(self.value)
+
+    def direction(self) -> int | str:
+        return {IndexKind.ASCENDING: ASCENDING, IndexKind.DESCENDING: DESCENDING, IndexKind.HASHED: HASHED}[self]
+
+
+# Операторы условий partialFilterExpression, поддерживаемые MongoDB
+PARTIAL_FILTER_OPERATORS = {"$eq", "$exists", "$gt", "$gte", "$lt", "$lte", "$type"}
+
+
+def check_partial_filter(expression: dict[str, Any], field_names: set[str]):
+    """
+    Проверка выражения частичного индекса: условия на поля типа с операторами PARTIAL_FILTER_OPERATORS
+    и скалярными значениями, объединенные на верхнем уровне или в $and
+    """
+    for key, condition in expression.items():
+        if key == "$and":
+            if not isinstance(condition, list) or not condition or \
+                    not all(isinstance(item, dict) for item in condition):
+                raise ValueError("Partial filter $and requires a non-empty list of expressions")
+            for item in condition:
+                check_partial_filter(item, field_names)
+            continue
+        if key not in field_names:
+            raise ValueError(f"Partial filter contains unknown field: {key}")
+        operators = condition if isinstance(condition, dict) else {"$eq": condition}
+        if not operators:
+            raise ValueError(f"Partial filter condition for field {key} is empty")
+        for operator, value in operators.items():
+            if operator not in PARTIAL_FILTER_OPERATORS:
+                raise ValueError(f"Partial filter operator {operator} is not supported, "
+                                 f"allowed: {', '.join(sorted(PARTIAL_FILTER_OPERATORS))}")
+            if isinstance(value, (dict, list)):
+                raise ValueError(f"Partial filter value for {key} {operator} must be a scalar")
+            if operator == "$exists" and value is not True:
+                raise ValueError("Partial filter supports only $exists: true")
+
+
+class FieldIndex(BaseModel):
+    """Вторичный индекс поля типа"""
+    kind: IndexKind = IndexKind.ASCENDING
+    # Индексировать только документы, в которых поле присутствует
+    sparse: bool = False
+    # Индексировать только документы, удовлетворяющие выражению (partialFilterExpression MongoDB)
+    partial_filter: dict[str, Any] | None = None
+    # Удаление документов через заданное время после значения поля (TTL индекс, только для datetime)
+    expire_after_seconds: int | None = Field(default=None, ge=0)
+
+    @model_validator(mode='after')
+    def check_options(self) -> Self:
+        if self.sparse and self.partial_filter is not None:
+            raise ValueError("Index can not be both sparse and partial")
+        if self.kind == IndexKind.HASHED and self.expire_after_seconds is not None:
+            raise ValueError("TTL index can not be hashed")
+        return self
+
+    def options(self) -> dict[str, Any]:
+        """Параметры создания индекса MongoDB"""
+        options = {}
+        if self.sparse:
+            options["sparse"] = True
+        if self.partial_filter is not None:
+            options["partialFilterExpression"] = self.partial_filter
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        return options
+
 
 class RegisterField(BaseModel):
     name: str
     optional: bool = False
     type: SupportedTypes
+    index: FieldIndex | None = None
+
+    @model_validator(mode='after')
+    def check_index(self) -> Self:
+        if self.index is None:
+            return self
+        if self.index.kind == IndexKind.HASHED and self.type.is_list():
+            raise ValueError(f"Hashed index is not supported for list field {self.name}")
+        if self.index.expire_after_seconds is not None and self.type != SupportedTypes.DATETIME:
+            raise ValueError(f"TTL index requires {SupportedTypes.DATETIME.value} field, "
+                             f"{self.name} is {self.type.value}")
+        return self
+
+    @model_serializer(mode='wrap')
+    def serialize(self, handler: SerializerFunctionWrapHandler) -> dict[str, Any]:
+        # Поля без индекса сериализуются без ключа index, как до его появления
+        data = handler(self)
+        if self.index is None:
+            data.pop("index", None)
+        return data
 
 
-# TODO: Генерация индексов по уникальным  slug и name
 class RegisterObjectTypeModel(BaseModel):
     id: PyObjectId = Field(alias='_id', default=None, serialization_alias='id')
     name: str
@@ -78,8 +255,22 @@ class RegisterObjectTypeModel(BaseModel):
         if extra_fields := set(self.notify_fields) - fields:
             raise ValueError(f"Notify fields list contains unknown fields:{extra_fields}")
 
+        if self.slug.endswith(HISTORY_COLLECTION_SUFFIX):
+            raise ValueError(f"Slug can not end with '{HISTORY_COLLECTION_SUFFIX}': "
+                             f"the suffix is reserved for history collections")
+
+        # Частичные индексы фильтруются только по полям типа и признаку деактивации
+        for field in self.fields:
+            if field.index is not None and field.index.partial_filter is not None:
+                check_partial_filter(field.index.partial_filter, fields | {"is_deactivated"})
+
         return self
 
+    def fields_version(self) -> str:
+        """Версия спецификации полей: меняется при любом изменении списка полей"""
+        fields_dump = json.dumps([field.model_dump(mode='json') for field in self.fields], sort_keys=True)
+        return hashlib.sha1(fields_dump.encode()).hexdigest()
+
     def fields_json_schema(self):
         base_properties = {field.name: field.type.json_schema() for field in self.fields}
         base_properties["_id"] = {
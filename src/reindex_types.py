@@ -0,0 +1,27 @@
+"""
+Перестроение уникальных индексов коллекций объектов типов реестра по полям unique_fields.
+Заменяет текстовые индексы, созданные прежними версиями, на уникальные B-tree индексы без остановки записи:
+
+    python reindex_types.py [--slug SLUG]
+"""
+import argparse
+import asyncio
+
+from config.config import close_client
+from database.register_object_type_repository import MongoRegisterTypeRepository
+
+
+async def reindex(slugs: list[str]):
+    repository = MongoRegisterTypeRepository()
+    register_types = await repository.find({"slug": {"$in": slugs}} if slugs else {})
+    for register_type in register_types:
+        dropped = await repository.reindex(register_type)
+        print(f"{register_type.slug}: unique index {register_type.unique_fields}, dropped {dropped or 'none'}")
+    close_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild unique indexes of register type collections")
+    parser.add_argument("--slug", action="append", default=[], help="register type slug (default: all types)")
+    args = parser.parse_args()
+    asyncio.run(reindex(args.slug))
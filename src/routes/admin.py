@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Response, status
+
+from database.query_profiler import SLOW_QUERY_PROFILER
+from schemas.slow_query import SlowQueriesSchema
+
+router = APIRouter()
+
+
+@router.get("/slow_queries",
+            description='Последние медленные запросы к БД с кратким описанием их планов выполнения. '
+                        'Заполняется при включенном SLOW_QUERY_PROFILING',
+            name="get_slow_queries",
+            response_model=SlowQueriesSchema)
+async def get_slow_queries():
+    return SlowQueriesSchema(enabled=SLOW_QUERY_PROFILER.enabled,
+                             threshold_ms=SLOW_QUERY_PROFILER.threshold_ms,
+                             items=SLOW_QUERY_PROFILER.records())
+
+
+@router.delete("/slow_queries",
+               description='Очистить список медленных запросов',
+               name="clear_slow_queries")
+async def clear_slow_queries():
+    SLOW_QUERY_PROFILER.clear()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,15 +1,38 @@
-from typing import Optional, Type, Iterable
+import json
+from datetime import datetime
+from typing import Optional, Type, Iterable, Literal
 
 from beanie import PydanticObjectId
-from fastapi import APIRouter, HTTPException, Response, status, Depends
+from fastapi import APIRouter, HTTPException, Response, status, Depends, Request, Query
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from pymongo.errors import ExecutionTimeout
 
+from config.config import SETTINGS
+
+from database.aggregation import build_group_pipeline
+from database.change_feed import CHANGE_FEED_HUB, sse_chunks
+from database.query_filters import build_filter, parse_sort
 from database.register_object_repository import MongoRegisterRepository
+from database.register_object_importer import RegisterObjectImporter, LineTooLongError, split_lines, \
+    write_error_status
+from database.register_type_registry import TYPE_REGISTRY
+from library.metrics import observe_stage
+from library.response_cache import RESPONSE_CACHE, CachedResponse, make_etag, conditional_response
+from library.serialization import RawJSONResponse, RequestStreamingResponse, document_to_response, ndjson_chunks, \
+    csv_chunks, dumps
 from models.register_object import RegisterObjectModel, HistoryRecordModel
+from schemas.pagination import Page
 from schemas.register_object import CreateRegisterObjectSchema, RegisterObjectNoHistorySchema, \
-    UpdateRegisterObjectSchema
+    UpdateRegisterObjectSchema, BulkCreateResultSchema, BulkItemResultSchema, SyncResultSchema, \
+    ImportProgressSchema, ImportResultSchema, AggregateRequestSchema, AggregateResultSchema, CountResultSchema
 
 router = APIRouter()
 
+LIST_RESERVED_PARAMS = {"limit", "cursor", "sort"}
+EXPORT_RESERVED_PARAMS = {"format", "batch_size", "include_history"}
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
 
 def get_repository(slug: str = None) -> MongoRegisterRepository:
     return MongoRegisterRepository(slug)
@@ -23,40 +46,336 @@ def get_repository(slug: str = None) -> MongoRegisterRepository:
              )
 async def create_object(slug: str, register_object_payload: CreateRegisterObjectSchema,
                         repository: MongoRegisterRepository = Depends(get_repository)):
-    collection_exists = await repository.collection_exists()
+    collection_exists = await repository.collection_exists(for_write=True)
     if not collection_exists:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
 
-    register_object = RegisterObjectModel(**register_object_payload.model_dump(exclude_unset=True))
+    register_type = await TYPE_REGISTRY.require(slug)
+    with observe_stage("validate"):
+        validated_payload = register_type.create_schema.model_validate(
+            register_object_payload.model_dump(exclude_unset=True))
+        register_object = RegisterObjectModel(**validated_payload.model_dump(exclude_unset=True))
     result: RegisterObjectModel = await repository.insert_one(register_object)
 
     return result.model_dump()
 
 
+async def read_bulk_items(request: Request, max_items: int | None = None) -> list:
+    """
+    Чтение объектов пакетного запроса: JSON массив или NDJSON (по объекту на строку).
+    NDJSON читается построчно по мере поступления: чтение прекращается, как только объектов больше max_items,
+    строка с некорректным JSON или длиннее IMPORT_MAX_LINE_BYTES возвращается на месте объекта как ошибка
+    (json.JSONDecodeError или LineTooLongError)
+    """
+    if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        items = []
+        async for line in split_lines(request.stream(), SETTINGS.IMPORT_MAX_LINE_BYTES):
+            if not isinstance(line, LineTooLongError) and not line.strip():
+                continue
+            if max_items is not None and len(items) >= max_items:
+                raise too_many_items_error(max_items)
+            if isinstance(line, LineTooLongError):
+                items.append(line)
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as ex:
+                items.append(ex)
+        return items
+
+    try:
+        items = json.loads(await request.body())
+    except json.JSONDecodeError as ex:
+        raise ValueError(f"Invalid request body: {ex}")
+    if not isinstance(items, list):
+        raise ValueError("Request body must be a JSON array of objects")
+    if max_items is not None and len(items) > max_items:
+        raise too_many_items_error(max_items)
+    return items
+
+
+def too_many_items_error(max_items: int) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                         detail=f"Too many objects in request, maximum is {max_items}")
+
+
+def invalid_bulk_item(index: int,
+                      error: ValidationError | json.JSONDecodeError | LineTooLongError) -> BulkItemResultSchema:
+    """Результат объекта пакетного запроса, не прошедшего разбор JSON или валидацию"""
+    if isinstance(error, json.JSONDecodeError):
+        return BulkItemResultSchema(index=index, status='invalid', detail=[f"Invalid JSON: {error}"])
+    if isinstance(error, LineTooLongError):
+        return BulkItemResultSchema(index=index, status='invalid', detail=[str(error)])
+    return BulkItemResultSchema(index=index, status='invalid', detail=[item['msg'] for item in error.errors()])
+
+
+@router.post("/{slug}/_bulk",
+             description='Пакетно добавить объекты зарегистрированного типа в реестр. '
+                         f'Тело запроса - JSON массив или NDJSON ({NDJSON_MEDIA_TYPE})',
+             name='bulk_create_register_objects',
+             response_model=BulkCreateResultSchema
+             )
+async def bulk_create_objects(slug: str, request: Request,
+                              repository: MongoRegisterRepository = Depends(get_repository)):
+    collection_exists = await repository.collection_exists(for_write=True)
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+
+    items = await read_bulk_items(request, SETTINGS.BULK_MAX_ITEMS)
+    create_schema = (await TYPE_REGISTRY.require(slug)).create_schema
+    results: dict[int, BulkItemResultSchema] = {}
+    documents, document_indexes = [], []
+    for index, item in enumerate(items):
+        if isinstance(item, (json.JSONDecodeError, LineTooLongError)):
+            results[index] = invalid_bulk_item(index, item)
+            continue
+        try:
+            payload = create_schema.model_validate(item)
+        except ValidationError as ex:
+            results[index] = invalid_bulk_item(index, ex)
+            continue
+        documents.append(RegisterObjectModel(**payload.model_dump(exclude_unset=True)))
+        document_indexes.append(index)
+
+    inserted_ids, write_errors = await repository.insert_many(documents)
+    for document_index, object_id in inserted_ids.items():
+        index = document_indexes[document_index]
+        results[index] = BulkItemResultSchema(index=index, status='created', id=object_id)
+    for document_index, error in write_errors.items():
+        index = document_indexes[document_index]
+        results[index] = BulkItemResultSchema(index=index, status=write_error_status(error),
+                                              detail=error.get("errmsg"))
+
+    created = len(inserted_ids)
+    return BulkCreateResultSchema(created=created,
+                                  failed=len(items) - created,
+                                  items=[results[index] for index in range(len(items))])
+
+
+@router.post("/{slug}/_import",
+             description='Потоковая загрузка объектов зарегистрированного типа из NDJSON. '
+                         'Тело запроса читается по мере поступления и записывается пачками, '
+                         'в ответе - ошибки незагруженных строк (index - номер строки), '
+                         f'не более {SETTINGS.IMPORT_MAX_ERRORS}. '
+                         f'Строки длиннее {SETTINGS.IMPORT_MAX_LINE_BYTES} байт отклоняются. '
+                         f'С заголовком Accept: {NDJSON_MEDIA_TYPE} ответ передается потоком NDJSON по мере загрузки: '
+                         'ошибки строк и прогресс после каждой пачки, последняя строка - прогресс с finished',
+             name='import_register_objects',
+             response_model=ImportResultSchema
+             )
+async def import_objects(slug: str, request: Request,
+                         batch_size: int = Query(SETTINGS.IMPORT_BATCH_SIZE, ge=1, le=SETTINGS.BULK_MAX_ITEMS),
+                         concurrency: int = Query(SETTINGS.IMPORT_CONCURRENCY, ge=1, le=32),
+                         repository: MongoRegisterRepository = Depends(get_repository)):
+    collection_exists = await repository.collection_exists(for_write=True)
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+
+    importer = RegisterObjectImporter(slug, batch_size, concurrency)
+    events = importer.run(split_lines(request.stream(), SETTINGS.IMPORT_MAX_LINE_BYTES))
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return RequestStreamingResponse((event.model_dump_json().encode() + b"\n" async for event in events),
+                                        media_type=NDJSON_MEDIA_TYPE)
+
+    progress, errors = None, []
+    async for event in events:
+        if isinstance(event, ImportProgressSchema):
+            progress = event
+        elif len(errors) < SETTINGS.IMPORT_MAX_ERRORS:
+            errors.append(event)
+    return ImportResultSchema(processed=progress.processed, created=progress.created, failed=progress.failed,
+                              errors=errors, errors_omitted=progress.failed - len(errors))
+
+
+@router.post("/{slug}/_sync",
+             description='Синхронизировать реестр с полным снимком объектов источника по уникальным полям типа. '
+                         'Записываются только новые и измененные объекты. '
+                         f'Тело запроса - JSON массив или NDJSON ({NDJSON_MEDIA_TYPE})',
+             name='sync_register_objects',
+             response_model=SyncResultSchema
+             )
+async def sync_objects(slug: str, request: Request,
+                       deactivate_missing: bool = Query(False, description='Деактивировать объекты, '
+                                                                           'отсутствующие в снимке'),
+                       repository: MongoRegisterRepository = Depends(get_repository)):
+    collection_exists = await repository.collection_exists(for_write=True)
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+
+    items = await read_bulk_items(request)
+    create_schema = (await TYPE_REGISTRY.require(slug)).create_schema
+    errors = []
+    documents = []
+    for index, item in enumerate(items):
+        if isinstance(item, (json.JSONDecodeError, LineTooLongError)):
+            errors.append(invalid_bulk_item(index, item))
+            continue
+        try:
+            payload = create_schema.model_validate(item)
+        except ValidationError as ex:
+            errors.append(invalid_bulk_item(index, ex))
+            continue
+        documents.append((index, RegisterObjectModel(**payload.model_dump(exclude_unset=True))))
+
+    if errors and deactivate_missing:
+        # Неполный снимок привел бы к деактивации объектов, не прошедших валидацию
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=[error.model_dump() for error in errors])
+
+    result = await repository.sync([document for _, document in documents], deactivate_missing,
+                                   SETTINGS.SYNC_BATCH_SIZE)
+    for document_index, detail in result.pop("errors"):
+        index = documents[document_index][0] if document_index is not None else None
+        errors.append(BulkItemResultSchema(index=index, status='error', detail=detail))
+    return SyncResultSchema(**result, failed=len(errors), errors=errors)
+
+
+@router.get("/{slug}/_count",
+            description='Количество объектов зарегистрированного типа. '
+                        'Фильтры передаются так же, как при получении списка объектов',
+            name="count_register_objects",
+            response_model=CountResultSchema)
+async def count_objects(slug: str, request: Request,
+                        repository: MongoRegisterRepository = Depends(get_repository)):
+    collection_exists = await repository.collection_exists()
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+
+    register_type = await TYPE_REGISTRY.require(slug)
+    query = build_filter(request.query_params.multi_items(), register_type.field_types)
+    try:
+        count = await repository.count(query, max_time_ms=SETTINGS.AGGREGATION_MAX_TIME_MS)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Count exceeded time limit")
+    return CountResultSchema(count=count)
+
+
+@router.post("/{slug}/_aggregate",
+             description='Группировка объектов зарегистрированного типа по полям и вычисление метрик групп '
+                         '(count, sum, avg, min, max) на сервере БД',
+             name="aggregate_register_objects",
+             response_model=AggregateResultSchema)
+async def aggregate_objects(slug: str, aggregate_request: AggregateRequestSchema,
+                            repository: MongoRegisterRepository = Depends(get_repository)):
+    collection_exists = await repository.collection_exists()
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+
+    register_type = await TYPE_REGISTRY.require(slug)
+    query = build_filter(aggregate_request.filter.items(), register_type.field_types, parse_strings=False)
+    pipeline = build_group_pipeline(query, aggregate_request.group_by, aggregate_request.metrics,
+                                    register_type.field_types, aggregate_request.limit)
+    try:
+        groups = await repository.aggregate_raw(pipeline, max_time_ms=SETTINGS.AGGREGATION_MAX_TIME_MS)
+    except ExecutionTimeout:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Aggregation exceeded time limit")
+    return RawJSONResponse({"groups": groups})
+
+
+@router.get("/{slug}/_export",
+            description='Потоковая выгрузка объектов зарегистрированного типа в NDJSON или CSV. '
+                        'Фильтры передаются так же, как при получении списка объектов. '
+                        'История выгружается только в NDJSON и только при хранении в документе',
+            name="export_register_objects",
+            response_class=StreamingResponse)
+async def export_objects(slug: str,
+                         request: Request,
+                         format: Literal['ndjson', 'csv'] = Query('ndjson'),
+                         batch_size: int = Query(1000, ge=1, le=10000,
+                                                 description='Размер пачки чтения из БД'),
+                         include_history: bool = Query(False),
+                         repository: MongoRegisterRepository = Depends(get_repository)):
+    collection_exists = await repository.collection_exists()
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+    if include_history and format == 'csv':
+        raise ValueError("History can be exported only in ndjson format")
+
+    register_type = await TYPE_REGISTRY.require(slug)
+    query = build_filter(((key, value) for key, value in request.query_params.multi_items()
+                          if key not in EXPORT_RESERVED_PARAMS),
+                         register_type.field_types)
+    exclude_fields = set() if include_history else {"history"}
+    documents = repository.iterate_raw(query, exclude_fields, batch_size)
+
+    if format == 'csv':
+        columns = ["id", *(field.name for field in register_type.type_object.fields), "notify_fields",
+                   "is_deactivated"]
+        content, media_type = csv_chunks(documents, columns, batch_size), "text/csv"
+    else:
+        content, media_type = ndjson_chunks(documents, exclude_fields, batch_size), NDJSON_MEDIA_TYPE
+    return StreamingResponse(content, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{slug}.{format}"'})
+
+
+@router.get("/{slug}/_events",
+            description='Лента изменений объектов зарегистрированного типа (server-sent events). '
+                        'Изменения объекта передаются, только если затрагивают его notify_fields. '
+                        'Идентификатор события - позиция в ленте: после переподключения с заголовком '
+                        'Last-Event-ID (или параметром last_event_id) передаются события после нее',
+            name="register_object_events",
+            response_class=StreamingResponse)
+async def object_events(slug: str,
+                        request: Request,
+                        last_event_id: Optional[str] = Query(None),
+                        repository: MongoRegisterRepository = Depends(get_repository)):
+    collection_exists = await repository.collection_exists()
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+
+    events = CHANGE_FEED_HUB.events(slug, request.headers.get("last-event-id") or last_event_id)
+    return StreamingResponse(sse_chunks(events, SETTINGS.CHANGE_FEED_HEARTBEAT_SECONDS),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @router.get("/{slug}/{object_id}",
-            description='Получить объект зарегистрированного типа из реестра',
+            description='Получить объект зарегистрированного типа из реестра. '
+                        'Ответ содержит ETag, при совпадении с If-None-Match возвращается 304',
             name="get_register_object",
             response_model=RegisterObjectNoHistorySchema)
 async def get_object(slug: str,
                      object_id: PydanticObjectId,
+                     request: Request,
                      repository: MongoRegisterRepository = Depends(get_repository)):
-    result_object: RegisterObjectModel = await repository.find_one_by_id(object_id, {"history"})
-    if result_object is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail=f"Register Object type {slug}/{object_id} not found")
+    cached, generation = await RESPONSE_CACHE.get(repository.cache_namespace, str(object_id))
+    if cached is None:
+        result_object, version = await repository.find_one_versioned_raw(object_id)
+        if result_object is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Register Object type {slug}/{object_id} not found")
+        body = dumps(document_to_response(result_object))
+        cached = CachedResponse(body=body, etag=make_etag(version or body))
+        await RESPONSE_CACHE.set(repository.cache_namespace, str(object_id), cached, generation)
+    return conditional_response(request, cached)
 
-    return result_object.model_dump()
 
-
-# TODO: Паджинация и фильтры
 @router.get("/{slug}/",
-            description='Получить объекты зарегистрированного типа из реестра',
+            description='Получить объекты зарегистрированного типа из реестра. '
+                        'Фильтры передаются query параметрами вида field=value или field__op=value, '
+                        'где op: eq, ne, gt, gte, lt, lte, in (параметр повторяется для каждого значения)',
             name="get_register_objects",
-            response_model=list[RegisterObjectNoHistorySchema])
+            response_model=Page[RegisterObjectNoHistorySchema])
 async def get_objects(slug: str,
+                      request: Request,
+                      limit: int = Query(100, ge=1, le=1000),
+                      cursor: str | None = Query(None, description='Токен следующей страницы'),
+                      sort: str = Query('id', description='Поле сортировки, "-" для сортировки по убыванию'),
                       repository: MongoRegisterRepository = Depends(get_repository)):
-    result_objects: Iterable[RegisterObjectModel] = await repository.find()
-    return (result_object.model_dump() for result_object in result_objects)
+    collection_exists = await repository.collection_exists()
+    if not collection_exists:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Register Object type {slug} not found")
+
+    register_type = await TYPE_REGISTRY.require(slug)
+    query = build_filter(((key, value) for key, value in request.query_params.multi_items()
+                          if key not in LIST_RESERVED_PARAMS),
+                         register_type.field_types)
+    sort_field, descending = parse_sort(sort, register_type.field_types, register_type.required_fields)
+
+    result_objects, next_cursor = await repository.find_page_raw(query, limit, sort_field, descending, cursor,
+                                                                 exclude_fields={"history"})
+    return RawJSONResponse({"items": [document_to_response(result_object) for result_object in result_objects],
+                            "next_cursor": next_cursor})
 
 
 @router.delete("/{slug}/{object_id}",
@@ -80,7 +399,11 @@ async def update_object(slug: str,
                         object_id: PydanticObjectId,
                         update_object_payload: UpdateRegisterObjectSchema,
                         repository: MongoRegisterRepository = Depends(get_repository)):
-    result = await repository.update_one(object_id, update_object_payload.model_dump(exclude_unset=True))
+    register_type = await TYPE_REGISTRY.require(slug)
+    with observe_stage("validate"):
+        validated_payload = register_type.update_schema.model_validate(
+            update_object_payload.model_dump(exclude_unset=True))
+    result = await repository.update_one(object_id, validated_payload.model_dump(exclude_unset=True))
     if result:
         return result.model_dump()
     else:
@@ -101,19 +424,22 @@ async def update_object(slug: str,
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
 
-# TODO: Добавить паджинацию и фильтрацию
 @router.get("/{slug}/{object_id}/history/",
-            description='История объекта',
+            description='История объекта в хронологическом порядке',
             name="get_object_history_records_list",
-            response_model=list[HistoryRecordModel])
+            response_model=Page[HistoryRecordModel])
 async def get_object_history(slug: str,
                              object_id: PydanticObjectId,
+                             since: datetime | None = Query(None, description='Начало интервала (включительно)'),
+                             until: datetime | None = Query(None, description='Конец интервала (не включительно)'),
+                             limit: int = Query(100, ge=1, le=1000),
+                             cursor: str | None = Query(None, description='Токен следующей страницы'),
                              repository: MongoRegisterRepository = Depends(get_repository)):
-    result_object: RegisterObjectModel = await repository.find_one_by_id(object_id)
-    if result_object:
-        return result_object.history
-    else:
+    history_page = await repository.get_object_history_page(object_id, since, until, limit, cursor)
+    if history_page is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    history, next_cursor = history_page
+    return {"items": history, "next_cursor": next_cursor}
 
 
 @router.get("/{slug}/{object_id}/history/{history_id}",
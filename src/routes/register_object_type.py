@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Body, HTTPException, status, Response, Depends
+from fastapi import APIRouter, Body, HTTPException, status, Response, Depends, Request
+from pydantic import BaseModel
 from pymongo.errors import OperationFailure
 
 from database.register_object_type_repository import *
+from database.field_index_builder import FIELD_INDEX_BUILDER
+from library.response_cache import RESPONSE_CACHE, REGISTER_TYPE_NAMESPACE, CachedResponse, make_etag, \
+    conditional_response
+from library.serialization import document_to_response, dumps
 from schemas.register_object_type import RegisterObjectTypeResponseSchema, UpdateRegisterObjectTypeSchema, \
-    CreateRegisterObjectTypeSchema
+    CreateRegisterObjectTypeSchema, RegisterObjectTypeDetailSchema
 
 router = APIRouter()
 
@@ -37,22 +42,80 @@ async def add_register_type_object(register_type_object: CreateRegisterObjectTyp
     response_model=list[RegisterObjectTypeResponseSchema],
     name="get_register_object_type_list",
 )
-async def get_all_register_type_objects(repository: MongoRegisterTypeRepository = Depends(get_repository)):
-    registers_objects = await repository.find()
-    return registers_objects
+async def get_all_register_type_objects(request: Request,
+                                        repository: MongoRegisterTypeRepository = Depends(get_repository)):
+    cached, generation = await RESPONSE_CACHE.get(REGISTER_TYPE_NAMESPACE, "list")
+    if cached is None:
+        registers_objects = await repository.find_raw()
+        body = dumps([type_response(RegisterObjectTypeResponseSchema, document_to_response(register_object))
+                      for register_object in registers_objects])
+        cached = CachedResponse(body=body, etag=make_etag(body))
+        await RESPONSE_CACHE.set(REGISTER_TYPE_NAMESPACE, "list", cached, generation)
+    return conditional_response(request, cached)
+
+
+def type_response(schema: type[BaseModel], data: dict) -> dict:
+    """
+    Тип в ответе API: только поля схемы ответа со значениями по умолчанию.
+    Ответы типов кэшируются, поэтому проверка по схеме выполняется только при заполнении кэша
+    """
+    return schema.model_validate(data).model_dump(mode="json")
+
+
+async def register_type_detail(register_type_document: dict) -> dict:
+    """Тип в ответе API со статусом построения вторичных индексов его полей"""
+    response = document_to_response(register_type_document)
+    index_statuses = await FIELD_INDEX_BUILDER.status(RegisterObjectTypeModel.model_validate(register_type_document))
+    response["indexes"] = [index_status.model_dump() for index_status in index_statuses]
+    return type_response(RegisterObjectTypeDetailSchema, response)
+
+
+async def cached_register_type_detail(request: Request, cache_key: str, query: dict,
+                                      repository: MongoRegisterTypeRepository) -> Response | None:
+    """
+    Ответ с типом из кэша или из БД. Пока индексы полей типа строятся, ответ не кэшируется
+    Returns:
+        ответ или None, если тип не найден
+    """
+    cached, generation = await RESPONSE_CACHE.get(REGISTER_TYPE_NAMESPACE, cache_key)
+    if cached is None:
+        register_object = await repository.find_one_raw(query)
+        if register_object is None:
+            return None
+        response = await register_type_detail(register_object)
+        body = dumps(response)
+        cached = CachedResponse(body=body, etag=make_etag(body))
+        if all(index["status"] != "building" for index in response["indexes"]):
+            await RESPONSE_CACHE.set(REGISTER_TYPE_NAMESPACE, cache_key, cached, generation)
+    return conditional_response(request, cached)
+
+
+@router.get(
+    "/by-slug/{slug}",
+    description="Получить объект типа по slug",
+    response_model=RegisterObjectTypeDetailSchema,
+    name="get_register_object_type_by_slug"
+)
+async def get_register_type_by_slug(slug: str, request: Request,
+                                    repository: MongoRegisterTypeRepository = Depends(get_repository)):
+    response = await cached_register_type_detail(request, f"slug:{slug}", {"slug": slug}, repository)
+    if response is not None:
+        return response
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Object with slug {slug} not found")
 
 
 @router.get(
     "/{object_id}",
-    description="Получить объект типа",
-    response_model=RegisterObjectTypeResponseSchema,
+    description="Получить объект типа и статус построения вторичных индексов его полей. "
+                "Ответ содержит ETag, при совпадении с If-None-Match возвращается 304",
+    response_model=RegisterObjectTypeDetailSchema,
     name="get_register_object_type"
 )
-async def get_register_type_data(object_id: PydanticObjectId,
+async def get_register_type_data(object_id: PydanticObjectId, request: Request,
                                  repository: MongoRegisterTypeRepository = Depends(get_repository)):
-    register_object = await repository.find_one_by_id(object_id)
-    if register_object:
-        return register_object
+    response = await cached_register_type_detail(request, f"id:{object_id}", {"_id": object_id}, repository)
+    if response is not None:
+        return response
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Object with id {object_id} not found")
 
 
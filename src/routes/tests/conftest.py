@@ -1 +1,11 @@
+import pytest
+
+from library.response_cache import RESPONSE_CACHE
 from routes.tests.fixtures.fixtures import *
+
+
+@pytest.fixture(autouse=True)
+async def clear_response_cache():
+    """Кэш ответов общий для процесса, коллекции тестовой БД очищаются между тестами без его сброса"""
+    yield
+    await RESPONSE_CACHE.clear()
@@ -0,0 +1,68 @@
+"""Интеграционные тесты администрирования"""
+from http import HTTPStatus
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import app
+from database.mongo_repository import MongoDataBaseRepository
+from database.query_profiler import SLOW_QUERY_PROFILER, plan_summary
+
+
+@pytest.fixture
+def profile_all_queries(monkeypatch):
+    monkeypatch.setattr(SLOW_QUERY_PROFILER, "enabled", True)
+    monkeypatch.setattr(SLOW_QUERY_PROFILER, "threshold_ms", 0)
+    yield
+    SLOW_QUERY_PROFILER.clear()
+
+
+def test_plan_summary():
+    """Проверка разбора плана агрегации с полным просмотром коллекции"""
+    explain = {"stages": [{"$cursor": {
+        "queryPlanner": {"winningPlan": {"queryPlan": {"stage": "COLLSCAN"}}},
+        "executionStats": {"nReturned": 3, "totalDocsExamined": 100, "totalKeysExamined": 0},
+    }}]}
+    summary = plan_summary(explain)
+    assert summary["collection_scan"]
+    assert summary["stages"] == ["COLLSCAN"]
+    assert summary["docs_examined"] == 100
+    assert summary["returned"] == 3
+
+
+@pytest.mark.asyncio
+async def test_slow_queries(test_client: TestClient, profile_all_queries):
+    """Запросы дольше порога попадают в список медленных запросов с планом выполнения"""
+    await MongoDataBaseRepository().find("register_type", {"slug": "slow_query_test"})
+    await SLOW_QUERY_PROFILER.wait()
+
+    items = test_client.get(app.url_path_for("get_slow_queries")).json()["items"]
+    assert items[0]["collection"] == "register_type"
+    assert items[0]["operation"] == "find"
+    assert items[0]["command"]["filter"] == {"slug": "slow_query_test"}
+    assert items[0]["stages"]
+
+    response = test_client.delete(app.url_path_for("clear_slow_queries"))
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    assert test_client.get(app.url_path_for("get_slow_queries")).json()["items"] == []
+
+
+@pytest.mark.asyncio
+async def test_slow_aggregate_options(profile_all_queries, monkeypatch):
+    """Параметры агрегации попадают в explain, maxTimeMS - на верхний уровень команды explain"""
+    repository = MongoDataBaseRepository()
+    commands = []
+
+    async def command(explain_command):
+        commands.append(explain_command)
+        return {}
+
+    monkeypatch.setattr(repository.db, "command", command)
+    await repository.aggregate("register_type", [{"$match": {"slug": "slow_query_test"}}],
+                               allowDiskUse=True, maxTimeMS=1000)
+    await SLOW_QUERY_PROFILER.wait()
+
+    assert commands[0]["maxTimeMS"] == 1000
+    assert commands[0]["explain"]["allowDiskUse"] is True
+    assert "maxTimeMS" not in commands[0]["explain"]
+    assert SLOW_QUERY_PROFILER.records()[0].command["maxTimeMS"] == 1000
@@ -1,11 +1,22 @@
 """Интеграционные тесты регистрации типов данных в реестре"""
+import asyncio
+import json
+import httpx
 import pytest
+from beanie import PydanticObjectId
 from deepdiff import DeepDiff
 from http import HTTPStatus
 
 from app import app
 from fastapi.testclient import TestClient
 
+from config.config import SETTINGS, WebhookSubscriber
+
+from database.change_feed import CHANGE_FEED_HUB, ChangeFeedLost, change_to_event
+from database.mongo_repository import MongoDataBaseRepository
+from database.outbox import OUTBOX_COLLECTION
+from database.webhook_dispatcher import WebhookDispatcher
+
 from database.register_object_repository import MongoRegisterRepository
 from database.register_object_type_repository import MongoRegisterTypeRepository
 from models import RegisterObjectTypeModel
@@ -59,6 +70,216 @@ async def test_create_new_object_with_same_unique_fields(test_client: TestClient
     assert response.status_code == HTTPStatus.CONFLICT
 
 
+@pytest.mark.asyncio
+async def test_create_new_object_validation_error(test_client: TestClient, register_type_object_all_fields_object,
+                                                  register_object_all_fields_data: dict):
+    """Проверка валидации объекта по полям типа до записи в бд.
+    Ожидается 422 для поля неверного типа и для поля, не объявленного в типе"""
+    collection_name = register_type_object_all_fields_object.slug
+    create_url = app.url_path_for("create_register_object", slug=collection_name)
+
+    response = test_client.post(create_url, json={**register_object_all_fields_data, "float_field": "not a float"})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    response = test_client.post(create_url, json={**register_object_all_fields_data, "unknown_field": 1})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    repository = MongoRegisterRepository(collection_name)
+    assert len(list(await repository.find())) == 0
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_objects(test_client: TestClient, register_type_object_all_fields_object,
+                                   register_object_all_fields):
+    """Проверка пакетного создания объектов.
+    Ожидается создание новых объектов и ошибка дублирования для объекта с существующими уникальными полями"""
+    collection_name = register_type_object_all_fields_object.slug
+    existing_data = register_object_all_fields.model_dump(exclude={"id", "history", "notify_fields"})
+    new_objects_data = [{**existing_data, "int_field": register_object_all_fields.int_field + index}
+                        for index in range(1, 4)]
+
+    bulk_url = app.url_path_for("bulk_create_register_objects", slug=collection_name)
+    response = test_client.post(bulk_url, json=[existing_data, *new_objects_data])
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["created"] == 3
+    assert response.json()["failed"] == 1
+    assert [item["status"] for item in response.json()["items"]] == ["duplicate", "created", "created", "created"]
+
+    repository = MongoRegisterRepository(collection_name)
+    created_object = await repository.find_one_by_id(PydanticObjectId(response.json()["items"][1]["id"]))
+    assert created_object.int_field == new_objects_data[0]["int_field"]
+    # Для созданного объекта создалась начальная историческая запись
+    assert len(created_object.history) == 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_objects_ndjson(test_client: TestClient, register_type_object_all_fields_object,
+                                          register_object_all_fields_data: dict, monkeypatch):
+    """Проверка пакетного создания объектов из NDJSON.
+    Ожидается статус invalid для строки с некорректным JSON без отказа всего запроса
+    и ошибка 413 при превышении BULK_MAX_ITEMS"""
+    collection_name = register_type_object_all_fields_object.slug
+    lines = [json.dumps({**register_object_all_fields_data, "int_field": index}) for index in range(2)]
+    lines.insert(1, "{not json")
+
+    bulk_url = app.url_path_for("bulk_create_register_objects", slug=collection_name)
+    response = test_client.post(bulk_url, content="\n".join(lines).encode(),
+                                headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["created"] == 2
+    assert [item["status"] for item in response.json()["items"]] == ["created", "invalid", "created"]
+
+    monkeypatch.setattr(SETTINGS, "BULK_MAX_ITEMS", 2)
+    response = test_client.post(bulk_url, content="\n".join(lines).encode(),
+                                headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+
+@pytest.mark.asyncio
+async def test_import_objects(test_client: TestClient, register_type_object_all_fields_object,
+                              register_object_all_fields_data: dict, monkeypatch):
+    """Проверка потоковой загрузки объектов из NDJSON пачками.
+    Ожидается загрузка корректных строк и ошибки с номерами строк для некорректного JSON и неверного типа поля"""
+    collection_name = register_type_object_all_fields_object.slug
+    lines = [json.dumps({**register_object_all_fields_data, "int_field": index}) for index in range(5)]
+    lines += ["", "{not json", json.dumps({**register_object_all_fields_data, "float_field": "not a float"})]
+
+    import_url = app.url_path_for("import_register_objects", slug=collection_name)
+    response = test_client.post(import_url, params={"batch_size": 2, "concurrency": 2},
+                                content="\n".join(lines).encode(), headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["created"] == 5
+    assert response.json()["failed"] == 2
+    assert [(error["index"], error["status"]) for error in response.json()["errors"]] == [(7, "invalid"),
+                                                                                         (8, "invalid")]
+    assert response.json()["errors_omitted"] == 0
+
+    repository = MongoRegisterRepository(collection_name)
+    assert len(list(await repository.find())) == 5
+
+    # Ошибки сверх IMPORT_MAX_ERRORS только подсчитываются
+    monkeypatch.setattr(SETTINGS, "IMPORT_MAX_ERRORS", 1)
+    response = test_client.post(import_url, content="\n".join(lines[-2:]).encode(),
+                                headers={"content-type": "application/x-ndjson"})
+    assert response.json()["failed"] == 2
+    assert len(response.json()["errors"]) == 1
+    assert response.json()["errors_omitted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_import_objects_progress(test_client: TestClient, register_type_object_all_fields_object,
+                                       register_object_all_fields_data: dict, monkeypatch):
+    """Проверка потоковой выдачи хода загрузки в NDJSON.
+    Ожидается ошибка строки длиннее IMPORT_MAX_LINE_BYTES без прерывания загрузки и итоговая запись хода"""
+    monkeypatch.setattr(SETTINGS, "IMPORT_MAX_LINE_BYTES", 4096)
+    collection_name = register_type_object_all_fields_object.slug
+    lines = [json.dumps({**register_object_all_fields_data, "int_field": index}) for index in range(3)]
+    lines.insert(1, json.dumps({**register_object_all_fields_data, "str_field": "x" * 5000}))
+
+    import_url = app.url_path_for("import_register_objects", slug=collection_name)
+    response = test_client.post(import_url, params={"batch_size": 2}, content="\n".join(lines).encode(),
+                                headers={"content-type": "application/x-ndjson", "accept": "application/x-ndjson"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [(event["index"], event["status"]) for event in events if "status" in event] == [(2, "invalid")]
+    assert events[-1] == {"processed": 4, "created": 3, "failed": 1, "finished": True}
+
+
+@pytest.mark.asyncio
+async def test_sync_objects(test_client: TestClient, register_type_object_all_fields_object,
+                            register_object_all_fields):
+    """Проверка синхронизации реестра со снимком источника.
+    Снимок содержит существующий объект без изменений и новый объект. Ожидается вставка только нового объекта.
+    Повторная синхронизация с изменением нового объекта и deactivate_missing: существующий объект,
+    отсутствующий в снимке, деактивируется"""
+    collection_name = register_type_object_all_fields_object.slug
+    existing_data = register_object_all_fields.model_dump(exclude={"id", "history", "notify_fields",
+                                                                   "is_deactivated"})
+    new_object_data = {**existing_data, "int_field": register_object_all_fields.int_field + 1}
+
+    sync_url = app.url_path_for("sync_register_objects", slug=collection_name)
+    response = test_client.post(sync_url, json=[existing_data, new_object_data])
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["inserted"] == 1
+    assert response.json()["unchanged"] == 1
+    assert response.json()["updated"] == response.json()["failed"] == 0
+
+    response = test_client.post(sync_url, params={"deactivate_missing": True},
+                                json=[{**new_object_data, "float_field": 42.0}])
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["updated"] == 1
+    assert response.json()["deactivated"] == 1
+
+    repository = MongoRegisterRepository(collection_name)
+    deactivated_object: RegisterObjectModel = await repository.find_one_by_id(register_object_all_fields.id)
+    assert deactivated_object.is_deactivated
+    assert len(deactivated_object.history) == 2
+
+
+@pytest.mark.asyncio
+async def test_count_and_aggregate_objects(test_client: TestClient, register_object_all_fields,
+                                           register_type_object_all_fields_object):
+    """Проверка подсчета объектов с фильтром и группировки с метриками по полям типа"""
+    collection_name = register_type_object_all_fields_object.slug
+    count_url = app.url_path_for("count_register_objects", slug=collection_name)
+
+    response = test_client.get(count_url)
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"count": 1}
+    response = test_client.get(count_url, params={"is_deactivated": "true"})
+    assert response.json() == {"count": 0}
+
+    aggregate_url = app.url_path_for("aggregate_register_objects", slug=collection_name)
+    response = test_client.post(aggregate_url, json={"group_by": ["is_deactivated"],
+                                                     "metrics": [{"op": "count"},
+                                                                 {"op": "sum", "field": "int_field"}]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["groups"] == [{"key": {"is_deactivated": False}, "count": 1,
+                                          "sum_int_field": register_object_all_fields.int_field}]
+
+    # Метрики по строковым полям ограничены min и max
+    response = test_client.post(aggregate_url, json={"metrics": [{"op": "sum", "field": "string_field"}]})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    # Имя метрики не может совпадать со служебными полями, значения фильтра проверяются по типу поля
+    response = test_client.post(aggregate_url, json={"metrics": [{"op": "count", "name": "_id"}]})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    response = test_client.post(aggregate_url, json={"filter": {"int_field": {"$ne": None}}})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    response = test_client.post(aggregate_url,
+                                json={"filter": {"int_field__in": [register_object_all_fields.int_field]}})
+    assert response.json()["groups"][0]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_export_objects(test_client: TestClient, register_object_all_fields,
+                              register_type_object_all_fields_object):
+    """Проверка потоковой выгрузки объектов в NDJSON и CSV, с историей и без"""
+    collection_name = register_type_object_all_fields_object.slug
+    export_url = app.url_path_for("export_register_objects", slug=collection_name)
+
+    response = test_client.get(export_url, params={"batch_size": 1})
+    assert response.status_code == HTTPStatus.OK
+    lines = response.text.splitlines()
+    assert len(lines) == 1
+    exported_object = json.loads(lines[0])
+    assert exported_object["id"] == str(register_object_all_fields.id)
+    assert "history" not in exported_object
+
+    response = test_client.get(export_url, params={"include_history": True})
+    assert len(json.loads(response.text.splitlines()[0])["history"]) == 1
+
+    response = test_client.get(export_url, params={"format": "csv"})
+    assert response.status_code == HTTPStatus.OK
+    header, row = response.text.splitlines()
+    assert header.split(",")[0] == "id"
+    assert row.split(",")[0] == str(register_object_all_fields.id)
+
+    response = test_client.get(export_url, params={"format": "csv", "include_history": True})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
 @pytest.mark.asyncio
 async def test_get_object(test_client: TestClient, register_object_all_fields, register_type_object_all_fields_object):
     """Проверка получения объекта из бд"""
@@ -77,7 +298,55 @@ async def test_get_object(test_client: TestClient, register_object_all_fields, r
                     ) == {}
 
 
-# TODO: Добавить паджинацию
+@pytest.mark.asyncio
+async def test_get_object_etag(test_client: TestClient, register_object_all_fields,
+                               register_type_object_all_fields_object):
+    """Проверка условного получения объекта по ETag.
+    Ожидается 304 для актуального ETag и новый ETag после обновления объекта"""
+    collection_name = register_type_object_all_fields_object.slug
+    get_url = app.url_path_for("get_register_object", slug=collection_name, object_id=register_object_all_fields.id)
+    response = test_client.get(get_url)
+    assert response.status_code == HTTPStatus.OK
+    etag = response.headers["ETag"]
+
+    response = test_client.get(get_url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.content == b""
+
+    repository = MongoRegisterRepository(collection_name)
+    await repository.update_one(register_object_all_fields.id, {"float_field": 42.0})
+
+    response = test_client.get(get_url, headers={"If-None-Match": etag})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["ETag"] != etag
+    assert response.json()["float_field"] == 42.0
+
+
+@pytest.mark.asyncio
+async def test_get_object_cache_race(test_client: TestClient, register_object_all_fields,
+                                     register_type_object_all_fields_object, monkeypatch):
+    """Проверка заполнения кэша ответа параллельно с обновлением объекта.
+    Ожидается, что ответ, прочитанный из БД до обновления, не выдается из кэша после него"""
+    collection_name = register_type_object_all_fields_object.slug
+    get_url = app.url_path_for("get_register_object", slug=collection_name, object_id=register_object_all_fields.id)
+    find_one_versioned_raw = MongoRegisterRepository.find_one_versioned_raw
+    updates = []
+
+    async def read_then_update(repository: MongoRegisterRepository, object_id: PydanticObjectId):
+        # Обновление выполняется между чтением объекта из БД и сохранением ответа в кэше
+        result = await find_one_versioned_raw(repository, object_id)
+        if not updates:
+            updates.append(await repository.update_one(object_id, {"float_field": 42.0}))
+        return result
+
+    monkeypatch.setattr(MongoRegisterRepository, "find_one_versioned_raw", read_then_update)
+    response = test_client.get(get_url)
+    assert response.json()["float_field"] == register_object_all_fields.float_field
+
+    response = test_client.get(get_url)
+    assert response.json()["float_field"] == 42.0
+
+
 @pytest.mark.asyncio
 async def test_get_objects(test_client: TestClient, register_object_all_fields, register_type_object_all_fields_object):
     """Проверка получения списка объектов из бд"""
@@ -98,6 +367,65 @@ async def test_get_objects(test_client: TestClient, register_object_all_fields,
     assert len(list(await repository.find())) == 5
 
 
+@pytest.mark.asyncio
+async def test_get_objects_pagination(test_client: TestClient, register_object_all_fields,
+                                      register_type_object_all_fields_object):
+    """Проверка постраничного получения списка объектов.
+    Ожидается, что при обходе страниц по токену продолжения каждый объект возвращается ровно один раз"""
+    collection_name = register_type_object_all_fields_object.slug
+    repository = MongoRegisterRepository(collection_name)
+
+    base_data = register_object_all_fields.model_dump(exclude={"id", "history", "notify_fields", 'int_field'})
+    for index in range(4):
+        await repository.insert_one(RegisterObjectModel(**base_data, int_field=index))
+
+    get_url = app.url_path_for("get_register_objects", slug=collection_name)
+    received_ids = []
+    params = {"limit": 2}
+    while True:
+        response = test_client.get(get_url, params=params)
+        assert response.status_code == HTTPStatus.OK
+        page = response.json()
+        assert len(page["items"]) <= 2
+        received_ids.extend(item["id"] for item in page["items"])
+        if not page["next_cursor"]:
+            break
+        params["cursor"] = page["next_cursor"]
+
+    assert len(received_ids) == len(set(received_ids)) == 5
+
+
+@pytest.mark.asyncio
+async def test_get_objects_filter(test_client: TestClient, register_object_all_fields,
+                                  register_type_object_all_fields_object):
+    """Проверка фильтрации списка объектов по полям типа"""
+    collection_name = register_type_object_all_fields_object.slug
+    repository = MongoRegisterRepository(collection_name)
+
+    base_data = register_object_all_fields.model_dump(exclude={"id", "history", "notify_fields", 'int_field'})
+    for index in range(4):
+        await repository.insert_one(RegisterObjectModel(**base_data, int_field=index))
+
+    get_url = app.url_path_for("get_register_objects", slug=collection_name)
+    response = test_client.get(get_url, params={"int_field__in": ["1", "2"], "sort": "-int_field"})
+    assert response.status_code == HTTPStatus.OK
+    int_values = [item["int_field"] for item in response.json()["items"]]
+    assert set(int_values) == {1, 2}
+    assert int_values == sorted(int_values, reverse=True)
+
+    # Значения in не разделяются по запятым
+    response = test_client.get(get_url, params={"string_field__in": [f"{base_data['string_field']},x", "y"]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["items"] == []
+    response = test_client.get(get_url, params={"string_field__in": [base_data['string_field'], "a,b"],
+                                                "int_field__in": ["1", "2"]})
+    assert len(response.json()["items"]) == 2
+
+    # Фильтр по не объявленному в типе полю
+    response = test_client.get(get_url, params={"unknown_field": "1"})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
 @pytest.mark.asyncio
 async def test_get_non_existing_object(test_client: TestClient, register_object_all_fields,
                                        register_type_object_all_fields_object):
@@ -167,6 +495,160 @@ async def test_update_object(test_client: TestClient, register_object_all_fields
                                    "root['id']"]) == {}
 
 
+def test_change_to_event_notify_fields():
+    """Изменения попадают в ленту, только если затрагивают notify_fields объекта"""
+    change = {"_id": {"_data": "token"}, "operationType": "update", "documentKey": {"_id": PydanticObjectId()},
+              "fullDocument": {"notify_fields": ["title"], "title": "new", "size": 1},
+              "updateDescription": {"updatedFields": {"size": 1, "history.1": {}}, "removedFields": []}}
+    assert change_to_event(change, []) is None
+
+    change["updateDescription"]["updatedFields"]["title"] = "new"
+    event = change_to_event(change, [])
+    assert event.id == "token"
+    assert event.data["changed_fields"] == ["title"]
+    assert event.data["fields"] == {"title": "new"}
+
+
+@pytest.mark.asyncio
+async def test_object_events(register_object_all_fields, register_type_object_all_fields_object):
+    """Проверка ленты изменений: событие изменения notify_fields и возобновление после переподключения"""
+    collection_name = register_type_object_all_fields_object.slug
+    repository = MongoRegisterRepository(collection_name)
+    await repository.update_one(register_object_all_fields.id, {"notify_fields": ["float_field"]})
+
+    events = CHANGE_FEED_HUB.events(collection_name)
+    next_event = asyncio.ensure_future(anext(events))
+    await asyncio.sleep(1)
+    # Изменение поля не из notify_fields в ленту не попадает
+    await repository.update_one(register_object_all_fields.id, {"is_deactivated": True})
+    await repository.update_one(register_object_all_fields.id, {"float_field": 42.0})
+    event = await asyncio.wait_for(next_event, timeout=10)
+    assert event.data["id"] == register_object_all_fields.id
+    assert event.data["changed_fields"] == ["float_field"]
+    assert event.data["fields"] == {"float_field": 42.0}
+
+    await repository.update_one(register_object_all_fields.id, {"float_field": 43.0})
+    resumed_events = CHANGE_FEED_HUB.events(collection_name, last_event_id=event.id)
+    resumed_event = await asyncio.wait_for(anext(resumed_events), timeout=10)
+    assert resumed_event.data["fields"] == {"float_field": 43.0}
+    await events.aclose()
+    await resumed_events.aclose()
+
+
+@pytest.mark.asyncio
+async def test_object_events_invalidated(register_type_object_all_fields_object):
+    """Удаление коллекции закрывает ленту с ошибкой, следующая подписка открывает новую ленту"""
+    collection_name = register_type_object_all_fields_object.slug
+    events = CHANGE_FEED_HUB.events(collection_name)
+    next_event = asyncio.ensure_future(anext(events))
+    await asyncio.sleep(1)
+    await MongoDataBaseRepository().db[collection_name].drop()
+    with pytest.raises(ChangeFeedLost):
+        await asyncio.wait_for(next_event, timeout=10)
+
+    new_events = CHANGE_FEED_HUB.events(collection_name)
+    next_event = asyncio.ensure_future(anext(new_events))
+    await asyncio.sleep(1)
+    await MongoDataBaseRepository().db[collection_name].insert_one({"notify_fields": []})
+    event = await asyncio.wait_for(next_event, timeout=10)
+    assert event.operation == "insert"
+    await new_events.aclose()
+
+
+@pytest.mark.asyncio
+async def test_update_object_outbox(test_client: TestClient, register_object_all_fields,
+                                    register_type_object_all_fields_object, monkeypatch):
+    """Изменение notify_fields объекта записывается в outbox и доставляется подписчику webhook"""
+    subscriber = WebhookSubscriber(name="test", url="http://webhook.test/events")
+    monkeypatch.setattr(SETTINGS, "OUTBOX_ENABLED", True)
+    monkeypatch.setattr(SETTINGS, "WEBHOOK_SUBSCRIBERS", [subscriber])
+    collection_name = register_type_object_all_fields_object.slug
+    repository = MongoRegisterRepository(collection_name)
+    await repository.update_one(register_object_all_fields.id, {"notify_fields": ["float_field"]})
+    outbox = MongoDataBaseRepository()
+    await outbox.delete_many(OUTBOX_COLLECTION, {})
+
+    # Изменение поля не из notify_fields не записывается в outbox
+    await repository.update_one(register_object_all_fields.id, {"is_deactivated": True})
+    assert await outbox.count(OUTBOX_COLLECTION, {}) == 0
+
+    updated_object = await repository.update_one(register_object_all_fields.id, {"float_field": 42.0})
+    assert updated_object.float_field == 42.0
+    records = await outbox.find(OUTBOX_COLLECTION, {})
+    assert len(records) == 1
+    assert records[0]["object_id"] == register_object_all_fields.id
+    assert records[0]["changed_fields"] == ["float_field"]
+    assert records[0]["pending"] == ["test"]
+
+    requests = []
+
+    def webhook(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        # Первая доставка неуспешна, запись доставляется повторно
+        return httpx.Response(HTTPStatus.OK if len(requests) > 1 else HTTPStatus.SERVICE_UNAVAILABLE)
+
+    dispatcher = WebhookDispatcher([subscriber], client=httpx.AsyncClient(transport=httpx.MockTransport(webhook)))
+    assert await dispatcher.dispatch_batch(subscriber) == 1
+    assert (await outbox.find(OUTBOX_COLLECTION, {}))[0]["state"]["test"]["attempts"] == 1
+    await outbox.update_many(OUTBOX_COLLECTION, {}, {"$unset": {"state.test.next_attempt_at": ""}})
+    assert await dispatcher.dispatch_batch(subscriber) == 1
+    assert requests[-1]["events"][0]["fields"] == {"float_field": 42.0}
+    assert await outbox.count(OUTBOX_COLLECTION, {}) == 0
+
+
+async def test_bulk_create_objects_outbox(test_client: TestClient, register_type_object_all_fields_object,
+                                          register_object_all_fields, monkeypatch):
+    """Пакетное создание объектов записывает в outbox по записи на каждый созданный объект"""
+    monkeypatch.setattr(SETTINGS, "OUTBOX_ENABLED", True)
+    monkeypatch.setattr(SETTINGS, "WEBHOOK_SUBSCRIBERS", [WebhookSubscriber(name="test", url="http://webhook.test")])
+    collection_name = register_type_object_all_fields_object.slug
+    existing_data = register_object_all_fields.model_dump(exclude={"id", "history", "notify_fields"})
+    new_data = {**existing_data, "int_field": register_object_all_fields.int_field + 1}
+
+    bulk_url = app.url_path_for("bulk_create_register_objects", slug=collection_name)
+    response = test_client.post(bulk_url, json=[existing_data, new_data])
+    assert [item["status"] for item in response.json()["items"]] == ["duplicate", "created"]
+
+    records = await MongoDataBaseRepository().find(OUTBOX_COLLECTION, {"slug": collection_name})
+    assert [(str(record["object_id"]), record["operation"]) for record in records] == \
+        [(response.json()["items"][1]["id"], "insert")]
+    assert records[0]["pending"] == ["test"]
+
+
+@pytest.mark.asyncio
+async def test_sync_objects_outbox(test_client: TestClient, register_type_object_all_fields_object,
+                                   register_object_all_fields, monkeypatch):
+    """Синхронизация записывает в outbox вставку объектов и изменение их notify_fields, в том числе деактивацию"""
+    monkeypatch.setattr(SETTINGS, "OUTBOX_ENABLED", True)
+    monkeypatch.setattr(SETTINGS, "WEBHOOK_SUBSCRIBERS", [WebhookSubscriber(name="test", url="http://webhook.test")])
+    collection_name = register_type_object_all_fields_object.slug
+    repository = MongoRegisterRepository(collection_name)
+    await repository.update_one(register_object_all_fields.id, {"notify_fields": ["float_field", "is_deactivated"]})
+    outbox = MongoDataBaseRepository()
+    await outbox.delete_many(OUTBOX_COLLECTION, {})
+
+    existing_data = register_object_all_fields.model_dump(exclude={"id", "history", "notify_fields",
+                                                                   "is_deactivated"})
+    new_object_data = {**existing_data, "int_field": register_object_all_fields.int_field + 1,
+                       "notify_fields": ["float_field"]}
+    sync_url = app.url_path_for("sync_register_objects", slug=collection_name)
+    response = test_client.post(sync_url, json=[existing_data, new_object_data])
+    assert response.json()["inserted"] == 1
+    records = await outbox.find(OUTBOX_COLLECTION, {})
+    assert [record["operation"] for record in records] == ["insert"]
+    new_object_id = records[0]["object_id"]
+    await outbox.delete_many(OUTBOX_COLLECTION, {})
+
+    response = test_client.post(sync_url, params={"deactivate_missing": True},
+                                json=[{**new_object_data, "float_field": 42.0}])
+    assert response.json()["updated"] == response.json()["deactivated"] == 1
+    records = {record["object_id"]: record for record in await outbox.find(OUTBOX_COLLECTION, {})}
+    assert records[new_object_id]["changed_fields"] == ["float_field"]
+    assert records[new_object_id]["fields"] == {"float_field": 42.0}
+    assert records[register_object_all_fields.id]["changed_fields"] == ["is_deactivated"]
+    assert records[register_object_all_fields.id]["fields"] == {"is_deactivated": True}
+
+
 async def test_update_object_unique_field_error(test_client: TestClient, register_object_all_fields,
                                                 register_type_object_all_fields_object):
     """Проверка обновления уникаьного поля объекта. Ожидается 422 статус в ответе"""
@@ -178,6 +660,20 @@ async def test_update_object_unique_field_error(test_client: TestClient, registe
     assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
 
 
+async def test_update_object_empty(test_client: TestClient, register_object_all_fields,
+                                   register_type_object_all_fields_object):
+    """Проверка обновления объекта без полей. Ожидается 422 статус в ответе и отсутствие новой исторической записи"""
+    collection_name = register_type_object_all_fields_object.slug
+    update_url = app.url_path_for("update_register_object",
+                                  slug=collection_name,
+                                  object_id=register_object_all_fields.id)
+    response = test_client.patch(update_url, json={})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+    repository = MongoRegisterRepository(collection_name)
+    assert len((await repository.find_one_by_id(register_object_all_fields.id)).history) == 1
+
+
 async def test_update_object_field_error(test_client: TestClient, register_object_all_fields,
                                          register_type_object_all_fields_object):
     """Проверка обновления поля объекта не валидными данными. Ожидается 422 статус в ответе"""
@@ -255,4 +751,62 @@ async def test_get_object_history_records(test_client: TestClient, register_obje
                                object_id=register_object_all_fields.id, )
     response = test_client.get(get_url)
     assert response.status_code == HTTPStatus.OK
-    assert len(response.json()) == 5
+    assert len(response.json()["items"]) == 5
+
+
+@pytest.mark.asyncio
+async def test_get_object_history_records_collection_storage(test_client: TestClient, register_object_all_fields,
+                                                             register_type_object_all_fields_object, monkeypatch):
+    """Проверка хранения истории в отдельной коллекции. Историческая запись существующего объекта переносится
+    миграцией, затем объект обновляется 4 раза. Ожидается 5 записей в истории и пустой массив history документа"""
+    monkeypatch.setattr(SETTINGS, "HISTORY_STORAGE", "collection")
+    collection_name = register_type_object_all_fields_object.slug
+
+    repository = MongoRegisterRepository(collection_name)
+    assert await repository.migrate_embedded_history() == 1
+
+    for float_value in [1.0, 2.0, 3.0, 4.0]:
+        await repository.update_one(register_object_all_fields.id, {"float_field": float_value})
+
+    get_url = app.url_path_for("get_object_history_records_list", slug=collection_name,
+                               object_id=register_object_all_fields.id, )
+    response = test_client.get(get_url)
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.json()["items"]) == 5
+    assert response.json()["items"][-1]["float_field"] == 4.0
+
+    registry_object: RegisterObjectModel = await repository.find_one_by_id(register_object_all_fields.id)
+    assert registry_object.history == []
+
+
+@pytest.mark.asyncio
+async def test_get_object_history_records_pagination(test_client: TestClient, register_object_all_fields,
+                                                     register_type_object_all_fields_object):
+    """Проверка постраничного получения истории объекта. Создается обект, обновляется 4 раза.
+    Проверяется что при обходе по 2 записи возвращаются все 5 записей в хронологическом порядке"""
+    collection_name = register_type_object_all_fields_object.slug
+
+    repository = MongoRegisterRepository(collection_name)
+
+    for float_value in [1.0, 2.0, 3.0, 4.0]:
+        await repository.update_one(register_object_all_fields.id, {"float_field": float_value})
+
+    get_url = app.url_path_for("get_object_history_records_list", slug=collection_name,
+                               object_id=register_object_all_fields.id, )
+    history_records = []
+    params = {"limit": 2}
+    while True:
+        response = test_client.get(get_url, params=params)
+        assert response.status_code == HTTPStatus.OK
+        history_records.extend(response.json()["items"])
+        if not response.json()["next_cursor"]:
+            break
+        params["cursor"] = response.json()["next_cursor"]
+
+    assert len(history_records) == 5
+    assert [record["float_field"] for record in history_records[1:]] == [1.0, 2.0, 3.0, 4.0]
+
+    # Интервал, в который не попадает ни одна запись
+    response = test_client.get(get_url, params={"until": "2000-01-01T00:00:00Z"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["items"] == []
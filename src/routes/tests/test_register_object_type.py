@@ -6,9 +6,12 @@ from http import HTTPStatus
 from app import app
 from fastapi.testclient import TestClient
 
+from database.field_index_builder import FIELD_INDEX_BUILDER
 from database.register_object_repository import MongoRegisterRepository
 from database.register_object_type_repository import MongoRegisterTypeRepository
 from models import RegisterObjectTypeModel
+from schemas.register_object import RegisterObjectNoHistorySchema
+from schemas.register_object_type import RegisterObjectTypeResponseSchema
 
 
 @pytest.mark.asyncio
@@ -78,8 +81,43 @@ async def test_get_type(test_client: TestClient, register_type_all_fields_data):
     response = test_client.get(get_url)
 
     assert response.status_code == HTTPStatus.OK
-    assert DeepDiff(created.model_dump(), response.json(),
+    assert DeepDiff(created.model_dump(), response.json(), exclude_paths=["root['indexes']"],
                     ignore_order=True) == {}
+    assert response.json()["indexes"] == []
+
+
+@pytest.mark.asyncio
+async def test_get_type_by_slug(test_client: TestClient, register_type_all_fields_data):
+    """Проверка получения типа по slug"""
+    types_repository = MongoRegisterTypeRepository()
+    created: RegisterObjectTypeModel = await types_repository.insert_one(
+        RegisterObjectTypeModel(**register_type_all_fields_data))
+
+    response = test_client.get(app.url_path_for("get_register_object_type_by_slug", slug=created.slug))
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["id"] == str(created.id)
+
+    response = test_client.get(app.url_path_for("get_register_object_type_by_slug", slug="non_existing_slug"))
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_get_type_index_status(test_client: TestClient, register_type_all_fields_data):
+    """Проверка построения вторичного индекса поля и получения его статуса"""
+    indexed_field = register_type_all_fields_data["fields"][0]
+    indexed_field["index"] = {"kind": "descending"}
+    types_repository = MongoRegisterTypeRepository()
+    created: RegisterObjectTypeModel = await types_repository.insert_one(
+        RegisterObjectTypeModel(**register_type_all_fields_data))
+    await FIELD_INDEX_BUILDER.wait(created.slug)
+
+    get_url = app.url_path_for("get_register_object_type", object_id=created.id)
+    response = test_client.get(get_url)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["fields"][0]["index"]["kind"] == "descending"
+    assert response.json()["indexes"] == [{"field": indexed_field["name"], "name": f"field_{indexed_field['name']}",
+                                           "status": "ready", "error": None}]
 
 
 @pytest.mark.asyncio
@@ -212,3 +250,25 @@ async def test_update_object_with_bad_new_fields_list(test_client: TestClient, r
         "type": "bool"
     }, ]})
     assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+async def test_raw_responses_match_models(test_client: TestClient, register_type_object_all_fields_object,
+                                          register_object_all_fields):
+    """Ответы, сериализованные без response_model, совпадают с ответами по схемам для тех же документов"""
+    types_repository = MongoRegisterTypeRepository()
+    # Поле, которого нет в схеме ответа, не попадает в ответ
+    await types_repository._repository.update_one(types_repository.collection_name,
+                                                  {"_id": register_type_object_all_fields_object.id},
+                                                  {"$set": {"internal": True}})
+    type_document = await types_repository.find_one_raw({"_id": register_type_object_all_fields_object.id})
+    response = test_client.get(app.url_path_for("get_register_object_type_list"))
+    assert response.json() == [RegisterObjectTypeResponseSchema.model_validate(
+        {**type_document, "id": type_document["_id"]}).model_dump(mode="json")]
+
+    slug = register_type_object_all_fields_object.slug
+    object_document = await MongoRegisterRepository(slug).find_one_raw({"_id": register_object_all_fields.id})
+    response = test_client.get(app.url_path_for("get_register_object", slug=slug,
+                                                 object_id=register_object_all_fields.id))
+    assert response.json() == RegisterObjectNoHistorySchema.model_validate(
+        {**object_document, "id": object_document["_id"]}).model_dump(mode="json", exclude={"_id"})
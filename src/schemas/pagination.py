@@ -0,0 +1,11 @@
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar('T')
+
+
+class Page(BaseModel, Generic[T]):
+    """Страница выборки с токеном продолжения для получения следующей страницы"""
+    items: list[T]
+    next_cursor: str | None = None
@@ -1,11 +1,15 @@
 import typing
 from typing import Any, Literal
 
-from pydantic import BaseModel, Field
+from cachetools import LRUCache
+from pydantic import BaseModel, Field, ConfigDict, StrictStr, StrictBool, model_validator
+from typing_extensions import Self
 from pydantic.main import IncEx
 from pydantic_core import PydanticUndefined
 
 from library.pydantic.fields import PyObjectId
+from library.pydantic.models_generator import create_strict_model
+from models.register_object_type import RegisterObjectTypeModel
 
 
 class CreateRegisterObjectSchema(BaseModel):
@@ -22,6 +26,38 @@ class UpdateRegisterObjectSchema(BaseModel):
         extra = 'allow'
 
 
+class StrictRegisterObjectSchema(BaseModel):
+    """Базовая схема для моделей, генерируемых по полям типа реестра. Неизвестные поля запрещены"""
+    model_config = ConfigDict(extra='forbid')
+
+    notify_fields: list[StrictStr] = []
+    is_deactivated: StrictBool = False
+
+
+_compiled_schemas: LRUCache = LRUCache(maxsize=1024)
+
+
+def compile_register_object_schemas(type_object: RegisterObjectTypeModel) -> tuple[type[BaseModel], type[BaseModel]]:
+    """
+    Схемы создания и обновления объектов типа реестра со строгой валидацией полей типа.
+    Схемы кэшируются по slug и версии полей типа
+    Returns:
+        схема создания и схема обновления (все поля необязательные)
+    """
+    cache_key = (type_object.slug, type_object.fields_version())
+    if cache_key not in _compiled_schemas:
+        create_schema = create_strict_model(
+            f"Create_{type_object.slug}",
+            {field.name: (field.type.python_type(), not field.optional) for field in type_object.fields},
+            StrictRegisterObjectSchema)
+        update_schema = create_strict_model(
+            f"Update_{type_object.slug}",
+            {field.name: (field.type.python_type(), False) for field in type_object.fields},
+            StrictRegisterObjectSchema)
+        _compiled_schemas[cache_key] = (create_schema, update_schema)
+    return _compiled_schemas[cache_key]
+
+
 class RegisterObjectNoHistorySchema(BaseModel):
     id: PyObjectId
     notify_fields: list[str] | None = []
@@ -30,3 +66,78 @@ class RegisterObjectNoHistorySchema(BaseModel):
 
     class Config:
         extra = 'allow'
+
+
+class BulkItemResultSchema(BaseModel):
+    index: int | None
+    status: Literal['created', 'duplicate', 'invalid', 'error']
+    id: PyObjectId | None = None
+    detail: Any = None
+
+
+class BulkCreateResultSchema(BaseModel):
+    created: int
+    failed: int
+    items: list[BulkItemResultSchema]
+
+
+# Имя метрики агрегации - имя поля результата $group: не может начинаться с '_' или '$' и содержать '.'
+METRIC_NAME_PATTERN = r'^[A-Za-z][A-Za-z0-9_]*$'
+
+
+class AggregateMetricSchema(BaseModel):
+    op: Literal['count', 'sum', 'avg', 'min', 'max']
+    field: str | None = None
+    name: str | None = Field(default=None, pattern=METRIC_NAME_PATTERN,
+                             description='Имя метрики в результате, по умолчанию <op>_<field>')
+
+    @model_validator(mode='after')
+    def check_field(self) -> Self:
+        if self.op != 'count' and self.field is None:
+            raise ValueError(f"Operation {self.op} requires a field")
+        return self
+
+    def output_name(self) -> str:
+        if self.name:
+            return self.name
+        return self.op if self.op == 'count' else f"{self.op}_{self.field}"
+
+
+class AggregateRequestSchema(BaseModel):
+    filter: dict[str, Any] = Field(default={}, description='Условия отбора вида {"field__op": value}, '
+                                                            'операторы те же, что в фильтрах списка объектов')
+    group_by: list[str] = []
+    metrics: list[AggregateMetricSchema] = Field(default=[AggregateMetricSchema(op='count')], min_length=1)
+    limit: int = Field(default=1000, ge=1, le=10000, description='Максимальное количество групп')
+
+
+class CountResultSchema(BaseModel):
+    count: int
+
+
+class AggregateResultSchema(BaseModel):
+    groups: list[dict[str, Any]]
+
+
+class ImportProgressSchema(BaseModel):
+    processed: int
+    created: int
+    failed: int
+    finished: bool = False
+
+
+class ImportResultSchema(BaseModel):
+    processed: int
+    created: int
+    failed: int
+    errors: list[BulkItemResultSchema]
+    errors_omitted: int = Field(default=0, description='Количество ошибок, не вошедших в errors')
+
+
+class SyncResultSchema(BaseModel):
+    inserted: int
+    updated: int
+    unchanged: int
+    deactivated: int
+    failed: int
+    errors: list[BulkItemResultSchema]
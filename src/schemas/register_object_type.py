@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Literal
 
 from pydantic import BaseModel, model_validator, Field, constr
 from typing_extensions import Self
@@ -24,6 +25,13 @@ class UpdateRegisterObjectTypeSchema(BaseModel):
         }
 
 
+class FieldIndexStatusSchema(BaseModel):
+    field: str
+    name: str
+    status: Literal['ready', 'building', 'failed', 'missing']
+    error: str | None = None
+
+
 class RegisterObjectTypeResponseSchema(BaseModel):
     id: PyObjectId
     name: str
@@ -34,6 +42,10 @@ class RegisterObjectTypeResponseSchema(BaseModel):
     slug: str
 
 
+class RegisterObjectTypeDetailSchema(RegisterObjectTypeResponseSchema):
+    indexes: list[FieldIndexStatusSchema]
+
+
 class CreateRegisterObjectTypeSchema(BaseModel):
     name: str
     description: str | None
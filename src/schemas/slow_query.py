@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class SlowQuerySchema(BaseModel):
+    collection: str
+    operation: Literal['find', 'aggregate']
+    duration_ms: float
+    recorded_at: datetime
+    # Параметры команды (filter, sort, pipeline и т.д.) в расширенном JSON
+    command: dict
+    stages: list[str]
+    indexes: list[str]
+    collection_scan: bool
+    docs_examined: int | None = None
+    keys_examined: int | None = None
+    returned: int | None = None
+    explain_time_ms: int | None = None
+
+
+class SlowQueriesSchema(BaseModel):
+    enabled: bool
+    threshold_ms: float
+    items: list[SlowQuerySchema]